@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Measures latency and allocations of the full Sparrow.__call__ path.
+
+    python benchmarks/bench_call.py [calls]
+"""
+import io
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from request import request
+from response import response
+
+CALLS = 20000
+
+app = Sparrow()
+
+
+@app.route('/hello')
+def hello():
+    return 'Hello World!'
+
+
+@app.route('/user/:name')
+def user(name):
+    return 'Hello %s' % name
+
+
+@app.route('/json')
+def as_json():
+    return {'path': request.path, 'agent': request.environ.get('HTTP_USER_AGENT')}
+
+
+@app.route('/headers')
+def headers():
+    response.header['X-Frame-Options'] = 'DENY'
+    response.header['Cache-Control'] = 'no-cache'
+    response.set_cookie('session', 'abc', path='/')
+    return 'ok'
+
+
+SCENARIOS = ('/hello', '/user/sparrow', '/json', '/headers', '/missing')
+
+
+def environ(path):
+    return {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+            'HTTP_USER_AGENT': 'bench', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr}
+
+
+def start_response(status, headers):
+    pass
+
+
+def allocations(env, calls):
+    """
+    Average bytes allocated on top of the baseline while serving a single
+    request (the tracemalloc peak), and bytes left behind per request.
+    """
+    app(dict(env), start_response)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    total = 0
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        for chunk in app(dict(env), start_response):
+            pass
+        total += tracemalloc.get_traced_memory()[1] - current
+    retained = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return total / calls, retained / calls
+
+
+def run(calls=CALLS):
+    print('%-16s %12s %12s %12s' % ('path', 'usec/call', 'peak B', 'retained B'))
+    for path in SCENARIOS:
+        env = environ(path)
+
+        def call():
+            for chunk in app(dict(env), start_response):
+                pass
+
+        best = min(timeit.repeat(call, number=calls, repeat=5))
+        peak, retained = allocations(env, 1000)
+        print('%-16s %12.2f %12.1f %12.1f'
+              % (path, best / calls * 1e6, peak, retained))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if sys.argv[1:] else CALLS)
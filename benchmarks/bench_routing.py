@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the routing engines on tables of dynamic routes.
+
+    python benchmarks/bench_routing.py [sizes...]
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from routing import ROUTERS
+
+SIZES = (10, 100, 1000)
+LOOKUPS = 2000
+
+
+def handler(**kargs):
+    return kargs
+
+
+def build(name, size):
+    router = ROUTERS[name]()
+    urls = []
+    for i in range(size):
+        kind = i % 4
+        if kind == 0:
+            router.add('GET', 'api/res%d/:id' % i, handler)
+            urls.append('api/res%d/%d' % (i, i))
+        elif kind == 1:
+            router.add('GET', 'api/res%d/:id/items/:item' % i, handler)
+            urls.append('api/res%d/%d/items/x%d' % (i, i, i))
+        elif kind == 2:
+            router.add('GET', 'api/res%d/:id#[0-9]+#.json' % i, handler)
+            urls.append('api/res%d/%d.json' % (i, i))
+        else:
+            router.add('GET', 'api/res%d/:id#int/files/:name#path' % i, handler)
+            urls.append('api/res%d/%d/files/a/b%d.txt' % (i, i, i))
+    return router, urls
+
+
+def run(sizes=SIZES):
+    print('%-8s %8s %14s' % ('router', 'routes', 'usec/lookup'))
+    for size in sizes:
+        for name in sorted(ROUTERS):
+            router, urls = build(name, size)
+            rnd = random.Random(size)
+            sample = [rnd.choice(urls) for _ in range(LOOKUPS)]
+            match = router.match
+
+            def lookups():
+                for url in sample:
+                    match(url, 'GET')
+
+            best = min(timeit.repeat(lookups, number=1, repeat=5))
+            print('%-8s %8d %14.2f' % (name, size, best / LOOKUPS * 1e6))
+
+
+if __name__ == '__main__':
+    run([int(x) for x in sys.argv[1:]] or SIZES)
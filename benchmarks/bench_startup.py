@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Measures worker startup: time and memory from importing sparrow to the first
+served request, with and without Sparrow.freeze().
+
+Every case runs in a fresh interpreter. 'cold' builds the app in the
+process that serves; 'fork' builds it in a master that forks one worker, as
+server.py --preload does, and reports the worker's time to its first
+response and the memory it does not share with the master after a GC pass.
+
+    python benchmarks/bench_startup.py [routes] [-r repeat]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sparrow')
+
+
+def memory():
+    """ Returns (rss, private) of this process in MB, private if known. """
+    rss = private = None
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if name == 'Rss':
+                    rss = int(value.split()[0]) / 1024.0
+                elif name in ('Private_Clean', 'Private_Dirty'):
+                    private = (private or 0) + int(value.split()[0]) / 1024.0
+    except (OSError, ValueError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return rss, private
+
+
+def serve_first(app, path):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+               'wsgi.errors': sys.stderr}
+    return b''.join(app(environ, lambda status, headers: None))
+
+
+def child(mode, routes, frozen):
+    import time
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from sparrow import Sparrow
+    imported = time.perf_counter()
+    app = Sparrow()
+    for i in range(routes):
+        kind = i % 4
+        if kind == 0:
+            app.add_route('/api/res%d/list' % i, lambda: 'list')
+        elif kind == 1:
+            app.add_route('/api/res%d/:id#int' % i, lambda id: {'id': id})
+        elif kind == 2:
+            app.add_route('/api/res%d/:id/items/:item' % i, lambda id, item: item)
+        else:
+            app.add_route('/api/res%d/:id#[0-9]+#.json' % i, lambda id: {'id': id})
+    built = time.perf_counter()
+    if frozen:
+        app.freeze()
+    ready = time.perf_counter()
+    result = {'import': imported - start, 'build': built - imported,
+              'freeze': ready - built}
+    path = '/api/res%d/7' % (1 if routes > 1 else 0)
+    if mode == 'cold':
+        serve_first(app, path)
+        result['first'] = time.perf_counter() - start
+        result['rss'], result['private'] = memory()
+        print(json.dumps(result))
+        return
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        forked = time.perf_counter()
+        serve_first(app, path)
+        first = time.perf_counter() - forked
+        for _ in range(1000):
+            serve_first(app, path)
+        import gc
+        gc.collect() # touches every tracked object that was not frozen
+        rss, private = memory()
+        os.write(write, json.dumps({'first': first, 'rss': rss,
+                                    'private': private}).encode('utf8'))
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        result.update(json.loads(f.read()))
+    os.waitpid(pid, 0)
+    print(json.dumps(result))
+
+
+def run(routes, repeat):
+    print('%-5s %-7s %9s %9s %9s %10s %9s %11s' % (
+        'mode', 'frozen', 'import ms', 'build ms', 'freeze ms', 'first ms',
+        'rss MB', 'private MB'))
+    for mode in ('cold', 'fork'):
+        for frozen in (False, True):
+            runs = []
+            for _ in range(repeat):
+                out = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), '--child', mode,
+                     '--frozen' if frozen else '--thawed', str(routes)])
+                runs.append(json.loads(out.decode('utf8').strip().splitlines()[-1]))
+            best = min(runs, key=lambda r: r['first'])
+            private = best['private']
+            print('%-5s %-7s %9.1f %9.1f %9.1f %10.2f %9.1f %11s' % (
+                mode, frozen, best['import'] * 1e3, best['build'] * 1e3,
+                best['freeze'] * 1e3, best['first'] * 1e3, best['rss'],
+                '%.1f' % private if private is not None else '-'))
+    print('first: from import (cold) or from fork (fork) to the first response')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('routes', nargs='?', type=int, default=1000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--child', choices=('cold', 'fork'))
+    parser.add_argument('--frozen', dest='frozen', action='store_true')
+    parser.add_argument('--thawed', dest='frozen', action='store_false')
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args.child, args.routes, args.frozen)
+    else:
+        run(args.routes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
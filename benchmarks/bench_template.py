@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Renders realistic SimpleTemplate pages with and without the translate
+optimisation pass.
+
+    python benchmarks/bench_template.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from template import SimpleTemplate
+
+HEADER = """<html>
+<head>
+  <title>{{title}}</title>
+  <link rel="stylesheet" href="/static/site.css">
+</head>
+<body>
+<div id="nav">
+% for name, link in nav:
+  <a href="{{link}}">{{name}}</a>
+% end
+</div>
+"""
+
+REPORT = """% include {header} title=title, nav=nav
+<h1>{{title}}</h1>
+<p>Generated for {{user['name']}} ({{user['email']}})</p>
+<table class="report">
+  <thead>
+    <tr><th>#</th><th>Name</th><th>Amount</th><th>Status</th></tr>
+  </thead>
+  <tbody>
+% for i, row in enumerate(rows):
+    <tr class="{{ 'odd' if i % 2 else 'even' }}">
+      <td>{{i}}</td>
+      <td>{{row['name']}}</td>
+      <td>{{ '%.2f' % row['amount'] }}</td>
+%   if row['ok']:
+      <td class="ok">ok</td>
+%   else:
+      <td class="fail">failed</td>
+%   end
+    </tr>
+% end
+  </tbody>
+</table>
+<p>{{len(rows)}} rows</p>
+</body>
+</html>
+"""
+
+ARGS = {
+    'title': 'Monthly report',
+    'nav': [('Home', '/'), ('Reports', '/reports'), ('Settings', '/settings')],
+    'user': {'name': 'Jane', 'email': 'jane@example.com'},
+    'rows': [{'name': 'item %d' % i, 'amount': i * 1.5, 'ok': i % 3 != 0}
+             for i in range(500)],
+}
+
+
+def run():
+    directory = tempfile.mkdtemp()
+    try:
+        header = os.path.join(directory, 'header.tpl')
+        with open(header, 'w') as f:
+            f.write(HEADER)
+        source = REPORT.replace('{header}', header)
+        print('%-10s %-8s %12s' % ('optimize', 'mode', 'msec/page'))
+        for optimize in (False, True):
+            SimpleTemplate.optimize = optimize
+            tpl = SimpleTemplate(template=source)
+            assert ''.join(tpl.render(**ARGS)) == ''.join(tpl.stream(**ARGS))
+            for mode, func in (('render', lambda: ''.join(tpl.render(**ARGS))),
+                               ('stream', lambda: ''.join(tpl.stream(**ARGS)))):
+                best = min(timeit.repeat(func, number=30, repeat=15)) / 30
+                print('%-10s %-8s %12.3f' % (optimize, mode, best * 1000))
+    finally:
+        SimpleTemplate.optimize = True
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run()
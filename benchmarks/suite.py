@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmarks of the WSGI stack.
+
+In process, every scenario calls Sparrow.__call__ with a synthetic environ;
+with --socket the same application is served by sparrow/server.py in a
+child process and driven over HTTP. Reports requests/sec, p50/p99 latency
+and (in process) the bytes allocated per request, and can store results as
+JSON and compare them against an earlier run:
+
+    python benchmarks/suite.py -o before.json
+    python benchmarks/suite.py -c before.json
+    python benchmarks/suite.py --socket --mode async -k json
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SPARROW = os.path.join(HERE, '..', 'sparrow')
+sys.path.insert(0, SPARROW)
+
+from sparrow import Sparrow
+from request import request
+from template import TEMPLATES, template
+from utilities import send_file
+
+TABLE_SIZES = (10, 100, 1000)
+DEFAULT_SIZE = 100
+DATA = os.path.join(tempfile.gettempdir(), 'sparrow-bench-%d' % os.getuid())
+
+HEADER = """<html><head><title>{{title}}</title></head><body>
+<ul>
+% for name in nav:
+  <li><a href="/{{name}}">{{name}}</a></li>
+% end
+</ul>
+"""
+
+PAGE = """% include header title=title, nav=nav
+<table>
+% for i, row in enumerate(rows):
+  <tr class="{{'odd' if i % 2 else 'even'}}"><td>{{i}}</td><td>{{row['name']}}</td><td>{{row['amount']}}</td></tr>
+% end
+</table>
+</body></html>
+"""
+
+ROWS = [{'name': 'item %d' % i, 'amount': i * 1.5} for i in range(100)]
+NAV = ['home', 'reports', 'settings', 'help']
+
+
+def prepare_data():
+    """ Writes the template and static files the scenarios use. """
+    os.makedirs(DATA, exist_ok=True)
+    for name, content in (('header.tpl', HEADER), ('page.tpl', PAGE),
+                          ('static.txt', 'x' * 16384)):
+        with open(os.path.join(DATA, name), 'w') as f:
+            f.write(content)
+    if DATA not in TEMPLATES.lookup:
+        TEMPLATES.lookup.insert(0, DATA)
+
+
+def make_app(size=100):
+    """ An application with size dynamic routes plus the scenario routes. """
+    prepare_data()
+    app = Sparrow()
+    for i in range(size):
+        app.add_route('/api/res%d/:id' % i, lambda id: 'resource %s' % id)
+
+    @app.route('/static')
+    def static():
+        return 'static route'
+
+    @app.route('/query')
+    def query():
+        return 'page %s of %s' % (request.GET.get('page'), request.COOKIES.get('session'))
+
+    @app.route('/upload', method='POST')
+    def upload():
+        return 'got %d fields' % len(request.POST)
+
+    @app.route('/json')
+    def as_json():
+        return {'id': 42, 'name': 'sparrow', 'tags': ['a', 'b', 'c'],
+                'nested': {'x': 1.5, 'y': None, 'z': True}}
+
+    @app.route('/template')
+    def page():
+        return template('page', title='Report', nav=NAV, rows=ROWS)
+
+    @app.route('/file')
+    def static_file():
+        send_file('static.txt', root=DATA)
+
+    @app.route('/boom')
+    def boom():
+        raise ValueError('benchmark error')
+
+    return app
+
+
+app = make_app(int(os.environ.get('SPARROW_BENCH_ROUTES', DEFAULT_SIZE)))
+
+COOKIES = '; '.join('c%d=value%d' % (i, i) for i in range(30)) + '; session=abc123'
+BOUNDARY = 'sparrowbench'
+MULTIPART = ('--{b}\r\nContent-Disposition: form-data; name="title"\r\n\r\nhello\r\n'
+             '--{b}\r\nContent-Disposition: form-data; name="tags"\r\n\r\na,b,c\r\n'
+             '--{b}\r\nContent-Disposition: form-data; name="file"; filename="f.bin"\r\n'
+             'Content-Type: application/octet-stream\r\n\r\n'.format(b=BOUNDARY).encode()
+             + b'\x00' * 65536 + ('\r\n--%s--\r\n' % BOUNDARY).encode())
+
+# name: (method, path, query, headers, body, uses the route table)
+SCENARIOS = {
+    'static': ('GET', '/static', '', {}, b'', True),
+    'dynamic': ('GET', '/api/res{last}/42', '', {}, b'', True),
+    'query_cookies': ('GET', '/query', 'page=3&sort=name&filter=active',
+                      {'Cookie': COOKIES}, b'', False),
+    'multipart': ('POST', '/upload', '',
+                  {'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY},
+                  MULTIPART, False),
+    'json': ('GET', '/json', '', {}, b'', False),
+    'template': ('GET', '/template', '', {}, b'', False),
+    'send_file': ('GET', '/file', '', {}, b'', False),
+    'not_found': ('GET', '/missing', '', {}, b'', False),
+    'error_500': ('GET', '/boom', '', {}, b'', False),
+}
+
+
+def cases(selected, sizes):
+    """ Yields (label, size, scenario) for the selected scenarios. """
+    for name, scenario in SCENARIOS.items():
+        if selected and not any(k in name for k in selected):
+            continue
+        if scenario[5]:
+            for size in sizes:
+                yield '%s@%d' % (name, size), size, scenario
+        else:
+            yield name, None, scenario
+
+
+def environ(scenario, size, errors):
+    method, path, query, headers, body, _ = scenario
+    env = {'REQUEST_METHOD': method, 'PATH_INFO': path.format(last=(size or 1) - 1),
+           'QUERY_STRING': query, 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+           'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+           'wsgi.errors': errors, 'CONTENT_LENGTH': str(len(body))}
+    for key, value in headers.items():
+        key = key.upper().replace('-', '_')
+        env[key if key == 'CONTENT_TYPE' else 'HTTP_' + key] = value
+    return env
+
+
+def start_response(status, headers):
+    pass
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+
+def summarize(latencies, elapsed):
+    latencies.sort()
+    return {'requests': len(latencies), 'rps': len(latencies) / elapsed,
+            'p50_us': percentile(latencies, 50) / 1e3,
+            'p99_us': percentile(latencies, 99) / 1e3}
+
+
+def run_in_process(selected, requests, sizes, repeat=3):
+    results = {}
+    apps = {}
+    errors = io.StringIO()
+    for label, size, scenario in cases(selected, sizes):
+        if size not in apps:
+            apps[size] = make_app(size) if size else app
+        target = apps[size]
+        base = environ(scenario, size, errors)
+        body = scenario[4]
+
+        def call():
+            env = dict(base)
+            env['wsgi.input'] = io.BytesIO(body)
+            for chunk in target(env, start_response):
+                pass
+            errors.seek(0)
+            errors.truncate()
+
+        for _ in range(min(200, requests)):
+            call()
+        clock = time.perf_counter_ns
+        result = None
+        for _ in range(repeat): # keep the fastest round
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(requests):
+                t = clock()
+                call()
+                latencies.append(clock() - t)
+            current = summarize(latencies, time.perf_counter() - started)
+            if result is None or current['rps'] > result['rps']:
+                result = current
+
+        samples = min(500, requests)
+        tracemalloc.start()
+        total = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            call()
+            total += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        result['alloc_bytes'] = total / samples
+        results[label] = result
+        report(label, result)
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_socket(selected, requests, sizes, mode, concurrency):
+    """ Starts one server per route table size and drives its scenarios. """
+    groups = {}
+    for case in cases(selected, sizes):
+        groups.setdefault(case[1] or DEFAULT_SIZE, []).append(case)
+    results = {}
+    for size, group in sorted(groups.items()):
+        port = free_port()
+        env = dict(os.environ, SPARROW_BENCH_ROUTES=str(size),
+                   PYTHONPATH=os.pathsep.join([SPARROW, HERE]))
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(SPARROW, 'server.py'), 'serve', 'suite:app',
+             '-b', '127.0.0.1:%d' % port, '-w', '1', '-m', mode],
+            env=env, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(port)
+            for label, case_size, scenario in group:
+                result = drive(port, scenario, size, requests, concurrency)
+                results[label] = result
+                report(label, result)
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def wait_for(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server did not start on port %d' % port)
+
+
+def drive(port, scenario, size, requests, concurrency):
+    method, path, query, headers, body, _ = scenario
+    url = path.format(last=(size or 1) - 1) + ('?' + query if query else '')
+    latencies = []
+    per_client = max(1, requests // concurrency)
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        mine = []
+        for _ in range(per_client):
+            t = time.perf_counter_ns()
+            try:
+                conn.request(method, url, body=body or None, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.getheader('Connection', '').lower() == 'close' or resp.version == 10:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port)
+                continue
+            mine.append(time.perf_counter_ns() - t)
+        conn.close()
+        latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = summarize(latencies, time.perf_counter() - started)
+    result['alloc_bytes'] = None
+    return result
+
+
+def report(label, result):
+    alloc = result['alloc_bytes']
+    print('%-22s %10.0f %10.1f %10.1f %12s' % (
+        label, result['rps'], result['p50_us'], result['p99_us'],
+        '-' if alloc is None else '%.0f' % alloc))
+    sys.stdout.flush()
+
+
+def compare(results, baseline):
+    print('\n%-22s %12s %12s %12s' % ('vs. baseline', 'rps', 'p99', 'alloc'))
+    for label, result in results.items():
+        old = baseline.get(label)
+        if not old:
+            continue
+        def change(key):
+            if not old.get(key) or result.get(key) is None:
+                return '-'
+            delta = (result[key] - old[key]) / old[key] * 100
+            return '%+.1f%%' % delta
+        print('%-22s %12s %12s %12s' % (label, change('rps'), change('p99_us'),
+                                         change('alloc_bytes')))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--requests', type=int, default=5000)
+    parser.add_argument('-k', '--filter', action='append', default=[],
+                        help='only run scenarios whose name contains this')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='rounds per scenario in process, the fastest counts')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(TABLE_SIZES))
+    parser.add_argument('--socket', action='store_true',
+                        help='drive sparrow/server.py over HTTP instead')
+    parser.add_argument('--mode', choices=('thread', 'async'), default='thread')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    parser.add_argument('-c', '--compare', help='compare with a JSON result file')
+    args = parser.parse_args(argv)
+
+    print('%-22s %10s %10s %10s %12s' % ('scenario', 'req/s', 'p50 us', 'p99 us', 'alloc B'))
+    if args.socket:
+        results = run_socket(args.filter, args.requests, args.sizes, args.mode,
+                             args.concurrency)
+    else:
+        results = run_in_process(args.filter, args.requests, args.sizes, args.repeat)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+    if args.output:
+        meta = {'revision': git_revision(), 'python': platform.python_version(),
+                'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'socket': args.socket, 'mode': args.mode if args.socket else None,
+                'requests': args.requests, 'repeat': args.repeat}
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
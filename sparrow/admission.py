@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control for Sparrow(admission=Admission(...)): limits how many
+handlers run at once, in total and per route, and sheds the rest early.
+
+Requests over a limit wait in a bounded queue for at most timeout seconds.
+A request that finds the queue full, or whose expected wait (queue depth
+times the moving average of the handler time) exceeds the timeout, is
+rejected right away with 503 and a Retry-After header, before its handler
+costs any CPU. Cached responses are served without admission.
+
+    app = Sparrow(admission=Admission(max_inflight=32, queue_size=64,
+                                      timeout=0.5, routes={'/upload': 4}))
+    app.route('/_admission')(app.admission.endpoint)
+
+Under ASGI requests never wait: waiting would block the event loop.
+"""
+import math
+import threading
+import time
+from response import response
+
+# Weight of the newest sample in the moving average of the handler time.
+ALPHA = 0.1
+
+
+class Limiter(object):
+    """ A counting semaphore with a bounded wait queue and counters. """
+
+    def __init__(self, limit, queue_size=64, timeout=1.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.inflight = 0
+        self.waiting = 0
+        self.service_time = 0.0
+        self.admitted = self.rejected = self.timed_out = 0
+        self.cond = threading.Condition(threading.Lock())
+
+    def expected_wait(self):
+        """ Seconds a new request is expected to wait for a slot. """
+        return (self.waiting + 1) * self.service_time / self.limit
+
+    def acquire(self, block=True):
+        """
+        Takes a slot and returns 0, or returns the seconds to suggest in
+        Retry-After if the request is rejected.
+        """
+        with self.cond:
+            if self.inflight < self.limit and not self.waiting:
+                self.inflight += 1
+                self.admitted += 1
+                return 0
+            wait = self.expected_wait()
+            retry_after = max(1, int(math.ceil(wait)))
+            if not block or self.waiting >= self.queue_size or wait > self.timeout:
+                self.rejected += 1
+                return retry_after
+            deadline = time.monotonic() + self.timeout
+            self.waiting += 1
+            try:
+                while self.inflight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        self.timed_out += 1
+                        return retry_after
+                    self.cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.inflight += 1
+            self.admitted += 1
+            return 0
+
+    def release(self, elapsed=None):
+        with self.cond:
+            self.inflight -= 1
+            if elapsed is not None:
+                self.service_time += ALPHA * (elapsed - self.service_time)
+            self.cond.notify()
+
+    def info(self):
+        return {'limit': self.limit, 'inflight': self.inflight,
+                'waiting': self.waiting, 'admitted': self.admitted,
+                'rejected': self.rejected, 'timed_out': self.timed_out,
+                'service_time': self.service_time}
+
+
+class Admission(object):
+    """
+    Admission control of an application. max_inflight limits all handlers
+    (None for no limit), routes maps route labels ('/upload', the route as
+    it was added, see routing.Route.label) to limits of their own.
+    """
+
+    def __init__(self, max_inflight=None, queue_size=64, timeout=1.0, routes=None):
+        self.limiter = Limiter(max_inflight, queue_size, timeout) if max_inflight else None
+        self.routes = dict((route, Limiter(limit, queue_size, timeout))
+                           for route, limit in (routes or {}).items())
+
+    def enter(self, route, block=True):
+        """
+        Admits a request to route. Returns (ticket, 0), or (None, seconds to
+        retry after) if it is rejected. The ticket goes back to leave().
+        """
+        held = []
+        # The narrower route limit first, so no global slot is held while
+        # waiting for it.
+        for limiter in (self.routes.get(route), self.limiter):
+            if limiter is None:
+                continue
+            retry_after = limiter.acquire(block)
+            if retry_after:
+                for other in held:
+                    other.release()
+                return None, retry_after
+            held.append(limiter)
+        return (held, time.monotonic()), 0
+
+    def leave(self, ticket):
+        held, start = ticket
+        elapsed = time.monotonic() - start
+        for limiter in held:
+            limiter.release(elapsed)
+
+    def info(self):
+        """ Returns {'total': counters, 'routes': {route: counters}}. """
+        return {'total': self.limiter.info() if self.limiter else None,
+                'routes': dict((route, limiter.info())
+                               for route, limiter in self.routes.items())}
+
+    def prometheus(self):
+        """ The queue depths and counters in the Prometheus text format. """
+        lines = []
+        limiters = [('', self.limiter)] if self.limiter else []
+        limiters += sorted(self.routes.items())
+        for name, kind, key in (('in_flight', 'gauge', 'inflight'),
+                                ('queue_depth', 'gauge', 'waiting'),
+                                ('admitted_total', 'counter', 'admitted'),
+                                ('rejected_total', 'counter', 'rejected'),
+                                ('timed_out_total', 'counter', 'timed_out')):
+            lines.append('# TYPE sparrow_admission_%s %s' % (name, kind))
+            for route, limiter in limiters:
+                labels = '{route="%s"}' % route.replace('"', '\\"') if route else ''
+                lines.append('sparrow_admission_%s%s %d' % (name, labels, getattr(limiter, key)))
+        return '\n'.join(lines) + '\n'
+
+    def endpoint(self):
+        """ A request handler serving prometheus(). """
+        response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        return self.prometheus()
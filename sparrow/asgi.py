@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers that adapt ASGI scopes and messages to the WSGI-style environ the
+Request object understands.
+"""
+import io
+import sys
+
+
+class Disconnected(Exception):
+    """ The client went away before its request body was complete. """
+
+
+def asgi_environ(scope, body=b''):
+    """ Builds a WSGI environ from an ASGI http scope and the request body. """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'asgi.scope': scope,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
+
+
+async def asgi_body(receive, limit=None, length=0):
+    """
+    Reads the complete request body from an ASGI receive channel. Returns
+    None as soon as the body, or its declared length, exceeds limit bytes;
+    nothing more is read then. Raises Disconnected if the client went away.
+    """
+    if limit is not None and length > limit:
+        return None
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise Disconnected()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def asgi_send(send, status, headers, output):
+    """ Sends a status, WSGI style header pairs and a body iterable. """
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                    for name, value in headers],
+    })
+    try:
+        for chunk in output:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+    finally:
+        if hasattr(output, 'close'):
+            output.close()
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def asgi_lifespan(receive, send, on_shutdown=None):
+    """
+    Acknowledges lifespan startup and shutdown events. on_shutdown (blocking)
+    runs in a thread before shutdown is acknowledged.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if on_shutdown is not None:
+                import asyncio
+                await asyncio.get_running_loop().run_in_executor(None, on_shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
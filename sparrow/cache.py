@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import marshal
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A thread safe, size bounded mapping that evicts the least recently used
+    entry. Keeps hit/miss/eviction counters so the size can be tuned.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.data.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def info(self):
+        """ Returns the counters and the current size as a dict. """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self.data),
+                'maxsize': self.maxsize}
+
+
+class MemoryStore(object):
+    """ A per-process, size bounded store whose entries expire after ttl. """
+
+    def __init__(self, maxsize=1024):
+        self.lru = LRUCache(maxsize)
+
+    def get(self, key):
+        entry = self.lru.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self.lru.pop(key)
+            return None
+        return entry[1]
+
+    def set(self, key, value, ttl):
+        self.lru.set(key, (time.time() + ttl, value))
+
+    def clear(self):
+        self.lru.clear()
+
+
+class FileStore(object):
+    """
+    A store in a directory shared by several processes (e.g. pre-forked
+    workers). Values must be marshallable. Entries are written to a
+    temporary name and renamed; expired ones are swept every sweep_interval
+    writes, and the oldest go first when there are more than maxsize.
+    """
+
+    def __init__(self, directory, maxsize=10000, sweep_interval=256):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.sweep_interval = sweep_interval
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        import hashlib
+        return os.path.join(self.directory,
+                            hashlib.sha1(repr(key).encode('utf8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                if marshal.load(f) < time.time():
+                    return None
+                stored_key, value = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return value if stored_key == repr(key) else None
+
+    def set(self, key, value, ttl):
+        import tempfile
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # The expiry time comes first, so sweep() can skip the value
+                marshal.dump(time.time() + ttl, f)
+                marshal.dump((repr(key), value), f)
+            os.replace(tmp, self.path(key))
+        except (OSError, ValueError):
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        self.writes += 1
+        if self.writes % self.sweep_interval == 0:
+            self.sweep()
+
+    def sweep(self):
+        """ Removes expired entries, then the oldest ones above maxsize. """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    expires = marshal.load(f)
+                if expires < now:
+                    os.unlink(path)
+                else:
+                    entries.append((os.stat(path).st_mtime, path))
+            except (OSError, EOFError, ValueError, TypeError):
+                continue
+        entries.sort()
+        for mtime, path in entries[:max(0, len(entries) - self.maxsize)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Response compression for Sparrow(compress=True). List bodies are compressed
+in one go, file and generator bodies with a streaming compressor; each
+chunk of a generator is flushed, so a client sees it without waiting for the
+next one. Brotli is used when the brotli package is installed, gzip (zlib)
+otherwise.
+"""
+import zlib
+from cache import LRUCache
+from static import accepted_encodings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types that are already compressed (prefix match).
+SKIP_TYPES = ('image/', 'video/', 'audio/', 'font/woff', 'application/zip',
+              'application/gzip', 'application/x-gzip', 'application/x-bzip2',
+              'application/x-xz', 'application/x-7z-compressed',
+              'application/x-rar-compressed', 'application/pdf',
+              'application/octet-stream')
+
+
+class Compressor(object):
+    """
+    Negotiates Accept-Encoding and compresses response bodies. Compressed
+    bodies are cached, one-shot bodies by a digest of their bytes and file
+    bodies by path and ETag (which alone is not unique across URLs), so hot
+    static files and pages are compressed only once.
+    """
+
+    def __init__(self, min_size=512, level=6, brotli_quality=4,
+                 encodings=('br', 'gzip'), skip_types=SKIP_TYPES,
+                 cache_size=256, cache_max_item=1024 * 1024):
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.encodings = tuple(e for e in encodings if e != 'br' or brotli)
+        self.skip_types = tuple(skip_types)
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.cache_max_item = cache_max_item
+
+    def negotiate(self, accept_encoding):
+        """ The preferred encoding the client accepts, or None. """
+        if not accept_encoding:
+            return None
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in self.encodings:
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def compressible(self, response):
+        """
+        Responses that already carry a Content-Encoding are left alone, so a
+        stream that must not be buffered can opt out with 'identity'.
+        """
+        if response.status < 200 or response.status in (204, 206, 304):
+            return False
+        if 'Content-Encoding' in response.header:
+            return False
+        content_type = response.header['Content-Type'] or ''
+        return not content_type.startswith(self.skip_types)
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip_compress(data, self.level)
+
+    def compressobj(self, encoding):
+        """ Returns (compress(data), flush(), finish()) callables for a stream. """
+        if encoding == 'br':
+            c = brotli.Compressor(quality=self.brotli_quality)
+            return c.process, c.flush, c.finish
+        c = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+    def __call__(self, environ, response, output):
+        """ Compresses output if possible and fixes the response headers. """
+        if not self.compressible(response):
+            return output
+        length = response.header['Content-Length']
+        if isinstance(output, list):
+            length = sum(map(len, output))
+        if length is not None and int(length) < self.min_size:
+            return output
+        add_vary(response)
+        encoding = self.negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return output
+        response.header['Content-Encoding'] = encoding
+        etag = response.header['ETag']
+        if etag and not etag.startswith('W/'):
+            # The compressed body is a different representation
+            response.header['ETag'] = 'W/' + etag
+
+        if isinstance(output, list):
+            data = b''.join(output)
+            import hashlib
+            key = (hashlib.blake2b(data, digest_size=16).digest(), encoding)
+            body = self.cache.get(key) if self.cache is not None else None
+            if body is None:
+                body = self.compress(data, encoding)
+                if self.cache is not None and len(data) <= self.cache_max_item:
+                    self.cache.set(key, body)
+            response.header['Content-Length'] = str(len(body))
+            return [body]
+
+        del response.header['Content-Length']
+        key = (environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''),
+               etag, length, encoding)
+        if self.cache is not None and etag and length is not None:
+            body = self.cache.get(key)
+            if body is not None:
+                if hasattr(output, 'close'):
+                    output.close()
+                response.header['Content-Length'] = str(len(body))
+                return [body]
+            if int(length) <= self.cache_max_item:
+                return self.stream(output, encoding, key)
+        # Without a length the body is a generator, which may be a live stream
+        return self.stream(output, encoding, flush=length is None)
+
+    def stream(self, output, encoding, key=None, flush=False):
+        """
+        Compresses an iterable body chunk by chunk (and caches it). If flush,
+        every chunk is sent as soon as it is compressed.
+        """
+        compress, sync, finish = self.compressobj(encoding)
+        parts = [] if key is not None else None
+        try:
+            for chunk in output:
+                if not chunk:
+                    continue
+                data = compress(chunk)
+                if flush:
+                    data += sync()
+                if data:
+                    if parts is not None:
+                        parts.append(data)
+                    yield data
+            data = finish()
+            if parts is not None:
+                parts.append(data)
+                self.cache.set(key, b''.join(parts))
+            yield data
+        finally:
+            if hasattr(output, 'close'):
+                output.close()
+
+
+def gzip_compress(data, level=6):
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def add_vary(response):
+    vary = response.header['Vary']
+    if not vary:
+        response.header['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower() and vary.strip() != '*':
+        response.header['Vary'] = vary + ', Accept-Encoding'
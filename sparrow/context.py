@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from contextvars import ContextVar
+
+
+class ContextProxy(object):
+    """
+    Stands in for the object bound to the current context. Every thread and
+    every asyncio task sees its own object, so module level names such as
+    request and response work for WSGI workers and ASGI event loops alike.
+    """
+    __slots__ = ('_factory', '_var')
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_var',
+                           ContextVar('sparrow.%s' % factory.__name__))
+
+    def bind(self, *args):
+        """ Creates a fresh object for the current context and returns it. """
+        obj = self._factory(*args)
+        self._var.set(obj)
+        return obj
+
+    def _get_current_object(self):
+        try:
+            return self._var.get()
+        except LookupError:
+            raise RuntimeError('No %s bound to the current context.'
+                               % self._factory.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self._get_current_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_current_object(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._get_current_object(), name)
+
+    def __repr__(self):
+        try:
+            return '<%s proxy for %r>' % (self._factory.__name__, self._var.get())
+        except LookupError:
+            return '<unbound %s proxy>' % self._factory.__name__
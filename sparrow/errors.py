@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+The cheap side of error handling: default error pages are rendered once per
+status and message, and ErrorLog formats each distinct traceback once and
+counts its repeats instead of writing every one of them.
+"""
+import threading
+import time
+from cache import LRUCache
+from common import HTTP_ERROR_TEMPLATE, HTTP_CODES, TRACEBACK_TEMPLATE
+
+URL_SLOT = '\x00url\x00'
+# Longer messages (e.g. tracebacks) are rendered but not cached.
+MAX_CACHED_TEXT = 1024
+_pages = LRUCache(256)
+
+
+def render_error(status, text, url):
+    """ The default error page as str; url must be escaped already. """
+    return HTTP_ERROR_TEMPLATE % {
+        'status' : status,
+        'url' : url,
+        'error_name' : HTTP_CODES.get(status, 'Unknown').title(),
+        'error_message' : text
+    }
+
+
+def error_page(status, text, url, charset='utf8'):
+    """
+    The default error page as bytes. The encoded parts around the url are
+    cached, so only the (escaped) url is encoded per request.
+    """
+    key = (status, text, charset)
+    parts = _pages.get(key)
+    if parts is None:
+        head, tail = render_error(status, text, URL_SLOT).split(URL_SLOT, 1)
+        parts = (head.encode(charset), tail.encode(charset))
+        if len(text) <= MAX_CACHED_TEXT:
+            _pages.set(key, parts)
+    import html
+    return parts[0] + html.escape(url).encode(charset) + parts[1]
+
+
+class ErrorLog(object):
+    """
+    Writes unhandled exceptions to a stream (wsgi.errors). Exceptions of the
+    same type raised along the same code path share one formatted stack;
+    only the final line with the message is formatted for each of them.
+    Repeats within interval seconds are only counted and the count is
+    written with the next report.
+    """
+
+    def __init__(self, interval=60.0, limit=10, maxsize=256):
+        self.interval = interval
+        self.limit = limit
+        # signature -> [formatted stack, next report, suppressed repeats]
+        self.entries = LRUCache(maxsize)
+        self.lock = threading.Lock()
+
+    def signature(self, e):
+        frames = []
+        tb = e.__traceback__
+        while tb is not None:
+            frames.append((tb.tb_frame.f_code, tb.tb_lineno))
+            tb = tb.tb_next
+        return (type(e), tuple(frames))
+
+    def report(self, e, stream):
+        """ Returns the formatted traceback of e, writing it unless it is a recent repeat. """
+        import traceback
+        key = self.signature(e)
+        entry = self.entries.get(key)
+        last = traceback.format_exception_only(type(e), e)
+        if entry is None:
+            lines = traceback.format_exception(type(e), e, e.__traceback__, self.limit)
+            entry = [''.join(lines[:len(lines) - len(last)]), 0, 0]
+            self.entries.set(key, entry)
+        text = TRACEBACK_TEMPLATE % (entry[0] + ''.join(last))
+        now = time.monotonic()
+        with self.lock:
+            if now < entry[1]:
+                entry[2] += 1
+                return text
+            suppressed, entry[1], entry[2] = entry[2], now + self.interval, 0
+        message = "Unhandled Exception: %r\n" % (e,)
+        if suppressed:
+            message += "(%d more like it since the last report)\n" % suppressed
+        stream.write(message + text)
+        return text
+
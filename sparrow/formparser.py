@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental parsers for multipart/form-data and x-www-form-urlencoded
+request bodies. The body is read in fixed-size chunks and every field is
+yielded as soon as it is complete. File contents are spooled to disk above
+a threshold, and size limits are enforced with HTTPError(413).
+"""
+import re
+from tempfile import SpooledTemporaryFile
+from urllib.parse import unquote_plus
+from sparrow_exceptions import HTTPError
+
+re_option = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:\\.|[^"\\])*"|[^;]*)')
+
+
+def parse_options_header(value):
+    """ Splits 'form-data; name="a"' into ('form-data', {'name': 'a'}). """
+    main, _, rest = value.partition(';')
+    options = {}
+    for key, val in re_option.findall(';' + rest):
+        if val.startswith('"'):
+            val = re.sub(r'\\(.)', r'\1', val[1:-1])
+        options[key.lower()] = val
+    return main.strip().lower(), options
+
+
+class Part(object):
+    """
+    A single form field. File uploads keep their content in file, a
+    SpooledTemporaryFile that moves to disk above the spool threshold.
+    """
+
+    def __init__(self, name, filename=None, content_type=None, headers=None,
+                 charset='utf8', spool_threshold=512 * 1024, value=None):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.charset = charset
+        self.size = 0
+        self._value = value
+        self.file = None
+        if value is None:
+            self.file = SpooledTemporaryFile(max_size=spool_threshold)
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    @property
+    def value(self):
+        """ The decoded text of a field, or the raw bytes of an upload. """
+        if self._value is None:
+            self.file.seek(0)
+            data = self.file.read()
+            self.file.seek(0)
+            self._value = data if self.filename else data.decode(self.charset, 'replace')
+        return self._value
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class BodyReader(object):
+    """ Reads at most length bytes from a WSGI input stream in chunks. """
+
+    def __init__(self, stream, length, chunk_size=65536):
+        self.stream = stream
+        self.remaining = length
+        self.chunk_size = chunk_size
+
+    def read(self):
+        if self.remaining <= 0:
+            return b''
+        data = self.stream.read(min(self.chunk_size, self.remaining))
+        self.remaining -= len(data)
+        if not data:
+            self.remaining = 0
+        return data
+
+
+def check_part_size(part, max_part_size):
+    if max_part_size is not None and part.size > max_part_size:
+        raise HTTPError(413, 'Form field "%s" is larger than %d bytes'
+                        % (part.name, max_part_size))
+
+
+def iter_multipart(reader, boundary, charset='utf8', max_part_size=None,
+                   spool_threshold=512 * 1024, max_header_size=16384):
+    """ Yields a Part for every field of a multipart body as it completes. """
+    delimiter = b'--' + boundary.encode('latin1')
+    separator = b'\r\n' + delimiter
+    buf = reader.read()
+
+    # Skip the preamble
+    while True:
+        index = buf.find(delimiter)
+        if index >= 0:
+            buf = buf[index + len(delimiter):]
+            break
+        buf = buf[-len(delimiter):]
+        data = reader.read()
+        if not data:
+            raise HTTPError(400, 'Malformed multipart body')
+        buf += data
+
+    while True:
+        while len(buf) < 2:
+            data = reader.read()
+            if not data:
+                raise HTTPError(400, 'Malformed multipart body')
+            buf += data
+        if buf.startswith(b'--'):
+            return
+        if not buf.startswith(b'\r\n'):
+            raise HTTPError(400, 'Malformed multipart body')
+
+        # Part headers
+        while True:
+            index = buf.find(b'\r\n\r\n', 2)
+            if index >= 0:
+                break
+            if len(buf) > max_header_size:
+                raise HTTPError(413, 'Multipart headers too large')
+            data = reader.read()
+            if not data:
+                raise HTTPError(400, 'Malformed multipart body')
+            buf += data
+        headers = {}
+        for line in buf[2:index].decode(charset, 'replace').split('\r\n'):
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        buf = buf[index + 4:]
+        disposition, options = parse_options_header(headers.get('content-disposition', ''))
+        if disposition != 'form-data' or 'name' not in options:
+            raise HTTPError(400, 'Malformed multipart body')
+        part = Part(options['name'], options.get('filename'),
+                    headers.get('content-type'), headers, charset,
+                    spool_threshold)
+
+        # Part body, up to the next delimiter
+        while True:
+            index = buf.find(separator)
+            if index >= 0:
+                part.write(buf[:index])
+                buf = buf[index + len(separator):]
+                break
+            keep = len(separator) - 1
+            if len(buf) > keep:
+                part.write(buf[:-keep])
+                buf = buf[-keep:]
+            check_part_size(part, max_part_size)
+            data = reader.read()
+            if not data:
+                part.close()
+                raise HTTPError(400, 'Malformed multipart body')
+            buf += data
+        check_part_size(part, max_part_size)
+        part.file.seek(0)
+        yield part
+
+
+def iter_urlencoded(reader, charset='utf8', max_part_size=None):
+    """ Yields a Part (with a value) for every name=value pair. """
+    pending = b''
+    while True:
+        data = reader.read()
+        pending += data
+        pairs = pending.split(b'&')
+        pending = pairs.pop() if data else b''
+        if max_part_size is not None and len(pending) > max_part_size:
+            raise HTTPError(413, 'Form field is larger than %d bytes' % max_part_size)
+        for pair in pairs:
+            if not pair:
+                continue
+            if max_part_size is not None and len(pair) > max_part_size:
+                raise HTTPError(413, 'Form field is larger than %d bytes' % max_part_size)
+            name, _, value = pair.decode('latin1').partition('=')
+            yield Part(unquote_plus(name, charset), charset=charset,
+                       value=unquote_plus(value, charset))
+        if not data:
+            return
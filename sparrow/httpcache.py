@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side caching of whole responses for @app.cache() and the cache=
+route option. Entries hold the status, headers and the body that
+Sparrow.cast() produced, and carry a strong ETag so repeated requests can
+be answered with 304 Not Modified without calling the handler.
+"""
+from static import etag_matches
+
+
+class CacheRule(object):
+    """
+    Caching settings of one route. Entries are keyed by method, path, the
+    query params listed in params (the whole query string if params is None)
+    and the request headers listed in vary.
+    """
+
+    def __init__(self, store, ttl=60, vary=(), params=None):
+        self.store = store
+        self.ttl = ttl
+        self.vary = tuple(vary)
+        self.environ_keys = tuple('HTTP_' + h.upper().replace('-', '_')
+                                  for h in self.vary)
+        self.params = tuple(params) if params is not None else None
+
+    def key(self, request):
+        if self.params is None:
+            query = request.query_string
+        else:
+            query = tuple(tuple(request.GET.getall(p)) for p in self.params)
+        environ = request.environ
+        return (request.method, request.path, query,
+                tuple(environ.get(k, '') for k in self.environ_keys))
+
+    def lookup(self, request, response):
+        """
+        Returns the cached body for the request, or None. On a hit the status
+        and headers are restored; a matching If-None-Match yields 304.
+        """
+        key = self.key(request)
+        entry = self.store.get(key)
+        if entry is None:
+            return key, None
+        status, headers, body, etag = entry
+        response.header[:] = headers
+        inm = request.environ.get('HTTP_IF_NONE_MATCH')
+        if inm and etag_matches(etag, inm):
+            response.status = 304
+            del response.header['Content-Length']
+            return key, []
+        response.status = status
+        return key, [body]
+
+    def save(self, key, request, response, output):
+        """
+        Stores a cast list body of a 200 response and returns it, or [] with
+        a 304 status if the client already has this exact body.
+        """
+        if response.status != 200 or not isinstance(output, list) or response.has_cookies():
+            return output
+        cache_control = (response.header['Cache-Control'] or '').lower()
+        if 'no-store' in cache_control or 'private' in cache_control:
+            return output
+        body = b''.join(output)
+        etag = response.header['ETag']
+        if not etag:
+            import hashlib
+            etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+            response.header['ETag'] = etag
+        if self.vary:
+            vary = response.header['Vary']
+            response.header['Vary'] = ', '.join(((vary,) if vary else ()) + self.vary)
+        self.store.set(key, (response.status, list(response.header), body, etag), self.ttl)
+        inm = request.environ.get('HTTP_IF_NONE_MATCH')
+        if inm and etag_matches(etag, inm):
+            response.status = 304
+            del response.header['Content-Length']
+            return []
+        return [body]
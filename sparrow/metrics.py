@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Per-route request metrics for Sparrow(metrics=True): latency histograms for
+route matching, the handler and cast(), status code counters and an
+in-flight gauge. Every thread writes to its own shard, so recording needs
+no lock; readers merge the shards. Pre-forked workers can share a
+directory where each one dumps its numbers for the others to merge.
+
+    app = Sparrow(metrics=True)
+    app.route('/metrics')(app.metrics.endpoint)
+"""
+import marshal
+import os
+import threading
+import time
+import weakref
+from response import response
+
+PHASES = ('match', 'handler', 'cast', 'total')
+# Prometheus bucket bounds in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED = '<unmatched>'
+
+
+def bucket_index(usec):
+    """
+    Log-linear (HDR style) bucket of a latency in microseconds: exact below
+    16, then 8 buckets per power of two, so the error stays below 12.5%.
+    """
+    if usec < 16:
+        return usec
+    shift = usec.bit_length() - 4
+    return 16 + (shift - 1) * 8 + (usec >> shift) - 8
+
+
+def bucket_upper(index):
+    """ The exclusive upper bound of a bucket, in microseconds. """
+    if index < 16:
+        return index + 1
+    shift = (index - 16) // 8 + 1
+    return ((index - 16) % 8 + 9) << shift
+
+
+class Histogram(object):
+    """ Counts per bucket plus the exact count and sum (in microseconds). """
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self, counts=None, count=0, total=0):
+        self.counts = counts or {}
+        self.count = count
+        self.sum = total
+
+    def record(self, usec):
+        index = bucket_index(usec)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += usec
+
+    def merge(self, other):
+        # list() copies atomically, the owner thread may be writing
+        for index, n in list(other.counts.items()):
+            self.counts[index] = self.counts.get(index, 0) + n
+        self.count += other.count
+        self.sum += other.sum
+
+    def percentile(self, p):
+        """ An upper estimate of the p-th percentile, in seconds. """
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return bucket_upper(index) / 1e6
+        return bucket_upper(max(self.counts)) / 1e6
+
+    def cumulative(self, bounds=BUCKETS):
+        """ Counts of observations below each bound (in seconds). """
+        result = []
+        items = sorted(self.counts.items())
+        seen = i = 0
+        for bound in bounds:
+            limit = bound * 1e6
+            while i < len(items) and bucket_upper(items[i][0]) <= limit:
+                seen += items[i][1]
+                i += 1
+            result.append(seen)
+        return result
+
+    def dump(self):
+        return (self.counts, self.count, self.sum)
+
+
+class Shard(object):
+    """ The metrics written by one thread. """
+    __slots__ = ('histograms', 'statuses', 'inflight')
+
+    def __init__(self):
+        self.histograms = {}
+        self.statuses = {}
+        self.inflight = 0
+
+    def merge(self, other):
+        for key, hist in list(other.histograms.items()):
+            self.histograms.setdefault(key, Histogram()).merge(hist)
+        for key, n in list(other.statuses.items()):
+            self.statuses[key] = self.statuses.get(key, 0) + n
+        self.inflight += other.inflight
+
+    def dump(self):
+        return {'histograms': dict((key, hist.dump())
+                                   for key, hist in self.histograms.items()),
+                'statuses': dict(self.statuses), 'inflight': self.inflight}
+
+    @classmethod
+    def load(cls, data):
+        shard = cls()
+        for key, values in data['histograms'].items():
+            shard.histograms[key] = Histogram(*values)
+        shard.statuses = data['statuses']
+        shard.inflight = data['inflight']
+        return shard
+
+
+class Timer(object):
+    """ Collects the phase timestamps of one request. """
+    __slots__ = ('shard', 'route', 'start', 'matched_at', 'handled_at')
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.route = UNMATCHED
+        self.matched_at = self.handled_at = None
+        shard.inflight += 1
+        self.start = time.perf_counter_ns()
+
+    def matched(self, route):
+        self.route = route
+        self.matched_at = time.perf_counter_ns()
+
+    def handled(self):
+        self.handled_at = time.perf_counter_ns()
+
+    def finish(self, status):
+        end = time.perf_counter_ns()
+        shard = self.shard
+        shard.inflight -= 1
+        route = self.route
+        histograms = shard.histograms
+        matched = self.matched_at or self.handled_at or end
+        handled = self.handled_at or end
+        for phase, ns in (('match', matched - self.start),
+                          ('handler', handled - matched),
+                          ('cast', end - handled),
+                          ('total', end - self.start)):
+            hist = histograms.get((route, phase))
+            if hist is None:
+                hist = histograms[(route, phase)] = Histogram()
+            hist.record(ns // 1000)
+        key = (route, status)
+        shard.statuses[key] = shard.statuses.get(key, 0) + 1
+
+
+class Metrics(object):
+    """
+    Request metrics of an application. If directory is set, the merged
+    numbers of this process are written there every dump_interval seconds
+    and snapshot() adds those of the other processes.
+    """
+
+    def __init__(self, directory=None, dump_interval=5.0):
+        self.local = threading.local()
+        self.shards = []
+        self.retired = Shard()
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.next_dump = 0
+        self.started = time.time()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = Shard()
+            with self.lock:
+                self.shards.append(shard)
+            # Fold the shard of a finished thread into self.retired
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+            return shard
+
+    def _retire(self, shard):
+        with self.lock:
+            self.retired.merge(shard)
+            self.shards.remove(shard)
+
+    def timer(self):
+        """ Starts timing a request; see Timer. """
+        if self.directory and time.time() >= self.next_dump:
+            self.dump()
+        return Timer(self.shard())
+
+    def local_snapshot(self):
+        """ A Shard with the merged numbers of this process. """
+        total = Shard()
+        with self.lock:
+            for shard in [self.retired] + self.shards:
+                total.merge(shard)
+        return total
+
+    def dump(self):
+        """ Writes this process' numbers to the shared directory. """
+        self.next_dump = time.time() + self.dump_interval
+        import tempfile
+        data = marshal.dumps(self.local_snapshot().dump())
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.directory, '%d.metrics' % os.getpid()))
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def snapshot(self):
+        """ A Shard with the numbers of this and (if shared) other processes. """
+        total = self.local_snapshot()
+        if not self.directory:
+            return total
+        stale = time.time() - 3 * self.dump_interval
+        for name in os.listdir(self.directory):
+            if not name.endswith('.metrics') or name == '%d.metrics' % os.getpid():
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    shard = Shard.load(marshal.load(f))
+                if os.stat(path).st_mtime < stale:
+                    shard.inflight = 0 # the worker is gone
+            except (OSError, EOFError, ValueError, TypeError, KeyError):
+                continue
+            total.merge(shard)
+        return total
+
+    def summary(self):
+        """
+        Returns {route: {'requests': n, 'statuses': {code: n}, phase:
+        {'count', 'mean', 'p50', 'p90', 'p99'}}} with times in seconds.
+        """
+        snap = self.snapshot()
+        result = {}
+        for (route, phase), hist in snap.histograms.items():
+            entry = result.setdefault(route, {'requests': 0, 'statuses': {}})
+            entry[phase] = {'count': hist.count,
+                            'mean': hist.sum / hist.count / 1e6 if hist.count else 0.0,
+                            'p50': hist.percentile(50), 'p90': hist.percentile(90),
+                            'p99': hist.percentile(99)}
+            if phase == 'total':
+                entry['requests'] = hist.count
+        for (route, status), n in snap.statuses.items():
+            result.setdefault(route, {'requests': 0, 'statuses': {}})['statuses'][status] = n
+        return result
+
+    def prometheus(self):
+        """ The metrics in the Prometheus text exposition format. """
+        snap = self.snapshot()
+        lines = ['# HELP sparrow_request_duration_seconds Request latency by route and phase.',
+                 '# TYPE sparrow_request_duration_seconds histogram']
+        for (route, phase), hist in sorted(snap.histograms.items()):
+            labels = 'route="%s",phase="%s"' % (escape_label(route), phase)
+            for bound, n in zip(BUCKETS, hist.cumulative()):
+                lines.append('sparrow_request_duration_seconds_bucket{%s,le="%g"} %d'
+                             % (labels, bound, n))
+            lines.append('sparrow_request_duration_seconds_bucket{%s,le="+Inf"} %d'
+                         % (labels, hist.count))
+            lines.append('sparrow_request_duration_seconds_sum{%s} %.6f' % (labels, hist.sum / 1e6))
+            lines.append('sparrow_request_duration_seconds_count{%s} %d' % (labels, hist.count))
+        lines.append('# HELP sparrow_responses_total Responses by route and status code.')
+        lines.append('# TYPE sparrow_responses_total counter')
+        for (route, status), n in sorted(snap.statuses.items()):
+            lines.append('sparrow_responses_total{route="%s",status="%d"} %d'
+                         % (escape_label(route), status, n))
+        lines.append('# HELP sparrow_requests_in_flight Requests being processed.')
+        lines.append('# TYPE sparrow_requests_in_flight gauge')
+        lines.append('sparrow_requests_in_flight %d' % snap.inflight)
+        return '\n'.join(lines) + '\n'
+
+    def endpoint(self):
+        """ A request handler serving prometheus(). """
+        response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        return self.prometheus()
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
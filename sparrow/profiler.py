@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+On-demand profiling for live workers, with Sparrow(profiler=Profiler(...)):
+
+* A fraction of requests (sample_rate), or a single one sent with the
+  header 'X-Sparrow-Profile: <token>', run under cProfile. The reports of
+  the last keep requests are kept in memory.
+* sample() records the stacks of all threads every interval seconds for a
+  time window and folds them into flamegraph.pl compatible lines.
+
+Both are served by endpoint, a handler you mount under a route of your
+choice. It requires the token (as ?token= or in the header):
+
+    app = Sparrow(profiler=Profiler(token='secret'))
+    app.route('/_profile')(app.profiler.endpoint)
+
+When no profiler is set, Sparrow only pays for one 'is None' check.
+"""
+import cProfile
+import hmac
+import io
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from request import request
+from response import response
+from sparrow_exceptions import HTTPError
+
+MAX_WINDOW = 60.0
+
+
+class Profiler(object):
+
+    def __init__(self, token=None, sample_rate=0.0, header='X-Sparrow-Profile',
+                 keep=20, sort='cumulative', limit=40, interval=0.005):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.environ_key = 'HTTP_' + header.upper().replace('-', '_')
+        self.reports = deque(maxlen=keep)
+        self.sort = sort
+        self.limit = limit
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def authorized(self, value):
+        return bool(self.token and value) and hmac.compare_digest(
+            value.encode('utf8'), self.token.encode('utf8'))
+
+    def wants(self, environ):
+        """ True if this request should be profiled. """
+        if 'sparrow.profiling' in environ:
+            return False
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        return self.authorized(environ.get(self.environ_key))
+
+    def run(self, app, environ, start_response):
+        """ Calls app under cProfile and keeps the report. """
+        environ['sparrow.profiling'] = True
+        profile = cProfile.Profile()
+        start = time.time()
+        try:
+            return profile.runcall(app, environ, start_response)
+        finally:
+            out = io.StringIO()
+            stats = pstats.Stats(profile, stream=out)
+            stats.sort_stats(self.sort).print_stats(self.limit)
+            self.reports.appendleft('%s %s %s (%s)\n%s' % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start)),
+                environ.get('REQUEST_METHOD', 'GET'), environ.get('PATH_INFO', '/'),
+                environ.get('QUERY_STRING', ''), out.getvalue()))
+
+    def sample(self, seconds, interval=None):
+        """
+        Samples the stacks of all other threads for seconds and returns
+        them folded ('frame;frame;frame count' per line).
+        """
+        interval = interval or self.interval
+        seconds = min(float(seconds), MAX_WINDOW)
+        me = threading.get_ident()
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        counts = Counter()
+        # Only one window at a time; samplers would just sample each other
+        with self.lock:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        counts[fold(frame, names.get(ident, ident))] += 1
+                time.sleep(interval)
+        return ''.join('%s %d\n' % item for item in counts.most_common())
+
+    def endpoint(self):
+        """
+        A request handler: ?sample=<seconds> returns folded stacks of that
+        window, otherwise the reports of the last profiled requests.
+        """
+        token = request.GET.get('token') or request.environ.get(self.environ_key)
+        if not self.authorized(token):
+            raise HTTPError(403, 'Forbidden')
+        response.content_type = 'text/plain; charset=utf-8'
+        seconds = request.GET.get('sample', type=float)
+        if seconds:
+            return self.sample(seconds)
+        return '\n\n'.join(self.reports) or 'No profiled requests yet.\n'
+
+
+def fold(frame, thread):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.append(str(thread))
+    return ';'.join(reversed(stack))
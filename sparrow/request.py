@@ -1,80 +1,104 @@
 # -*- coding: utf-8 -*-
-import threading
-from Cookie import SimpleCookie
-import cgi
+from context import ContextProxy
+from structures import EnvironHeaders, LazyMultiDict, MultiDict, unquote_cookie
 
-class Request(threading.local):
-    def bind(self, environ):
+class Request(object):
+    """ Represents a single request. A new one is created for every call. """
+    __slots__ = ('environ', 'path', '_GET', '_POST', '_COOKIES', '_headers')
+
+    # Request body limits, in bytes. None disables a limit.
+    max_body_size = 100 * 1024 * 1024
+    max_part_size = None
+    spool_threshold = 512 * 1024
+    chunk_size = 64 * 1024
+
+    def __init__(self, environ):
         """
         绑定一个环境变量，设置GET、POST、COOKIE及path
         """
-        self._environ = environ
         self.environ = environ
         self._GET = None
         self._POST = None
         self._COOKIES = None
-        self.path = self._environ.get('PATH_INFO', '/').strip()
-        if not self.path.startswith('/'):
-            self.path = '/' + self.path
+        self._headers = None
+        path = environ.get('PATH_INFO', '/').strip()
+        self.path = path if path.startswith('/') else '/' + path
 
     @property
     def method(self):
         """
         获取请求方法，默认GET
         """
-        return self._environ.get('REQUEST_METHOD', 'GET').upper()
+        return self.environ.get('REQUEST_METHOD', 'GET').upper()
 
     @property
     def query_string(self):
         """
         获取query string，默认为空
         """
-        return self._environ.get('QUERY_STRING', '')
+        return self.environ.get('QUERY_STRING', '')
 
     @property
     def input_length(self):
         "获取输入长度，默认为0"
         try:
-            return int(self._environ.get('CONTENT_LENGTH', '0'))
+            return max(0, int(self.environ.get('CONTENT_LENGTH') or '0'))
         except ValueError:
             return 0
 
+    @property
+    def headers(self):
+        """ A case-insensitive view of the request headers. """
+        if self._headers is None:
+            self._headers = EnvironHeaders(self.environ)
+        return self._headers
+
     @property
     def GET(self):
-        """ Get a dict with GET parameters. """
+        """ A MultiDict of query parameters, parsed on demand. """
         if self._GET is None:
-            data = cgi.parse_qs(self.query_string, keep_blank_values=True)
-            self._GET = {}
-            for key, value in data.items():
-                if len(value) == 1:
-                    self._GET[key] = value[0]
-                else:
-                    self._GET[key] = value
+            self._GET = LazyMultiDict(self.query_string)
         return self._GET
 
+    def iter_parts(self):
+        """
+        Parses the request body incrementally and yields a formparser.Part
+        for every field as soon as it has been read. Bodies larger than
+        max_body_size are rejected with 413 before anything is read.
+        """
+        # Imported here: sparrow_exceptions depends on this module.
+        from formparser import BodyReader, iter_multipart, iter_urlencoded, parse_options_header
+        from sparrow_exceptions import HTTPError
+        length = self.input_length
+        if self.max_body_size is not None and length > self.max_body_size:
+            raise HTTPError(413, 'Request body is larger than %d bytes' % self.max_body_size)
+        content_type, options = parse_options_header(self.environ.get('CONTENT_TYPE', ''))
+        reader = BodyReader(self.environ['wsgi.input'], length, self.chunk_size)
+        if content_type == 'multipart/form-data':
+            if not options.get('boundary'):
+                raise HTTPError(400, 'Missing multipart boundary')
+            return iter_multipart(reader, options['boundary'],
+                                  options.get('charset', 'utf8'),
+                                  self.max_part_size, self.spool_threshold)
+        if content_type in ('application/x-www-form-urlencoded', ''):
+            return iter_urlencoded(reader, options.get('charset', 'utf8'),
+                                   self.max_part_size)
+        return iter(())
+
     @property
     def POST(self):
+        """ A MultiDict of POST form fields. File uploads are Part objects. """
         if self._POST is None:
-            data = cgi.FieldStorage(fp=self._environ['wsgi.input'],
-                environ=self._environ, keep_blank_values=True)
-            self._POST  = {}
-            for item in data.list or []:
-                name = item.name
-                if not item.filename:
-                    item = item.value
-                self._POST.setdefault(name, []).append(item)
-            for key in self._POST:
-                if len(self._POST[key]) == 1:
-                    self._POST[key] = self._POST[key][0]
+            self._POST = MultiDict((part.name, part if part.filename else part.value)
+                                   for part in self.iter_parts())
         return self._POST
 
     @property
     def COOKIES(self):
+        """ A MultiDict of request cookies, parsed on demand. """
         if self._COOKIES is None:
-            raw_dict = SimpleCookie(self._environ.get('HTTP_COOKIE',''))
-            self._COOKIES = {}
-            for cookie in raw_dict.itervalues():
-                self._COOKIES[cookie.key] = cookie.value
+            self._COOKIES = LazyMultiDict(self.environ.get('HTTP_COOKIE', ''), ';',
+                                          str.strip, unquote_cookie)
         return self._COOKIES
 
-request = Request()
\ No newline at end of file
+request = ContextProxy(Request)
\ No newline at end of file
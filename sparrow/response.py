@@ -1,45 +1,212 @@
-import threading
-from wsgiref.headers import Headers as HeaderWrapper
-from Cookie import SimpleCookie
+import re
+from cache import LRUCache
+from context import ContextProxy
 
-class Response(threading.local):
-    """ Represents a single response using thread-local namespace. """
+DEFAULT_HEADERS = (('Content-Type', 'text/html'),)
+# Header names seen so far -> title-cased; bounded, names may come from clients
+_titles = {}
+MAX_TITLES = 1024
+re_cookie_key = re.compile(r"^[\w!#$%&'*+\-.^`|~:]+$")
+_cookie_suffixes = LRUCache(256)
+_cookie_jar = None
 
-    def bind(self):
-        """ Clears old data and creates a brand new Response object """
+
+def title(name):
+    """ Returns name title-cased, as header names are stored. """
+    titled = _titles.get(name)
+    if titled is None:
+        titled = name.title()
+        if len(_titles) < MAX_TITLES:
+            _titles[name] = titled
+    return titled
+
+
+def serialize_headers(headers, base=()):
+    """
+    Returns the (name, value) pairs of base updated with headers (a dict or
+    a list of pairs) as a tuple, names title-cased and values str. Names in
+    headers replace those in base.
+    """
+    items = list(headers.items() if hasattr(headers, 'items') else headers)
+    items = [(name.title(), str(value)) for name, value in items]
+    names = set(name for name, value in items)
+    return tuple([item for item in base if item[0] not in names] + items)
+
+
+def quote_cookie(value):
+    """ Returns value quoted the way SimpleCookie writes it. """
+    global _cookie_jar
+    if _cookie_jar is None:
+        from http.cookies import SimpleCookie
+        _cookie_jar = SimpleCookie()
+    return _cookie_jar.value_encode(value)[1]
+
+
+def cookie_suffix(options):
+    """
+    The '; Path=/; HttpOnly' part of a Set-Cookie header for the
+    set_cookie() options, cached unless it depends on the time.
+    """
+    if not options:
+        return ''
+    key = tuple(sorted(options.items()))
+    suffix = _cookie_suffixes.get(key)
+    if suffix is None:
+        from http.cookies import Morsel
+        morsel = Morsel()
+        morsel.set('x', '', '')
+        for name, value in options.items():
+            morsel[name.replace('_', '-')] = value
+        suffix = morsel.OutputString()[len('x='):]
+        if not isinstance(options.get('expires'), int):
+            _cookie_suffixes.set(key, suffix)
+    return suffix
+
+
+class HeaderList(list):
+    """
+    A flat list of (name, value) pairs that is also a case-insensitive
+    mapping. Names are title-cased when set, so the list can be handed to
+    start_response() as it is.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        if not isinstance(name, str):
+            return list.__getitem__(self, name)
+        name = title(name)
+        for key, value in self:
+            if key == name:
+                return value
+        return None
+
+    def __setitem__(self, name, value):
+        if not isinstance(name, str):
+            return list.__setitem__(self, name, value)
+        name = title(name)
+        for key, old in self:
+            if key == name:
+                self[:] = [item for item in self if item[0] != name]
+                break
+        self.append((name, value if type(value) is str else str(value)))
+
+    def __delitem__(self, name):
+        if not isinstance(name, str):
+            return list.__delitem__(self, name)
+        name = title(name)
+        self[:] = [item for item in self if item[0] != name]
+
+    def __contains__(self, name):
+        if not isinstance(name, str):
+            return list.__contains__(self, name)
+        name = title(name)
+        for key, value in self:
+            if key == name:
+                return True
+        return False
+
+    def get(self, name, default=None):
+        value = self[name]
+        return default if value is None else value
+
+    def get_all(self, name):
+        name = title(name)
+        return [value for key, value in self if key == name]
+
+    def add_header(self, name, value, **params):
+        """ Adds a header without replacing existing ones (like Set-Cookie). """
+        parts = [str(value)] if value is not None else []
+        for key, param in params.items():
+            key = key.replace('_', '-')
+            parts.append(key if param is None else '%s="%s"' % (key, param))
+        self.append((title(name), '; '.join(parts)))
+
+    def keys(self):
+        return [key for key, value in self]
+
+    def values(self):
+        return [value for key, value in self]
+
+    def items(self):
+        return list(self)
+
+
+class Response(object):
+    """
+    Represents a single response. A new one is created for every call,
+    starting with headers (serialize_headers() pairs, e.g. the app's
+    default headers).
+    """
+    __slots__ = ('status', 'header', 'charset', 'error', '_COOKIES',
+                 '_set_cookies', 'deferred')
+
+    def __init__(self, headers=DEFAULT_HEADERS):
         self._COOKIES = None
+        self._set_cookies = None
+        self.deferred = None
         self.status = 200
-        self.header_list = []
-        self.header = HeaderWrapper(self.header_list)
-        self.content_type = 'text/html'
+        self.header = HeaderList(headers)
         self.error = None
         self.charset = 'utf8'
 
+    @property
+    def header_list(self):
+        return self.header
+
     def wsgiheaders(self):
         ''' Returns a wsgi conform list of header/value pairs '''
-        for c in self.COOKIES.itervalues():
-            self.header.add_header('Set-Cookie', c.OutputString())
-        return [(h.title(), str(v)) for h, v in self.header.items()]
+        # PEP 3333 asks for a real list; wsgiref rejects subclasses
+        headers = list(self.header)
+        if self._set_cookies:
+            headers.extend(('Set-Cookie', c) for c in self._set_cookies.values())
+        if self._COOKIES:
+            for c in self._COOKIES.values():
+                headers.append(('Set-Cookie', c.OutputString()))
+        return headers
+
+    def has_cookies(self):
+        return bool(self._set_cookies or self._COOKIES)
 
     @property
     def COOKIES(self):
+        """
+        A SimpleCookie for full control; its cookies are serialised on every
+        response. set_cookie() is cheaper.
+        """
         if not self._COOKIES:
+            from http.cookies import SimpleCookie
             self._COOKIES = SimpleCookie()
         return self._COOKIES
 
     def set_cookie(self, key, value, **kargs):
         """
         Sets a Cookie. Optional settings:
-        expires, path, comment, domain, max-age, secure, version, httponly
+        expires, path, comment, domain, max_age, secure, version, httponly
+        The header is built right away; the options part is cached.
         """
-        self.COOKIES[key] = value
-        for k, v in kargs.iteritems():
-            self.COOKIES[key][k] = v
+        if not re_cookie_key.match(key):
+            from http.cookies import CookieError
+            raise CookieError('Illegal key %r' % (key,))
+        if self._set_cookies is None:
+            self._set_cookies = {}
+        self._set_cookies[key] = '%s=%s%s' % (key, quote_cookie(value),
+                                              cookie_suffix(kargs))
+        if self._COOKIES and key in self._COOKIES:
+            del self._COOKIES[key]
+
+    def defer(self, fn, *args, **kargs):
+        """
+        Calls fn(*args, **kargs) after the response was sent, on the app's
+        task executor (see tasks.py).
+        """
+        if self.deferred is None:
+            self.deferred = []
+        self.deferred.append((fn, args, kargs))
 
     def get_content_type(self):
         """ Get the current 'Content-Type' header. """
         return self.header['Content-Type']
-        
+
     def set_content_type(self, value):
         if 'charset=' in value:
             self.charset = value.split('charset=')[-1].split(';')[0].strip()
@@ -47,4 +214,4 @@ class Response(threading.local):
 
     content_type = property(get_content_type, set_content_type, None,
                             get_content_type.__doc__)
-response = Response()
\ No newline at end of file
+response = ContextProxy(Response)
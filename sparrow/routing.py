@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Routing engines used by Sparrow to resolve non-static routes.
+
+Every router gets the normalised route source (e.g. "user/:id#int/:name#[a-z]+#")
+and its handler through add(), and returns (handler, params) or (None, None)
+from match(). Typed placeholders (":id#int") only match what their converter
+accepts and their values reach the handler converted.
+
+freeze() builds whatever is built lazily and makes the tables immutable; no
+routes are added afterwards.
+"""
+import re
+import threading
+
+re_simple_segment = re.compile(r'^\w*$')
+re_wildcard_segment = re.compile(r'^:[a-zA-Z_]+$')
+re_typed = re.compile(r':([a-zA-Z_]+)#([a-zA-Z_]\w*)(?=/|$)')
+re_typed_segment = re.compile(r'^:([a-zA-Z_]+)#([a-zA-Z_]\w*)$')
+
+
+class Route(object):
+    """
+    A registered route: what Sparrow hands to a router's add() and gets back
+    from match(). One handler may be mounted as several routes; options and
+    the metrics label belong to the route, not to the handler.
+    """
+    __slots__ = ('method', 'rule', 'handler', 'label', 'cache', 'headers')
+
+    def __init__(self, method, rule, handler, label=None):
+        self.method = method
+        self.rule = rule
+        self.handler = handler
+        self.label = label or '/' + rule
+        self.cache = None # an httpcache.CacheRule
+        self.headers = None # serialised headers its responses start with
+
+    def __repr__(self):
+        return '<Route %s %s -> %r>' % (self.method, self.label, self.handler)
+
+
+def to_uuid(value):
+    import uuid # only loaded by apps that use it
+    return uuid.UUID(value)
+
+
+# name -> (regular expression, to_python or None, matches within one segment)
+CONVERTERS = {
+    'int': (r'-?[0-9]+', int, True),
+    'float': (r'-?[0-9]+(?:\.[0-9]+)?', float, True),
+    'uuid': (r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+             r'[0-9a-fA-F]{4}-[0-9a-fA-F]{12}', to_uuid, True),
+    'path': (r'.+', None, False),
+}
+
+
+def register_converter(name, pattern, to_python=None, segment=True):
+    """
+    Adds a converter for ":name#<name>" placeholders. pattern must not
+    contain capturing groups; to_python gets the matched text, a ValueError
+    rejects the match. Set segment=False if pattern can match a '/'.
+    Routes using the converter must be added after it is registered.
+    """
+    CONVERTERS[name] = (pattern, to_python, segment)
+
+
+def get_converter(name):
+    try:
+        return CONVERTERS[name]
+    except KeyError:
+        raise ValueError('Unknown route converter: %r' % name)
+
+
+def route_converters(route):
+    """ Returns ((name, to_python), ...) for the typed placeholders of a route. """
+    converters = ((name, get_converter(conv)[1]) for name, conv in re_typed.findall(route))
+    return tuple(item for item in converters if item[1] is not None)
+
+
+def convert(args, converters):
+    """ Applies route_converters() to the matched args; None if one rejects its value. """
+    try:
+        for name, to_python in converters:
+            args[name] = to_python(args[name])
+    except ValueError:
+        return None
+    return args
+
+
+def compile_route(route):
+    """ Converts a route with :name placeholders into a regular expression. """
+    route = re_typed.sub(lambda m: '(?P<%s>%s)' % (m.group(1), get_converter(m.group(2))[0]),
+                         route)
+    route = re.sub(r':([a-zA-Z_]+)(?P<uniq>[^\w/])(?P<re>.+?)(?P=uniq)',
+                   r'(?P<\1>\g<re>)', route) # \1表示的是第一个匹配到的括号内内容
+                                             # \g<re> 表示的是(?<re>.+?)中的内容
+                                             # 其中,+?表示非贪婪匹配
+    return re.sub(r':([a-zA-Z_]+)', r'(?P<\1>[^/]+)', route)
+
+
+class ScanRouter(object):
+    """
+    Tries the compiled routes of a method one after another. Lookup cost
+    grows linearly with the number of routes.
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def add(self, method, route, handler):
+        regexp = re.compile('^%s$' % compile_route(route))
+        self.routes.setdefault(method, []).append([regexp, handler,
+                                                   route_converters(route)])
+
+    def match(self, url, method):
+        for regexp, handler, converters in self.routes.get(method, ()):
+            match = regexp.match(url)
+            if match:
+                args = match.groupdict()
+                if converters:
+                    args = convert(args, converters)
+                    if args is None:
+                        continue
+                return (handler, args)
+        return (None, None)
+
+    def freeze(self):
+        self.routes = dict((method, tuple(tuple(route) for route in routes))
+                           for method, routes in self.routes.items())
+
+
+class RegexpRouter(object):
+    """
+    Compiles the routes of a method into alternations, so one re.match()
+    tests many routes and finds the parameters of the winner. Matching slows
+    down with the number of groups in a pattern, so the routes are split
+    into chunks of about chunk_groups groups that are tried in order. Routes
+    keep their registration order. The chunks are rebuilt lazily on the
+    first match after add().
+    """
+    re_group = re.compile(r'\(\?P(<|=)([a-zA-Z_]\w*)')
+    chunk_groups = 32
+
+    def __init__(self):
+        self.routes = {}
+        self.compiled = {}
+        self.single = {} # (method, index) -> regexp, for the rare fallback
+        self.lock = threading.Lock()
+
+    def add(self, method, route, handler):
+        with self.lock:
+            self.routes.setdefault(method, []).append(
+                (compile_route(route), handler, route_converters(route)))
+            self.compiled.pop(method, None)
+
+    def build(self, method):
+        """ Builds the [(regexp, targets)] chunks for one method. """
+        chunks = []
+        parts = []
+        targets = {}
+        groups = 0
+        for i, (pattern, handler, converters) in enumerate(self.routes.get(method, ())):
+            prefix = '_%d_' % i
+            names = []
+            def rename(m):
+                if m.group(1) == '<':
+                    names.append((prefix + m.group(2), m.group(2)))
+                return '(?P%s%s%s' % (m.group(1), prefix, m.group(2))
+            pattern = self.re_group.sub(rename, pattern)
+            if parts and groups + pattern.count('(') + 1 > self.chunk_groups:
+                chunks.append((re.compile('^(?:%s)$' % '|'.join(parts)), targets))
+                parts, targets, groups = [], {}, 0
+            parts.append('(?P<_%d>%s)' % (i, pattern))
+            targets['_%d' % i] = (i, handler, tuple(names), converters)
+            groups += pattern.count('(') + 1
+        if parts:
+            chunks.append((re.compile('^(?:%s)$' % '|'.join(parts)), targets))
+        return tuple(chunks)
+
+    def freeze(self):
+        with self.lock:
+            for method in self.routes:
+                if method not in self.compiled:
+                    self.compiled[method] = self.build(method)
+            self.routes = dict((method, tuple(routes))
+                               for method, routes in self.routes.items())
+
+    def match(self, url, method):
+        chunks = self.compiled.get(method)
+        if chunks is None:
+            with self.lock:
+                chunks = self.compiled.get(method)
+                if chunks is None:
+                    chunks = self.compiled[method] = self.build(method)
+        for regexp, targets in chunks:
+            match = regexp.match(url)
+            if match:
+                index, handler, names, converters = targets[match.lastgroup]
+                args = dict((name, match.group(group)) for group, name in names)
+                if converters:
+                    args = convert(args, converters)
+                    if args is None:
+                        # An alternation only reports its first match
+                        return self.scan(url, method, index + 1)
+                return (handler, args)
+        return (None, None)
+
+    def scan(self, url, method, start):
+        """ Tries the routes from index start on one by one, like ScanRouter. """
+        routes = self.routes.get(method, ())
+        for index in range(start, len(routes)):
+            pattern, handler, converters = routes[index]
+            regexp = self.single.get((method, index))
+            if regexp is None:
+                regexp = self.single[(method, index)] = re.compile('^%s$' % pattern)
+            match = regexp.match(url)
+            if match:
+                args = match.groupdict()
+                if converters:
+                    args = convert(args, converters)
+                    if args is None:
+                        continue
+                return (handler, args)
+        return (None, None)
+
+
+class TrieNode(object):
+    __slots__ = ('static', 'typed', 'wildcard', 'tails', 'handler', 'names')
+
+    def __init__(self):
+        self.static = {}    # segment -> TrieNode
+        self.typed = []     # [converter, fullmatch, to_python, TrieNode] for ":name#int"
+        self.wildcard = None  # TrieNode for a ":name" segment
+        self.tails = []     # [regexp, handler, names, converters] matched against the rest
+        self.handler = None
+        self.names = ()
+
+
+class TrieRouter(object):
+    """
+    A prefix tree over path segments. Static segments are tried first, then
+    typed ":name#int" segments, then ":name" wildcards, then routes whose
+    remainder is a custom regular expression or a ":name#path". Lookup cost
+    depends on the depth of the path, not on the number of routes.
+    """
+
+    def __init__(self):
+        self.roots = {}
+
+    def add(self, method, route, handler):
+        node = self.roots.setdefault(method, TrieNode())
+        names = []
+        segments = route.split('/')
+        for i, segment in enumerate(segments):
+            typed = re_typed_segment.match(segment)
+            if re_simple_segment.match(segment):
+                node = node.static.setdefault(segment, TrieNode())
+            elif re_wildcard_segment.match(segment):
+                if node.wildcard is None:
+                    node.wildcard = TrieNode()
+                node = node.wildcard
+                names.append(segment[1:])
+            elif typed and get_converter(typed.group(2))[2]:
+                name, conv = typed.groups()
+                for entry in node.typed:
+                    if entry[0] == conv:
+                        break
+                else:
+                    pattern, to_python, _ = CONVERTERS[conv]
+                    entry = [conv, re.compile(pattern).fullmatch, to_python, TrieNode()]
+                    node.typed.append(entry)
+                node = entry[3]
+                names.append(name)
+            else:
+                # Custom regular expressions may span several segments, so the
+                # rest of the route is matched as a whole.
+                rest = '/'.join(segments[i:])
+                regexp = re.compile('^%s$' % compile_route(rest))
+                node.tails.append([regexp, handler, tuple(names), route_converters(rest)])
+                return
+        node.handler = handler
+        node.names = tuple(names)
+
+    def freeze(self):
+        stack = list(self.roots.values())
+        while stack:
+            node = stack.pop()
+            node.typed = tuple(tuple(entry) for entry in node.typed)
+            node.tails = tuple(tuple(entry) for entry in node.tails)
+            stack.extend(node.static.values())
+            stack.extend(entry[3] for entry in node.typed)
+            if node.wildcard is not None:
+                stack.append(node.wildcard)
+
+    def match(self, url, method):
+        root = self.roots.get(method)
+        if root is None:
+            return (None, None)
+        found = self._lookup(root, url.split('/'), 0, ())
+        return found or (None, None)
+
+    def _lookup(self, node, segments, i, values):
+        if i == len(segments):
+            if node.handler is not None:
+                return (node.handler, dict(zip(node.names, values)))
+            return None
+        segment = segments[i]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._lookup(child, segments, i + 1, values)
+            if found:
+                return found
+        for conv, fullmatch, to_python, child in node.typed:
+            if fullmatch(segment):
+                if to_python is None:
+                    value = segment
+                else:
+                    try:
+                        value = to_python(segment)
+                    except ValueError:
+                        continue
+                found = self._lookup(child, segments, i + 1, values + (value,))
+                if found:
+                    return found
+        if node.wildcard is not None and segment:
+            found = self._lookup(node.wildcard, segments, i + 1,
+                                 values + (segment,))
+            if found:
+                return found
+        if node.tails:
+            rest = '/'.join(segments[i:])
+            for regexp, handler, names, converters in node.tails:
+                match = regexp.match(rest)
+                if match:
+                    args = match.groupdict()
+                    if converters:
+                        args = convert(args, converters)
+                        if args is None:
+                            continue
+                    args.update(zip(names, values))
+                    return (handler, args)
+        return None
+
+
+ROUTERS = {
+    'scan': ScanRouter,
+    'trie': TrieRouter,
+    'regex': RegexpRouter,
+}
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+JSON serializers for autojson. Every backend turns an object into UTF-8
+encoded bytes. orjson is used when it is installed; the stdlib json module
+is the fallback, and also handles whatever the fast backend rejects.
+"""
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_CHUNK_SIZE = 65536
+
+
+def stdlib_dumps(obj):
+    import json
+    return json.dumps(obj).encode('utf8')
+
+
+def orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj)
+    except TypeError: # e.g. non-str keys or unsupported types
+        return stdlib_dumps(obj)
+
+
+JSON_BACKENDS = {'json': stdlib_dumps}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = orjson_dumps
+DEFAULT_JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def register_json_backend(name, dumps):
+    """ Registers dumps(obj) -> bytes under name. """
+    JSON_BACKENDS[name] = dumps
+
+
+def get_json_backend(name=None):
+    """
+    Returns the dumps function for name, a callable (used as is) or the
+    default backend for None. Unknown names fall back to the default.
+    """
+    if callable(name):
+        return name
+    return JSON_BACKENDS.get(name or DEFAULT_JSON_BACKEND,
+                             JSON_BACKENDS[DEFAULT_JSON_BACKEND])
+
+
+def iter_json_array(first, iterator, dumps, chunk_size=JSON_CHUNK_SIZE):
+    """
+    Encodes first and the remaining items of iterator as one JSON array,
+    yielding chunks of about chunk_size bytes. Only one chunk is ever held
+    in memory.
+    """
+    parts = [b'[', dumps(first)]
+    size = len(parts[1])
+    for item in iterator:
+        data = dumps(item)
+        parts.append(b',')
+        parts.append(data)
+        size += len(data) + 1
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    parts.append(b']')
+    yield b''.join(parts)
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+"""
+A pre-fork HTTP server for Sparrow applications.
+
+The master binds the listening socket once and forks worker processes that
+share it. Crashed workers are restarted, SIGHUP replaces all workers with a
+fresh generation and SIGTERM/SIGINT stop the server. Workers drain on
+SIGTERM: they stop accepting, turn off Sparrow.serve (late requests get a
+503), finish the requests already in flight and then the tasks deferred
+by them.
+
+    python server.py serve myapp:app --bind 0.0.0.0:8080 --workers 4
+
+With --preload the master imports the app and calls its freeze() before
+forking, so workers start serving at once and share the app's memory.
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import ServerHandler, WSGIServer, WSGIRequestHandler
+from common import HTTP_CODES
+from static import FileWrapper
+
+
+def load_app(app):
+    """ Returns app itself or imports it from a 'module:attribute' string. """
+    if not isinstance(app, str):
+        return app
+    module, _, name = app.partition(':')
+    return getattr(importlib.import_module(module), name or 'app')
+
+
+def make_socket(host, port, reuse_port=False, backlog=1024):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET,
+                         socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class SendfileHandler(ServerHandler):
+    """ Sends FileWrapper bodies with os.sendfile() instead of read()/write(). """
+
+    wsgi_file_wrapper = FileWrapper
+
+    def sendfile(self):
+        filelike = self.result.filelike
+        try:
+            filelike.fileno()
+        except (AttributeError, OSError, ValueError):
+            return False
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+        sock = self.request_handler.connection
+        self.bytes_sent += sock.sendfile(getattr(filelike, 'file', filelike),
+                                         getattr(filelike, 'offset', 0),
+                                         getattr(filelike, 'count', None))
+        return True
+
+
+class RequestHandler(WSGIRequestHandler):
+    # Headers and body are written separately; don't let Nagle hold the body
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        """ Same as WSGIRequestHandler.handle(), but with SendfileHandler. """
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = SendfileHandler(self.rfile, self.wfile, self.get_stderr(),
+                                  self.get_environ(), multithread=True)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class ThreadPoolWSGIServer(ThreadingMixIn, WSGIServer):
+    """
+    A WSGIServer on an already bound socket, backed by a thread pool. A
+    connection is only accepted while a thread is free to serve it; the
+    others wait in the listen backlog, where another worker may take them.
+    """
+
+    def __init__(self, sock, app, threads=16):
+        WSGIServer.__init__(self, sock.getsockname()[:2], RequestHandler,
+                            bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_name = socket.getfqdn(self.server_address[0])
+        self.server_port = self.server_address[1]
+        self.setup_environ()
+        self.set_app(app)
+        self.executor = ThreadPoolExecutor(threads)
+        self.slots = threading.BoundedSemaphore(threads)
+        # Workers share the socket; one that loses the race for a
+        # connection gets BlockingIOError instead of hanging in accept().
+        sock.setblocking(False)
+
+    def get_request(self):
+        self.slots.acquire()
+        try:
+            return self.socket.accept()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self.executor.submit(self._process_request, request, client_address)
+        except RuntimeError: # shut down meanwhile
+            self.slots.release()
+            self.shutdown_request(request)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+    def server_close(self):
+        self.executor.shutdown(wait=True)
+        self.socket.close()
+
+
+class HTTPProtocolError(Exception):
+    pass
+
+
+class RequestBody(object):
+    """
+    Reads a request body, plain or chunked, from a StreamReader in chunks of
+    at most chunk_size bytes as the app receives them, so the app's size
+    limits apply before a large body is buffered. done is True once all of
+    it was read; error is set if the body was malformed or cut short.
+    """
+
+    def __init__(self, reader, length=0, chunked=False, chunk_size=65536):
+        self.reader = reader
+        self.remaining = length # of the body, or of the current chunk
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+        self.done = not chunked and not length
+        self.finished = False
+        self.error = None
+
+    async def read(self):
+        """ Returns the next part of the body, b'' at its end. """
+        if self.done:
+            return b''
+        if self.chunked and not self.remaining:
+            size = int((await self.reader.readline()).split(b';')[0].strip() or b'0', 16)
+            if size < 0:
+                raise ValueError('Negative chunk size')
+            if not size:
+                while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.done = True
+                return b''
+            self.remaining = size
+        data = await self.reader.readexactly(min(self.chunk_size, self.remaining))
+        self.remaining -= len(data)
+        if self.chunked and not self.remaining:
+            await self.reader.readexactly(2)
+        elif not self.chunked:
+            self.done = not self.remaining
+        return data
+
+    async def receive(self):
+        """ The ASGI receive channel of the request. """
+        if self.finished or self.error is not None:
+            return {'type': 'http.disconnect'}
+        try:
+            data = await self.read()
+        except (asyncio.IncompleteReadError, ValueError) as e:
+            self.error = e
+            return {'type': 'http.disconnect'}
+        self.finished = self.done
+        return {'type': 'http.request', 'body': data, 'more_body': not self.done}
+
+
+class AsyncioWorker(object):
+    """
+    Serves the app's ASGI interface with a small HTTP/1.1 implementation on
+    a single-threaded event loop. Supports keep-alive and chunked bodies.
+    """
+
+    def __init__(self, sock, app, keepalive_timeout=75, max_header_size=65536):
+        self.sock = sock
+        self.app = app
+        self.keepalive_timeout = keepalive_timeout
+        self.max_header_size = max_header_size
+        self.active = 0
+        self.idle = set()  # writers of keep-alive connections between requests
+        self.stopping = None
+
+    def run(self, graceful_timeout):
+        asyncio.run(self.serve(graceful_timeout))
+
+    async def serve(self, graceful_timeout):
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, self.stopping.set)
+        loop.add_signal_handler(signal.SIGINT, self.stopping.set)
+        server = await asyncio.start_server(self.connection, sock=self.sock,
+                                            limit=self.max_header_size)
+        await self.stopping.wait()
+        server.close()
+        self.app.serve = False
+        for writer in list(self.idle):
+            writer.close()
+        deadline = loop.time() + graceful_timeout
+        while (self.active or self.idle) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def connection(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            keep_alive = True
+            while keep_alive and not self.stopping.is_set():
+                self.idle.add(writer)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                                  self.keepalive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    break
+                finally:
+                    self.idle.discard(writer)
+                self.active += 1
+                try:
+                    keep_alive = await self.request(head, reader, writer)
+                finally:
+                    self.active -= 1
+        except (HTTPProtocolError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def request(self, head, reader, writer):
+        """ Handles one request. Returns True if the connection stays open. """
+        lines = head.decode('latin1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HTTPProtocolError(lines[0])
+        headers = []
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers.append((name.strip().lower(), value.strip()))
+        fields = dict(headers)
+        keep_alive = (version == 'HTTP/1.1' and
+                      fields.get('connection', '').lower() != 'close')
+        if fields.get('transfer-encoding', '').lower() == 'chunked':
+            body = RequestBody(reader, chunked=True)
+        else:
+            try:
+                length = int(fields.get('content-length') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                await self.reject(writer, 400)
+                return False
+            body = RequestBody(reader, length)
+        path, _, query = target.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': version[5:],
+            'method': method.upper(),
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode('latin1'),
+            'query_string': query.encode('latin1'),
+            'root_path': '',
+            'headers': [(k.encode('latin1'), v.encode('latin1')) for k, v in headers],
+            'client': writer.get_extra_info('peername'),
+            'server': writer.get_extra_info('sockname'),
+        }
+        state = {}
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+                state['headers'] = message['headers']
+                return
+            # Everything of one message goes out in a single write; a head
+            # and body in separate segments stall on delayed ACKs.
+            data = []
+            if 'sent' not in state:
+                state['sent'] = True
+                # The unread rest of a rejected body is not drained
+                state['keep_alive'] = state['keep_alive'] and body.done
+                names = set(k.lower() for k, v in state['headers'])
+                state['chunked'] = (b'content-length' not in names and
+                                    version == 'HTTP/1.1' and method != 'HEAD' and
+                                    state['status'] not in (100, 101, 204, 304))
+                out = ['HTTP/1.1 %d %s\r\n' % (state['status'],
+                                                HTTP_CODES.get(state['status'], 'UNKNOWN'))]
+                for k, v in state['headers']:
+                    out.append('%s: %s\r\n' % (k.decode('latin1'), v.decode('latin1')))
+                if state['chunked']:
+                    out.append('Transfer-Encoding: chunked\r\n')
+                if not state['keep_alive']:
+                    out.append('Connection: close\r\n')
+                out.append('\r\n')
+                data.append(''.join(out).encode('latin1'))
+            chunk = message.get('body', b'')
+            if state['chunked']:
+                if chunk:
+                    data.append(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                if not message.get('more_body'):
+                    data.append(b'0\r\n\r\n')
+            elif chunk:
+                data.append(chunk)
+            if data:
+                writer.write(b''.join(data))
+                await writer.drain()
+        state['keep_alive'] = keep_alive and self.app.serve
+        await self.app.asgi(scope, body.receive, send)
+        if body.error is not None:
+            if 'sent' not in state and not isinstance(body.error, asyncio.IncompleteReadError):
+                await self.reject(writer, 400)
+            return False
+        return state['keep_alive'] and body.done
+
+    async def reject(self, writer, status):
+        """ Answers a request the app never saw and closes the connection. """
+        writer.write(('HTTP/1.1 %d %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+                      % (status, HTTP_CODES.get(status, 'UNKNOWN'))).encode('latin1'))
+        await writer.drain()
+
+
+class Worker(object):
+    """ Runs inside a forked child and serves requests until told to stop. """
+
+    def __init__(self, app, sock, mode='thread', threads=16, graceful_timeout=30):
+        self.app = app
+        self.sock = sock
+        self.mode = mode
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+
+    def run(self):
+        app = load_app(self.app)
+        if self.mode == 'async':
+            AsyncioWorker(self.sock, app).run(self.graceful_timeout)
+            app.shutdown()
+            return
+        server = ThreadPoolWSGIServer(self.sock, app, self.threads)
+        def drain(signum, frame):
+            # shutdown() blocks until serve_forever() returns, so it must not
+            # run in the signal handler's (main) thread.
+            threading.Thread(target=server.shutdown).start()
+            signal.signal(signal.SIGALRM, lambda *a: os._exit(1))
+            signal.alarm(self.graceful_timeout)
+        signal.signal(signal.SIGTERM, drain)
+        signal.signal(signal.SIGINT, drain)
+        server.serve_forever()
+        app.serve = False
+        server.server_close()
+        app.shutdown() # deferred tasks
+
+
+class Arbiter(object):
+    """
+    The pre-fork master. Keeps 'workers' children alive, replaces them on
+    SIGHUP and stops them on SIGTERM/SIGINT.
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=8080, workers=2,
+                 mode='thread', threads=16, reuse_port=False,
+                 graceful_timeout=30, preload=False):
+        self.app = app
+        self.preload = preload
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.mode = mode
+        self.threads = threads
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.sock = None
+        self.children = {}  # pid -> generation
+        self.generation = 0
+        self.signals = []
+
+    def run(self):
+        if self.preload:
+            # SIGHUP then restarts workers, but does not reload the code
+            self.app = load_app(self.app)
+            if hasattr(self.app, 'freeze') and not getattr(self.app, 'frozen', True):
+                self.app.freeze()
+        if not self.reuse_port:
+            self.sock = make_socket(self.host, self.port)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, lambda signum, frame: self.signals.append(signum))
+        self.spawn_missing()
+        try:
+            while True:
+                while self.signals:
+                    signum = self.signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        self.reload()
+                    else:
+                        return self.stop()
+                self.reap()
+                self.spawn_missing()
+                time.sleep(0.2)
+        finally:
+            if self.sock is not None:
+                self.sock.close()
+
+    def spawn_missing(self):
+        alive = sum(1 for gen in self.children.values() if gen == self.generation)
+        for _ in range(self.workers - alive):
+            self.spawn()
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = self.generation
+            return
+        status = 0
+        try:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(sig, signal.SIG_DFL)
+            sock = self.sock
+            if sock is None:
+                sock = make_socket(self.host, self.port, reuse_port=True)
+            Worker(self.app, sock, self.mode, self.threads,
+                   self.graceful_timeout).run()
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
+            self.children.pop(pid, None)
+
+    def kill(self, pids, sig=signal.SIGTERM):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+
+    def reload(self):
+        """ Starts a new generation of workers, then drains the old one. """
+        old = list(self.children)
+        self.generation += 1
+        self.spawn_missing()
+        self.kill(old)
+
+    def stop(self):
+        self.kill(list(self.children))
+        deadline = time.time() + self.graceful_timeout
+        while self.children and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.kill(list(self.children), signal.SIGKILL)
+        self.reap()
+
+
+def run(app, host='127.0.0.1', port=8080, workers=2, mode='thread',
+        threads=16, reuse_port=False, graceful_timeout=30, preload=False):
+    """
+    Serves app (an object or a 'module:attribute' string) with a pre-fork
+    master. mode is 'thread' (WSGI, thread pool per worker) or 'async'
+    (ASGI on one event loop per worker). workers=0 serves in this process.
+    preload imports and freezes the app in the master, before forking.
+    """
+    if workers <= 0:
+        sock = make_socket(host, port, reuse_port)
+        return Worker(app, sock, mode, threads, graceful_timeout).run()
+    Arbiter(app, host, port, workers, mode, threads, reuse_port,
+            graceful_timeout, preload).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='sparrow')
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help='serve an application')
+    serve.add_argument('app', help="'module:attribute' of the Sparrow app")
+    serve.add_argument('-b', '--bind', default='127.0.0.1:8080')
+    serve.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 2)
+    serve.add_argument('-m', '--mode', choices=('thread', 'async'), default='thread')
+    serve.add_argument('-t', '--threads', type=int, default=16)
+    serve.add_argument('--reuse-port', action='store_true')
+    serve.add_argument('--graceful-timeout', type=int, default=30)
+    serve.add_argument('--preload', action='store_true',
+                       help='import and freeze the app before forking workers')
+    args = parser.parse_args(argv)
+    if args.command != 'serve':
+        parser.error('missing command')
+    sys.path.insert(0, os.getcwd())
+    host, _, port = args.bind.rpartition(':')
+    run(args.app, host or '127.0.0.1', int(port), args.workers, args.mode,
+        args.threads, args.reuse_port, args.graceful_timeout, args.preload)
+
+
+if __name__ == '__main__':
+    main()
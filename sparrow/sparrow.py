@@ -1,66 +1,194 @@
 # -*- coding: utf-8 -*-
 
+import io
 import re
-import traceback
-from common import TRACEBACK_TEMPLATE, HTTP_CODES
-from request import request as request_thread_local
-from response import response as response_thread_local
-from sparrow_exceptions import HTTPError, BreakTheSparrow
-import json
-json_dumps = json.dumps
-import types
+import sys
+from types import MappingProxyType
+from itertools import islice
+from common import HTTP_CODES
+from request import request as request_context
+from response import DEFAULT_HEADERS, response as response_context, serialize_headers
+from sparrow_exceptions import SparrowException, HTTPError, BreakTheSparrow
+from errors import ErrorLog, error_page
+from routing import ROUTERS, Route, compile_route
+from cache import LRUCache, MemoryStore
+from static import FileWrapper
+from asgi import Disconnected, asgi_body, asgi_environ, asgi_lifespan, asgi_send
+from serializers import get_json_backend, iter_json_array
+from tasks import TaskExecutor, call_on_close
+
+re_simple_route = re.compile(r'^(\w+/)*\w*$')
 
 class Sparrow(object):
+    # Lists of records longer than this are encoded as a JSON stream.
+    json_stream_threshold = 1000
 
-    def __init__(self, catchall=True, optimize=False, autojson=True):
+    def __init__(self, catchall=True, optimize=False, autojson=True,
+                 router='trie', route_cache=0, json_backend=None, compress=False,
+                 cache_store=None, metrics=False, profiler=None, admission=None,
+                 tasks=None, default_headers=None):
         self.simple_routes = {}
-        self.regexp_routes = {}
+        # (method, route, handler) of the non-static routes, see regexp_routes
+        self.dynamic_routes = []
+        self._regexp_routes = None
+        if optimize: # deprecated alias for the combined regexp router
+            router = 'regex'
+        self.router = ROUTERS[router]()
+        # Optional LRU cache of resolved (method, url) -> (Route, params)
+        self.route_cache = LRUCache(route_cache) if route_cache else None
         self.default_route = None
         self.error_handler = {}
         self.optimize = optimize
         self.autojson = autojson
+        # dumps(obj) -> bytes, see serializers.JSON_BACKENDS
+        self.json_dumps = get_json_backend(json_backend)
+        # True for the defaults or a compress.Compressor instance
+        if compress is True:
+            from compress import Compressor
+            compress = Compressor()
+        self.compressor = compress or None
+        # Response cache: the CacheRule of a route is Route.cache; this maps
+        # handlers passed to cache() to theirs. Entries are stored in a
+        # MemoryStore unless a shared store (e.g. cache.FileStore) is given.
+        self.cache_rules = {}
+        self.cache_store = cache_store
+        # True or a metrics.Metrics instance; labelled by Route.label
+        if metrics is True:
+            from metrics import Metrics
+            metrics = Metrics()
+        self.metrics = metrics or None
+        # Every Route added, in order
+        self.routes = []
+        # A profiler.Profiler, consulted only when set
+        self.profiler = profiler
+        # An admission.Admission, limits the handlers running at once
+        self.admission = admission
+        # Runs the work handlers response.defer() after the response
+        self.tasks = tasks or TaskExecutor()
+        # Headers every response starts with; routes with a headers= option
+        # keep the defaults updated with them in Route.headers
+        self.default_headers = serialize_headers(default_headers or (), DEFAULT_HEADERS)
         self.catchall = catchall
+        # Deduplicates the tracebacks of unhandled exceptions
+        self.error_log = ErrorLog()
         self.serve = True
+        self.frozen = False
+
+    def shutdown(self, wait=True):
+        """ Stops serving (503) and waits for the deferred tasks. """
+        self.serve = False
+        self.tasks.shutdown(wait)
+
+    def freeze(self, templates=None):
+        """
+        Builds everything that is otherwise built lazily (the router's
+        expressions, templates below the templates directory), turns the
+        route and error handler tables into read-only mappings and moves all
+        objects to the permanent GC generation. Called in a pre-fork master
+        after all routes are added, the workers share the result
+        copy-on-write. Adding routes or handlers afterwards raises
+        RuntimeError.
+        """
+        import gc
+        self.router.freeze()
+        if templates:
+            from template import TEMPLATES
+            TEMPLATES.precompile(templates)
+        self.simple_routes = MappingProxyType(dict(
+            (method, MappingProxyType(routes)) for method, routes in self.simple_routes.items()))
+        self.dynamic_routes = tuple(self.dynamic_routes)
+        self.routes = tuple(self.routes)
+        for name in ('error_handler', 'cache_rules'):
+            setattr(self, name, MappingProxyType(getattr(self, name)))
+        if self.route_cache is not None:
+            self.route_cache.clear()
+        self.frozen = True
+        gc.collect()
+        gc.freeze()
+        return self
+
+    def _check_frozen(self):
+        if self.frozen:
+            raise RuntimeError('The application is frozen, see Sparrow.freeze()')
+
+    @property
+    def regexp_routes(self):
+        """ method -> [[compiled regexp, handler]] of the non-static routes. """
+        if self._regexp_routes is None:
+            routes = {}
+            for method, route, handler in self.dynamic_routes:
+                regexp = re.compile('^%s$' % compile_route(route))
+                routes.setdefault(method, []).append([regexp, handler])
+            self._regexp_routes = routes
+        return self._regexp_routes
 
     def match_url(self, url, method='GET'):
         """
         Returns the first matching handler and a parameter dict or (None, None)
         """
+        route, args = self.match_route(url, method)
+        if route is None:
+            return (None, None)
+        return (route.handler, args)
+
+    def match_route(self, url, method='GET'):
+        """ Like match_url(), but returns the matching routing.Route. """
+        if self.route_cache is None:
+            return self._match_route(url, method)
+        key = (method, url)
+        found = self.route_cache.get(key)
+        if found is None:
+            found = self._match_route(url, method)
+            self.route_cache.set(key, found)
+        return found
+
+    def _match_route(self, url, method):
         url = url.strip().lstrip("/ ")
         # Search for static routes first
         route = self.simple_routes.get(method,{}).get(url,None)
         if route:
             return (route, {})
         
-        routes = self.regexp_routes.get(method,[])
-        for i in range(len(routes)):
-            match = routes[i][0].match(url)
-            if match:
-                handler = routes[i][1]
-                if i > 0 and self.optimize and random.random() <= 0.001:
-                    routes[i-1], routes[i] = routes[i], routes[i-1]
-                return (handler, match.groupdict())
+        route, args = self.router.match(url, method)
+        if route:
+            return (route, args)
         if self.default_route:
             return (self.default_route, {})
         if method == 'HEAD': # Fall back to GET
-            return self.match_url(url)
+            return self.match_route(url)
         else:
             return (None, None)
 
     def add_route(self, route, handler, method='GET', **kargs):
-        """ Adds a new route to the route mappings. """
+        """
+        Adds a new route to the route mappings.
+        cache: cache responses, either a ttl in seconds or a dict of
+        cache() arguments.
+        headers: a dict (or list of pairs) of headers the route's responses
+        start with, on top of the app's default_headers.
+        """
+        self._check_frozen()
         method = method.strip().upper()
         route = route.strip().lstrip('$^/ ').rstrip('$^ ')
-        if re.match(r'^(\w+/)*\w*$', route):
-            self.simple_routes.setdefault(method, {})[route] = handler
+        record = Route(method, route, handler)
+        if kargs.get('cache'):
+            options = kargs['cache']
+            if not isinstance(options, dict):
+                options = {'ttl': options}
+            record.cache = self._cache_rule(**options)
+        else:
+            record.cache = self.cache_rules.get(handler)
+        if kargs.get('headers'):
+            record.headers = serialize_headers(kargs['headers'], self.default_headers)
+        self.routes.append(record)
+        if self.route_cache is not None:
+            self.route_cache.clear()
+        if re_simple_route.match(route):
+            self.simple_routes.setdefault(method, {})[route] = record
         else:
-            route = re.sub(r':([a-zA-Z_]+)(?P<uniq>[^\w/])(?P<re>.+?)(?P=uniq)',
-                           r'(?P<\1>\g<re>)',route) # \1表示的是第一个匹配到的括号内内容
-                                                    # \g<re> 表示的是(?<re>.+?)中的内容
-                                                    # 其中,+?表示非贪婪匹配
-            route = re.sub(r':([a-zA-Z_]+)', r'(?P<\1>[^/]+)', route)
-            route = re.compile('^%s$' % route)
-            self.regexp_routes.setdefault(method, []).append([route, handler])
+            self.router.add(method, route, record)
+            self.dynamic_routes.append((method, route, handler))
+            self._regexp_routes = None
 
     def route(self, url, **kargs):
         """
@@ -72,8 +200,38 @@ class Sparrow(object):
             return handler
         return wrapper
 
+    def cache(self, ttl=60, vary=(), params=None, store=None):
+        """
+        Decorator that caches the cast output of a GET/HEAD handler for ttl
+        seconds, on every route it is (or will be) mounted on; the cache=
+        option of add_route() covers a single route. Entries are keyed by
+        method, path, the query params named in params (all of them if None)
+        and the request headers named in vary.
+        """
+        rule = self._cache_rule(ttl, vary, params, store)
+        def wrapper(handler):
+            self._check_frozen()
+            self.cache_rules[handler] = rule
+            for route in self.routes + [self.default_route]:
+                if route is not None and route.handler is handler:
+                    route.cache = rule
+            return handler
+        return wrapper
+
+    def _cache_rule(self, ttl=60, vary=(), params=None, store=None):
+        from httpcache import CacheRule
+        if store is None:
+            if self.cache_store is None:
+                self.cache_store = MemoryStore()
+            store = self.cache_store
+        return CacheRule(store, ttl, vary, params)
+
     def set_default(self, handler):
-        self.default_route = handler
+        self._check_frozen()
+        self.default_route = Route('*', '', handler, '<default>')
+        self.default_route.cache = self.cache_rules.get(handler)
+        if self.route_cache is not None:
+            self.route_cache.clear()
 
     def default(self):
         """ Decorator for request handler. Same as add_defroute( handler )."""
@@ -84,6 +242,7 @@ class Sparrow(object):
 
     def set_error_handler(self, code, handler):
         """ Adds a new error handler. """
+        self._check_frozen()
         self.error_handler[int(code)] = handler
 
     def error(self, code=500):
@@ -96,67 +255,295 @@ class Sparrow(object):
             return handler
         return wrapper
 
-    def cast(self, out):
+    def cast(self, out, request, response):
         """
-        Cast the output to an iterable of strings.
+        Cast the output to an iterable of bytes.
         Set Content-Type and Content-Length when possible. Then clear output
         on HEAD requests.
-        Supports: False, str, unicode, list(unicode), dict(), open()
+        Supports: False, bytes, str, list(str), dict(), list(dict), open()
+        and generators, which are streamed without buffering. Generators of
+        dicts or lists and long lists of them are streamed as a JSON array;
+        An empty list or generator is an empty body, or [] if the handler
+        set a JSON Content-Type.
         """
-        if self.autojson and json_dumps and isinstance(out, dict):
-            out = [json_dumps(out)]
-            response_thread_local.content_type = 'application/json'
+        if self.autojson and isinstance(out, dict):
+            out = [self.json_dumps(out)]
+            response.content_type = 'application/json'
+        elif isinstance(out, list) and not out and self._json_expected(response):
+            out = [b'[]']
         elif not out:
             out = []
-            response_thread_local.header['Content-Length'] = '0'
-        elif isinstance(out, types.StringType):
+            if not self._bodyless(response):
+                response.header['Content-Length'] = '0'
+        elif isinstance(out, bytes):
             out = [out]
-        elif isinstance(out, unicode):
-            out = [out.encode(response_thread_local.charset)]
-        elif isinstance(out, list) and isinstance(out[0], unicode):
-            out = map(lambda x: x.encode(response_thread_local.charset), out)
+        elif isinstance(out, str):
+            out = [out.encode(response.charset)]
+        elif isinstance(out, list) and isinstance(out[0], str):
+            # One chunk: it gets a Content-Length and goes out in one write
+            out = [''.join(out).encode(response.charset)]
+        elif isinstance(out, list) and isinstance(out[0], bytes) and len(out) > 1:
+            out = [b''.join(out)]
+        elif self.autojson and isinstance(out, list) and isinstance(out[0], (dict, list)):
+            response.content_type = 'application/json'
+            if len(out) > self.json_stream_threshold:
+                out = iter_json_array(out[0], islice(out, 1, None), self.json_dumps)
+            else:
+                out = [self.json_dumps(out)]
         elif hasattr(out, 'read'):
-            out = request_thread_local.environ.get('wsgi.file_wrapper', lambda x: iter(lambda: x.read(8192), ''))(out)
-        if isinstance(out, list) and len(out) == 1:
-            response_thread_local.header['Content-Length'] = str(len(out[0]))
+            out = request.environ.get('wsgi.file_wrapper', FileWrapper)(out)
+        elif hasattr(out, '__iter__') and not isinstance(out, list):
+            out = self.cast_iter(out, response)
+        if isinstance(out, list) and len(out) == 1 and not self._bodyless(response):
+            response.header['Content-Length'] = str(len(out[0]))
         if not hasattr(out, '__iter__'):
             raise TypeError('Request handler for route "%s" returned [%s] '
-            'which is not iterable.' % (request_thread_local.path, type(out).__name__))
+            'which is not iterable.' % (request.path, type(out).__name__))
         return out
 
+    def _bodyless(self, response):
+        """ True for statuses that must not carry a body nor its Content-Length. """
+        return response.status < 200 or response.status in (204, 304)
+
+    def _json_expected(self, response):
+        """ True if the handler declared a JSON body, so an empty one is sent as []. """
+        content_type = response.header['Content-Type'] or ''
+        return (self.autojson and content_type.startswith('application/json')
+                and not self._bodyless(response))
+
+    def cast_iter(self, out, response):
+        """
+        Passes generators and other iterables through unbuffered, encoding
+        str chunks on the fly. The first chunk is fetched right away, so
+        errors raised before it still reach the error handlers. If it is a
+        dict or list, the items are encoded as a JSON array instead.
+        """
+        iterator = iter(out)
+        try:
+            first = next(iterator)
+        except StopIteration:
+            if hasattr(out, 'close'):
+                out.close()
+            return [b'[]'] if self._json_expected(response) else []
+        if self.autojson and isinstance(first, (dict, list)):
+            response.content_type = 'application/json'
+            def encoded():
+                try:
+                    yield from iter_json_array(first, iterator, self.json_dumps)
+                finally:
+                    if hasattr(out, 'close'):
+                        out.close()
+            return encoded()
+        charset = response.charset
+        def encoded():
+            try:
+                chunk = first
+                while True:
+                    yield chunk.encode(charset) if isinstance(chunk, str) else chunk
+                    chunk = next(iterator)
+            except StopIteration:
+                pass
+            finally:
+                if hasattr(out, 'close'):
+                    out.close()
+        return encoded()
+
+    def _route(self, request):
+        """ Returns (Route, args) for the request or raises HTTPError. """
+        if not self.serve:
+            raise HTTPError(503, "Server stopped")
+        route, args = self.match_route(request.path, request.method)
+        if route is None:
+            raise HTTPError(404, "Not found")
+        return route, args
+
+    def _http_error(self, e, request, response):
+        """
+        Calls the error handler registered for an HTTPError, or returns the
+        (cached) default error page.
+        """
+        response.status = e.http_status
+        handler = self.error_handler.get(e.http_status)
+        if handler is None:
+            return [error_page(e.http_status, ''.join(e.output),
+                               request.path, response.charset)]
+        return handler(e)
+
+    def _returned(self, e, request, response):
+        """ Handles an HTTPError or BreakTheSparrow returned by a handler. """
+        if isinstance(e, HTTPError):
+            return self._http_error(e, request, response)
+        return e.output_fp
+
+    def _admit(self, route, response, block=True):
+        """ Returns an admission ticket or raises HTTPError(503). """
+        ticket, retry_after = self.admission.enter(route.label, block)
+        if ticket is None:
+            response.header['Retry-After'] = str(retry_after)
+            raise HTTPError(503, 'Server overloaded, try again later.')
+        return ticket
+
+    def _cached(self, route, request):
+        """ Returns the CacheRule for a GET/HEAD request, or None. """
+        if route.cache is not None and request.method in ('GET', 'HEAD'):
+            return route.cache
+        return None
+
+    def _finish(self, output, request, response, rule=None, key=None):
+        output = self.cast(output, request, response)
+        if rule is not None:
+            output = rule.save(key, request, response, output)
+        body = output
+        if self.compressor is not None:
+            # HEAD too, so its headers match those of GET
+            body = self.compressor(request.environ, response, output)
+        if self._bodyless(response) or request.method == 'HEAD':
+            if body is not output and hasattr(body, 'close'):
+                body.close()
+            if hasattr(output, 'close'):
+                output.close()
+            return [] # rfc2616 section 4.3
+        return body
+
+    def _internal_error(self, e, request, response):
+        """ Renders an unhandled exception as a 500 page (catchall only). """
+        response.status = 500
+        err = "Unhandled Exception: %s\n" % (repr(e))
+        err += self.error_log.report(e, request.environ['wsgi.errors'])
+        return [error_page(500, err, request.path, response.charset)]
+
+    def _task_error(self, e):
+        """ Reports an exception raised by a deferred task. """
+        self.error_log.report(e, sys.stderr)
+
+    def _status_line(self, response):
+        return '%d %s' % (response.status, HTTP_CODES[response.status])
 
     def __call__(self, environ, start_response):
         """ The Sparrow WSGI-interface. """
-        request_thread_local.bind(environ)
-        response_thread_local.bind()
+        if self.profiler is not None and self.profiler.wants(environ):
+            return self.profiler.run(self, environ, start_response)
+        request = request_context.bind(environ)
+        response = response_context.bind(self.default_headers)
+        timer = self.metrics.timer() if self.metrics is not None else None
+        rule = key = output = ticket = None
         try: # Unhandled Exceptions
             try: # Sparrow Error Handling
-                if not self.serve:
-                    abort(503, "Server stopped")
-                handler, args = self.match_url(request_thread_local.path, request_thread_local.method)
-                if not handler:
-                    raise HTTPError(404, "Not found")
-                output = handler(**args)
-            except BreakTheSparrow, e:
+                route, args = self._route(request)
+                handler = route.handler
+                if route.headers is not None:
+                    response.header[:] = route.headers
+                if timer is not None:
+                    timer.matched(route.label)
+                rule = self._cached(route, request)
+                if rule is not None:
+                    key, output = rule.lookup(request, response)
+                if output is None:
+                    if self.admission is not None:
+                        ticket = self._admit(route, response)
+                    output = handler(**args)
+                    if isinstance(output, SparrowException):
+                        output = self._returned(output, request, response)
+                else:
+                    rule = None
+            except BreakTheSparrow as e:
                 output = e.output_fp
-            except HTTPError, e:
-                response_thread_local.status = e.http_status
-                output = self.error_handler.get(response_thread_local.status, str)(e)
-            output = self.cast(output)
-            if response_thread_local.status in (100, 101, 204, 304) or request_thread_local.method == 'HEAD':
-                output = [] # rfc2616 section 4.3
+            except HTTPError as e:
+                output = self._http_error(e, request, response)
+            if timer is not None:
+                timer.handled()
+            output = self._finish(output, request, response, rule, key)
         except (KeyboardInterrupt, SystemExit, MemoryError):
             raise
         except Exception as e:
-            response_thread_local.status = 500
-            if self.catchall:
-                err = "Unhandled Exception: %s\n" % (repr(e))
-                err += TRACEBACK_TEMPLATE % traceback.format_exc(10)
-                output = [str(HTTPError(500, err))]
-                request_thread_local._environ['wsgi.errors'].write(err)
-            else:
+            if not self.catchall:
                 raise
-        status = '%d %s' % (response_thread_local.status, HTTP_CODES[response_thread_local.status])
-        start_response(status, response_thread_local.wsgiheaders())
+            output = self._internal_error(e, request, response)
+        finally:
+            if ticket is not None:
+                self.admission.leave(ticket)
+        start_response(self._status_line(response), response.wsgiheaders())
+        if timer is not None:
+            timer.finish(response.status)
+        if response.deferred:
+            tasks = response.deferred
+            output = call_on_close(output, lambda: self.tasks.submit(tasks, self._task_error))
         return output
 
+    async def asgi(self, scope, receive, send):
+        """
+        The Sparrow ASGI-interface. Handlers and error handlers may be plain
+        functions or coroutine functions; plain ones run on the event loop.
+        """
+        from inspect import isawaitable
+        if scope['type'] == 'lifespan':
+            return await asgi_lifespan(receive, send, self.shutdown)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type: %s' % scope['type'])
+        environ = asgi_environ(scope)
+        request = request_context.bind(environ)
+        try:
+            body = await asgi_body(receive, request.max_body_size, request.input_length)
+        except Disconnected:
+            return
+        if body is not None:
+            environ['wsgi.input'] = io.BytesIO(body)
+            # Chunked and HTTP/2 requests may not declare a length
+            environ['CONTENT_LENGTH'] = str(len(body))
+        response = response_context.bind(self.default_headers)
+        timer = self.metrics.timer() if self.metrics is not None else None
+        rule = key = output = ticket = None
+        try: # Unhandled Exceptions
+            try: # Sparrow Error Handling
+                if body is None:
+                    raise HTTPError(413, 'Request body is larger than %d bytes'
+                                    % request.max_body_size)
+                route, args = self._route(request)
+                handler = route.handler
+                if route.headers is not None:
+                    response.header[:] = route.headers
+                if timer is not None:
+                    timer.matched(route.label)
+                rule = self._cached(route, request)
+                if rule is not None:
+                    key, output = rule.lookup(request, response)
+                if output is None:
+                    if self.admission is not None:
+                        ticket = self._admit(route, response, block=False)
+                    output = handler(**args)
+                    if isawaitable(output):
+                        output = await output
+                    if isinstance(output, SparrowException):
+                        output = self._returned(output, request, response)
+                        if isawaitable(output):
+                            output = await output
+                else:
+                    rule = None
+            except BreakTheSparrow as e:
+                output = e.output_fp
+            except HTTPError as e:
+                output = self._http_error(e, request, response)
+                if isawaitable(output):
+                    output = await output
+            if timer is not None:
+                timer.handled()
+            output = self._finish(output, request, response, rule, key)
+        except (KeyboardInterrupt, SystemExit, MemoryError):
+            raise
+        except Exception as e:
+            if not self.catchall:
+                raise
+            output = self._internal_error(e, request, response)
+        finally:
+            if ticket is not None:
+                self.admission.leave(ticket)
+        if timer is not None:
+            timer.finish(response.status)
+        await asgi_send(send, response.status,
+                        response.wsgiheaders(), output)
+        tasks = response.deferred
+        if tasks and not self.tasks.submit(tasks, self._task_error, inline=False):
+            # The pool is full: run them on a thread, not on the event loop
+            import asyncio
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.tasks.run, tasks, self._task_error)
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from request import request
-from common import HTTP_ERROR_TEMPLATE, HTTP_CODES
+from errors import render_error
 
 class SparrowException(Exception):
     """ A base class for exceptions used by sparrow. """
@@ -11,7 +11,7 @@ class SparrowException(Exception):
 class HTTPError(SparrowException):
     """
     This class is used to break the execution and then jump to an error
-    handler. 
+    handler. A handler may also return an instance instead of raising it.
     """
     def __init__(self, status, text):
         self.output = text
@@ -22,17 +22,15 @@ class HTTPError(SparrowException):
         return 'HTTPError(%d,%s)' % (self.http_status, repr(self.output))
 
     def __str__(self):
-        return HTTP_ERROR_TEMPLATE % {
-            'status' : self.http_status,
-            'url' : request.path,
-            'error_name' : HTTP_CODES.get(self.http_status, 'Unknown').title(),
-            'error_message' : ''.join(self.output)
-        }
+        import html
+        return render_error(self.http_status, ''.join(self.output),
+                            html.escape(request.path))
 
 
 class BreakTheSparrow(SparrowException):
     '''
-    Used to instantly break the execution of request handler.
+    Used to instantly break the execution of request handler. Returning an
+    instance sends its output the same way, without the raise.
     '''
     def __init__(self, output_fp):
         self.output_fp = output_fp
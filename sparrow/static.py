@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Building blocks for serving static files: validators, byte ranges,
+precompressed variants and file bodies that servers can hand to sendfile().
+"""
+import os
+
+# Precompressed siblings, in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+MAX_RANGES = 16
+
+
+class FileWrapper(object):
+    """
+    A wsgi.file_wrapper. Iterates the file in blocks; servers that know the
+    type may send filelike with os.sendfile() instead.
+    """
+
+    def __init__(self, filelike, blksize=65536):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        read = self.filelike.read
+        blksize = self.blksize
+        while True:
+            data = read(blksize)
+            if not data:
+                return
+            yield data
+
+
+class FileRange(object):
+    """ A readable window of count bytes from offset of an open file. """
+
+    def __init__(self, file, offset, count):
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.remaining = count
+        file.seek(offset)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def make_etag(stats, encoding=None):
+    """ A weak ETag built from inode, mtime and size. """
+    etag = '%x-%x-%x' % (stats.st_ino, stats.st_mtime_ns, stats.st_size)
+    if encoding:
+        etag += '-' + encoding
+    return 'W/"%s"' % etag
+
+
+def etag_matches(etag, header):
+    """ Weak comparison of an ETag against an If-None-Match header. """
+    if header.strip() == '*':
+        return True
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def accepted_encodings(header):
+    """ Content codings an Accept-Encoding header allows (q > 0). """
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding)
+    return accepted
+
+
+def find_precompressed(filename, accept_encoding):
+    """
+    Returns (encoding, path, stats, vary) for the best precompressed sibling
+    the client accepts, or (None, None, None, vary). vary is True if any
+    sibling exists, so the response depends on Accept-Encoding.
+    """
+    accepted = accepted_encodings(accept_encoding) if accept_encoding else ()
+    vary = False
+    for encoding, suffix in ENCODINGS:
+        try:
+            stats = os.stat(filename + suffix)
+        except OSError:
+            continue
+        vary = True
+        if encoding in accepted:
+            return encoding, filename + suffix, stats, vary
+    return None, None, None, vary
+
+
+def parse_range(header, size):
+    """
+    Parses a 'bytes=' Range header into a list of inclusive (start, end)
+    pairs. Returns [] if no range is satisfiable and None if the header is
+    invalid or asks for too many ranges (the full file should be sent).
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        start, sep, end = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not start:
+                length = int(end)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size - 1
+            else:
+                start = int(start)
+                end = int(end) if end else size - 1
+                if end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def multipart_ranges(filename, ranges, size, content_type, boundary):
+    """
+    Returns (content_length, generator) for a multipart/byteranges body.
+    The file is opened when the generator starts.
+    """
+    heads = [('--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+              % (boundary, content_type, start, end, size)).encode('latin1')
+             for start, end in ranges]
+    tail = ('--%s--\r\n' % boundary).encode('latin1')
+    length = len(tail) + sum(len(head) + end - start + 1 + 2
+                             for head, (start, end) in zip(heads, ranges))
+    def body():
+        with open(filename, 'rb') as f:
+            for head, (start, end) in zip(heads, ranges):
+                yield head
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining:
+                    data = f.read(min(65536, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+                yield b'\r\n'
+            yield tail
+    return length, body()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Containers for request data: a multi-value dict, a variant of it that
+parses its source string lazily, and a case-insensitive view of the
+HTTP headers in a WSGI environ.
+"""
+from urllib.parse import unquote_plus
+
+
+class MultiDict(object):
+    """
+    A dict in which every key may hold several values. d[key] and get()
+    always return a single value (the last one); getall() returns them all.
+    """
+    __slots__ = ('_dict',)
+
+    def __init__(self, pairs=()):
+        self._dict = {}
+        for key, value in pairs:
+            self._dict.setdefault(key, []).append(value)
+
+    def __getitem__(self, key):
+        return self._dict[key][-1]
+
+    def __setitem__(self, key, value):
+        self._dict[key] = [value]
+
+    def __delitem__(self, key):
+        del self._dict[key]
+
+    def __contains__(self, key):
+        return key in self._dict
+
+    def __iter__(self):
+        return iter(self._dict)
+
+    def __len__(self):
+        return len(self._dict)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.allitems())
+
+    def append(self, key, value):
+        """ Adds a value without replacing the existing ones. """
+        self._dict.setdefault(key, []).append(value)
+
+    def get(self, key, default=None, type=None):
+        """
+        Returns the last value for key, or default. If type is given the
+        value is converted with it and default is returned if that fails.
+        """
+        values = self.getall(key)
+        if not values:
+            return default
+        if type is None:
+            return values[-1]
+        try:
+            return type(values[-1])
+        except (ValueError, TypeError):
+            return default
+
+    def getall(self, key):
+        """ Returns a (possibly empty) list of all values for key. """
+        return list(self._dict.get(key, ()))
+
+    def keys(self):
+        return self._dict.keys()
+
+    def values(self):
+        return [values[-1] for values in self._dict.values()]
+
+    def items(self):
+        return [(key, values[-1]) for key, values in self._dict.items()]
+
+    def allitems(self):
+        return [(key, value) for key, values in self._dict.items()
+                for value in values]
+
+    def to_dict(self):
+        """ A plain dict; keys with several values map to lists. """
+        return dict((key, values[0] if len(values) == 1 else list(values))
+                    for key, values in self._dict.items())
+
+
+def unquote_query(text):
+    if '%' in text or '+' in text:
+        return unquote_plus(text)
+    return text
+
+
+def unquote_cookie(text):
+    text = text.strip()
+    if len(text) > 1 and text[0] == text[-1] == '"':
+        text = text[1:-1]
+    return text
+
+
+class LazyMultiDict(MultiDict):
+    """
+    A MultiDict over a raw 'name=value' list such as a query string or a
+    Cookie header. Single key lookups scan the raw string and decode only
+    the matching pairs; the whole string is parsed on first iteration or
+    modification.
+    """
+    __slots__ = ('_raw', '_sep', '_decode_name', '_decode_value')
+
+    def __init__(self, raw, sep='&', decode_name=unquote_query,
+                 decode_value=unquote_query):
+        self._raw = raw
+        self._sep = sep
+        self._decode_name = decode_name
+        self._decode_value = decode_value
+
+    def __getattr__(self, name):
+        if name != '_dict':
+            raise AttributeError(name)
+        self._dict = data = {}
+        decode_name, decode_value = self._decode_name, self._decode_value
+        for pair in self._raw.split(self._sep):
+            if pair.strip():
+                key, _, value = pair.partition('=')
+                data.setdefault(decode_name(key), []).append(decode_value(value))
+        return data
+
+    def _parsed(self):
+        try:
+            object.__getattribute__(self, '_dict')
+            return True
+        except AttributeError:
+            return False
+
+    def getall(self, key):
+        if self._parsed():
+            return MultiDict.getall(self, key)
+        decode_name = self._decode_name
+        values = []
+        for pair in self._raw.split(self._sep):
+            name, _, value = pair.partition('=')
+            if decode_name(name) == key:
+                values.append(self._decode_value(value))
+        return values
+
+    def __getitem__(self, key):
+        values = self.getall(key)
+        if not values:
+            raise KeyError(key)
+        return values[-1]
+
+    def __contains__(self, key):
+        return bool(self.getall(key))
+
+
+class EnvironHeaders(object):
+    """
+    A read-only, case-insensitive view of the request headers stored in a
+    WSGI environ (HTTP_* keys plus CONTENT_TYPE and CONTENT_LENGTH).
+    """
+    __slots__ = ('environ',)
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    @staticmethod
+    def _key(name):
+        key = name.upper().replace('-', '_')
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            return key
+        return 'HTTP_' + key
+
+    def __getitem__(self, name):
+        return self.environ[self._key(name)]
+
+    def __contains__(self, name):
+        return self._key(name) in self.environ
+
+    def get(self, name, default=None):
+        return self.environ.get(self._key(name), default)
+
+    def __iter__(self):
+        for key in self.environ:
+            if key.startswith('HTTP_'):
+                yield key[5:].replace('_', '-').title()
+            elif key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                yield key.replace('_', '-').title()
+
+    def __len__(self):
+        return len(list(self))
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def __repr__(self):
+        return 'EnvironHeaders(%r)' % self.items()
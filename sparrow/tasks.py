@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Follow-up work of handlers that should not delay the response:
+
+    @app.route('/orders', method='POST')
+    def order():
+        ...
+        response.defer(audit, 'order', order_id)
+        return {'id': order_id}
+
+The tasks of a request run, in order, once the server closed its body (after
+the ASGI response was sent). Sparrow.shutdown() waits for the pending ones.
+"""
+import threading
+
+
+class TaskExecutor(object):
+    """
+    Runs deferred tasks on up to max_workers threads, started on first use.
+    At most max_pending requests' tasks wait for a thread; beyond that the
+    thread that served the request runs them itself, which slows down
+    accepting new requests instead of growing the queue without bound.
+    Callers that must not block (an event loop) pass inline=False and run
+    them elsewhere.
+    """
+
+    def __init__(self, max_workers=4, max_pending=1000):
+        self.max_workers = max_workers
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.executor = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.submitted = self.ran_inline = self.failed = 0
+
+    def _executor(self):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self.executor = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix='sparrow-tasks')
+        return self.executor
+
+    def run(self, tasks, report):
+        """ Runs [(fn, args, kwargs)] in order and passes exceptions to report. """
+        for fn, args, kwargs in tasks:
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                self.failed += 1
+                report(e)
+
+    def _run(self, tasks, report):
+        try:
+            self.run(tasks, report)
+        finally:
+            self.slots.release()
+
+    def submit(self, tasks, report, inline=True):
+        """
+        Queues the tasks of one request and returns True. If the queue is
+        full they run right away, or with inline=False are left to the
+        caller; either way False is returned.
+        """
+        if not self.closed and self.slots.acquire(blocking=False):
+            try:
+                self._executor().submit(self._run, tasks, report)
+            except RuntimeError: # shut down meanwhile
+                self.slots.release()
+            else:
+                self.submitted += 1
+                return True
+        if inline:
+            self.ran_inline += 1
+            self.run(tasks, report)
+        return False
+
+    def shutdown(self, wait=True):
+        """ Stops queueing and, if wait, waits for the queued tasks. """
+        self.closed = True
+        with self.lock:
+            executor = self.executor
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def call_on_close(output, callback):
+    """
+    Returns a WSGI body that calls callback once the server closed output.
+    A wsgi.file_wrapper gets its close() replaced instead of being wrapped,
+    so the server still recognises it and may use sendfile().
+    """
+    if hasattr(output, 'filelike'):
+        close = getattr(output, 'close', None)
+        def closed():
+            try:
+                if close is not None:
+                    close()
+            finally:
+                callback()
+        try:
+            output.close = closed
+            return output
+        except (AttributeError, TypeError):
+            pass
+    return ClosingIterator(output, callback)
+
+
+class ClosingIterator(object):
+    """ Wraps a WSGI body and calls callback once the server closed it. """
+    __slots__ = ('iterable', 'callback')
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.callback()
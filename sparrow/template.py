@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 
 from abc import ABCMeta, abstractmethod, abstractproperty
+import ast
+import hashlib
+import marshal
+import os
 import re
+import sys
+import tempfile
+import time
+from cache import LRUCache
 from request import request
 from response import response
 from utilities import abort
-from exceptions import HTTPError
+from sparrow_exceptions import HTTPError
 
 class TemplateError(HTTPError):
     def __init__(self, message):
@@ -52,35 +60,200 @@ class PyStmt(str):
         return 'str(' + self + ')'
 
 
+class PyStrStmt(PyStmt):
+    """ An expression known to produce a string; emitted without str(). """
+    def __repr__(self):
+        return '(' + self + ')'
+
+
+def fold(expr):
+    """
+    Returns constant expressions as literal strings, and expressions that
+    are strings already as PyStrStmt. Everything else becomes a PyStmt.
+    """
+    try:
+        node = ast.parse(expr.strip(), mode='eval').body
+    except SyntaxError:
+        return PyStmt(expr) # let compile() report it with the right line
+    if isinstance(node, ast.Constant):
+        return str(node.value)
+    if (isinstance(node, ast.JoinedStr) or
+        (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+         node.func.id == 'str') or
+        (isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod) and
+         isinstance(node.left, ast.Constant) and isinstance(node.left.value, str))):
+        return PyStrStmt(expr)
+    return PyStmt(expr)
+
+
+class BytecodeCache(object):
+    """
+    Stores marshalled template code objects in a directory, so processes
+    (e.g. pre-forked workers) can skip translate() and compile(). Files are
+    written to a temporary name and renamed, so concurrent writers never
+    expose a partial entry.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, *parts):
+        """ Builds a cache key from the interpreter version and parts. """
+        digest = hashlib.sha1(repr((sys.implementation.cache_tag,
+                                    marshal.version) + parts).encode('utf8'))
+        return digest.hexdigest()
+
+    def load(self, key):
+        try:
+            with open(os.path.join(self.directory, key), 'rb') as f:
+                return marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(value, f)
+            os.replace(tmp, os.path.join(self.directory, key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+
 class SimpleTemplate(BaseTemplate):
+    # Set to a BytecodeCache to share compiled templates between processes.
+    bytecode_cache = None
+    # Merge output of consecutive text lines into one call, fold constant
+    # expressions and bind _stdout.append/extend to local names.
+    optimize = True
     re_python = re.compile(r'^\s*%\s*(?:(if|elif|else|try|except|finally|for|'
                             'while|with|def|class)|(include)|(end)|(.*))')
     re_inline = re.compile(r'\{\{(.*?)\}\}')
     dedent_keywords = ('elif', 'else', 'except', 'finally')
 
     def prepare(self):
+        self.co = self.compile_code()
+        self.co_stream = None
+
+    def compile_code(self, stream=False):
+        """ Returns the code object for render() or, with stream, stream(). """
+        cache = self.bytecode_cache
+        if cache is not None:
+            key = cache.key(*self.cache_key() + (stream,))
+            data = cache.load(key)
+            if data is not None:
+                co, includes = data
+                self.includes = dict((name, SimpleTemplate(filename=path))
+                                     for name, path in includes)
+                return co
         if self.template:
-            code = self.translate(self.template)
-            self.co = compile(code, '<string>', 'exec')
+            source, filename = self.template, '<string>'
         else:
             with open(self.filename) as f:
-                code = self.translate(f.read())
-                self.co = compile(code, self.filename, 'exec')
+                source, filename = f.read(), self.filename
+        code = self.translate(source, stream)
+        if stream:
+            tree = self.stream_tree(code)
+            if self.optimize:
+                tree.body[0].body[0:0] = hoisted_writers()
+            co = compile(tree, filename, 'exec')
+        elif self.optimize:
+            tree = ast.parse(code)
+            tree.body[0:0] = hoisted_writers()
+            co = compile(tree, filename, 'exec')
+        else:
+            co = compile(code, filename, 'exec')
+        if cache is not None:
+            cache.store(key, (co, tuple((name, tpl.filename) for name, tpl
+                                        in self.includes.items())))
+        return co
 
-    def translate(self, template):
-        indent = 0
+    def stream_tree(self, code):
+        """
+        Wraps translated code in a generator function '_stream'. Names the
+        template assigns are declared global, so they behave exactly as in
+        render(), and line numbers still point at the template source.
+        """
+        tree = ast.parse('def _stream():\n' + code + ' yield from ()\n')
+        ast.increment_lineno(tree, -1)
+        func = tree.body[0]
+        names = sorted(assigned_names(func.body))
+        if names:
+            func.body.insert(0, ast.Global(names=names, lineno=1, col_offset=0,
+                                           end_lineno=1, end_col_offset=0))
+        return tree
+
+    def cache_key(self):
+        """
+        Identifies the template source: a hash for template strings, path,
+        mtime and size for files.
+        """
+        if self.template:
+            source = hashlib.sha1(self.template.encode('utf8')).hexdigest()
+        else:
+            stat = os.stat(self.filename)
+            source = (os.path.abspath(self.filename), stat.st_mtime_ns,
+                      stat.st_size)
+        return (type(self).__name__, self.optimize, source)
+
+    def translate(self, template, stream=False):
+        indent = stream and 1 or 0
         strbuffer = []
         code = []
+        blocks = [] # open block keywords, to know when we are inside a def
         self.includes = dict()
 
+        def ready():
+            # Streaming code hands out full buffers after each write, except
+            # inside functions and classes defined by the template.
+            if stream and 'def' not in blocks and 'class' not in blocks:
+                return '; len(_stdout) >= _stdout.check_at and (yield from _stdout.ready())'
+            return ''
+
         def flush(allow_nobreak=False):
+            if self.optimize:
+                return flush_parts(allow_nobreak)
             if len(strbuffer):
                 if allow_nobreak and strbuffer[-1].endswith("\\\\\n"):
                     strbuffer[-1]=strbuffer[-1][:-3]
-                code.append(' ' * indent + "_stdout.append(%s)" % repr(''.join(strbuffer)))
+                code.append(' ' * indent + "_stdout.append(%s)" % repr(''.join(strbuffer)) + ready())
                 code.append((' ' * indent + '\n') * len(strbuffer)) # keep the same number of line
                 del strbuffer[:]
 
+        def flush_parts(allow_nobreak):
+            # strbuffer holds a list of parts per text line. Adjacent literals
+            # are merged, expressions stay on their own line so tracebacks
+            # point at the right template line.
+            if not strbuffer:
+                return
+            last = strbuffer[-1]
+            if (allow_nobreak and last and not isinstance(last[-1], PyStmt)
+                and last[-1].endswith("\\\\\n")):
+                last[-1] = last[-1][:-3]
+            lines = [[] for parts in strbuffer]
+            merge_into = None
+            for i, parts in enumerate(strbuffer):
+                for part in parts:
+                    if isinstance(part, PyStmt):
+                        lines[i].append(part)
+                        merge_into = None
+                    elif merge_into is not None:
+                        lines[merge_into][-1] += part
+                    else:
+                        lines[i].append(part)
+                        merge_into = i
+            parts = [part for line in lines for part in line]
+            if len(parts) <= 1 and not isinstance((parts or [''])[0], PyStmt):
+                code.append(' ' * indent + "_append(%s)" % repr((parts or [''])[0]) + ready())
+                code.append((' ' * indent + '\n') * len(strbuffer)) # keep the same number of line
+            else:
+                body = '\n'.join(' '.join(repr(part) + ',' for part in line)
+                                 for line in lines)
+                code.append(' ' * indent + "_extend((%s))" % body + ready() + '\n')
+            del strbuffer[:]
+
         for line in template.splitlines(True):
             lineend = '\n' if not line.endswith('\n') else ''
             m = self.re_python.match(line)
@@ -90,6 +263,9 @@ class SimpleTemplate(BaseTemplate):
                 if keyword:
                     if keyword in self.dedent_keywords:
                         indent -= 1
+                        blocks[-1:] = [keyword]
+                    else:
+                        blocks.append(keyword)
                     code.append(" " * indent + line[m.start(1):])
                     indent += 1
                 elif subtpl:
@@ -99,15 +275,31 @@ class SimpleTemplate(BaseTemplate):
                     filename = tmp[0]
                     args = tmp[1:] and tmp[1] or ''
                     if filename not in self.includes:
-                        self.includes[filename] = SimpleTemplate(filename)
-                    code.append(' ' * indent + 
-                                "_ = _includes[%s].execute(_stdout, %s)\n"
-                                % (repr(filename), args))
+                        path = TEMPLATES.search(filename) or filename
+                        self.includes[filename] = SimpleTemplate(filename=path)
+                    if ready():
+                        code.append(' ' * indent +
+                                    "yield from _includes[%s].generate(_stdout, %s)\n"
+                                    % (repr(filename), args))
+                    else:
+                        code.append(' ' * indent +
+                                    "_ = _includes[%s].execute(_stdout, %s)\n"
+                                    % (repr(filename), args))
                 elif end:
                     indent -= 1
+                    blocks[-1:] = []
                     code.append(' ' * indent + '#' + line[m.start(3):] + lineend)
+                elif statement and statement.strip() == 'flush':
+                    if ready():
+                        code.append(' ' * indent + 'yield from _stdout.flush()\n')
+                    else:
+                        code.append(' ' * indent + 'pass # flush\n')
                 elif statement:
                     code.append(' ' * indent + line[m.start(4):] + lineend)
+            elif self.optimize:
+                splits = self.re_inline.split(line) # text, (expr, text)*
+                parts = [fold(x) if i % 2 else x for i, x in enumerate(splits)]
+                strbuffer.append([x for x in parts if x])
             else:
                 splits = self.re_inline.split(line) # text, (expr, text)*
                 if len(splits) == 1:
@@ -117,7 +309,7 @@ class SimpleTemplate(BaseTemplate):
                     for i in range(1, len(splits), 2):
                         splits[i] = PyStmt(splits[i])
                     splits = [x for x in splits if bool(x)]
-                    code.append(' ' * indent + "_stdout.extend(%s)\n" % repr(splits))
+                    code.append(' ' * indent + "_stdout.extend(%s)" % repr(splits) + ready() + "\n")
         flush()
         return ''.join(code)
 
@@ -127,30 +319,224 @@ class SimpleTemplate(BaseTemplate):
         eval(self.co, args)
         return args
 
+    def generate(self, stdout, **args):
+        """
+        Returns a generator that renders into stdout (a StreamBuffer) and
+        yields its content whenever the buffer is full.
+        """
+        if self.co_stream is None:
+            self.co_stream = self.compile_code(stream=True)
+        args['_stdout'] = stdout
+        args['_includes'] = self.includes
+        eval(self.co_stream, args)
+        return args['_stream']()
+
     def render(self, **args):
         """ Render the template using keyword arguments as local variables. """
         stdout = []
         self.execute(stdout, **args)
         return stdout
 
-TEMPLATES = {}
+    def stream(self, bufsize=8192, **args):
+        """
+        Render the template as a generator of strings of roughly bufsize
+        characters. A '% flush' line in the template forces a chunk out.
+        """
+        stdout = StreamBuffer(bufsize)
+        for chunk in self.generate(stdout, **args):
+            yield chunk
+        if stdout:
+            yield stdout.drain()
+
+
+class StreamBuffer(list):
+    """
+    Output list of a streaming render that knows when it is full. The
+    generated code only calls ready() once the list holds check_at items,
+    which is re-estimated from the average item size.
+    """
+
+    def __init__(self, bufsize=8192):
+        list.__init__(self)
+        self.bufsize = bufsize
+        self.check_at = 16
+
+    def ready(self):
+        """ Returns (content,) if bufsize is reached, otherwise (). """
+        items = len(self)
+        size = sum(map(len, self))
+        if size >= self.bufsize:
+            self.check_at = items
+            return (self.drain(),)
+        self.check_at = items + max(16, (self.bufsize - size) * items // max(size, 1))
+        return ()
+
+    def flush(self):
+        """ Returns (content,) if there is buffered output, otherwise (). """
+        return self and (self.drain(),) or ()
+
+    def drain(self):
+        chunk = ''.join(self)
+        del self[:]
+        return chunk
+
+
+def hoisted_writers():
+    """ Statements binding _stdout.append/extend to _append/_extend. """
+    return ast.parse('_append = _stdout.append; _extend = _stdout.extend').body
+
+
+def assigned_names(body):
+    """ Names bound by statements in body, without entering nested scopes. """
+    names = set()
+    stack = list(body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            stack.extend(node.decorator_list)
+            continue
+        if isinstance(node, (ast.Lambda, ast.ListComp, ast.SetComp,
+                             ast.DictComp, ast.GeneratorExp)):
+            continue
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        elif isinstance(node, ast.alias):
+            names.add((node.asname or node.name).split('.')[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        stack.extend(ast.iter_child_nodes(node))
+    return names
+
+
+class TemplateRegistry(object):
+    """
+    A size bounded cache of compiled templates with a search path.
+
+    Files are looked up in the lookup directories, with and without the
+    default extensions. If check_interval is set, the files of a template
+    (its own and those it includes) are re-stat()ed at most once per
+    check_interval seconds and it is recompiled when the mtime or size of
+    any of them changed. With check_interval=None files are never checked
+    again.
+    """
+
+    def __init__(self, lookup=('./',), maxsize=1024, check_interval=None,
+                 extensions=('.tpl', '.html')):
+        self.lookup = list(lookup)
+        self.extensions = extensions
+        self.check_interval = check_interval
+        self.cache = LRUCache(maxsize)
+
+    def search(self, name):
+        """ Returns the absolute path of a template file or None. """
+        for root in self.lookup:
+            path = os.path.join(root, name)
+            for candidate in (path,) + tuple(path + ext for ext in self.extensions):
+                if os.path.isfile(candidate):
+                    return os.path.abspath(candidate)
+        return None
+
+    def get(self, tpl):
+        """
+        Returns the SimpleTemplate for a template string or a file name, or
+        None if no such file exists.
+        """
+        entry = self.cache.get(tpl)
+        if entry is not None:
+            if entry[1] is not None and self.check_interval is not None:
+                now = time.time()
+                if now - entry[2] >= self.check_interval:
+                    entry[2] = now
+                    if any(stat_key(path) != key for path, key in entry[1]):
+                        entry = None
+            if entry is not None:
+                return entry[0]
+        if "\n" in tpl or "{" in tpl or "%" in tpl or '$' in tpl:
+            compiled = SimpleTemplate(template=tpl)
+        else:
+            path = self.search(tpl)
+            if path is None:
+                return None
+            compiled = SimpleTemplate(filename=path)
+        entry = [compiled, file_stamps(compiled), time.time()]
+        self.cache.set(tpl, entry)
+        return entry[0]
+
+    def precompile(self, directory):
+        """
+        Compiles every template below directory and registers it under its
+        path relative to the directory, with and without the extension.
+        Returns the number of templates.
+        """
+        count = 0
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if os.path.splitext(name)[1] not in self.extensions:
+                    continue
+                path = os.path.abspath(os.path.join(root, name))
+                compiled = SimpleTemplate(filename=path)
+                entry = [compiled, file_stamps(compiled), time.time()]
+                name = os.path.relpath(path, directory)
+                self.cache.set(name, entry)
+                self.cache.set(os.path.splitext(name)[0], entry)
+                count += 1
+        return count
+
+    def clear(self):
+        self.cache.clear()
+
+
+def stat_key(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def file_stamps(tpl):
+    """
+    Returns ((path, stat_key), ...) for the file of tpl and every file it
+    includes, directly or not, or None if there are none.
+    """
+    paths = []
+    pending = [tpl]
+    while pending:
+        current = pending.pop()
+        if current.filename:
+            if current.filename in paths:
+                continue
+            paths.append(current.filename)
+        pending.extend(getattr(current, 'includes', {}).values())
+    return tuple((path, stat_key(path)) for path in paths) or None
+
+
+TEMPLATES = TemplateRegistry()
+
+def load_template(tpl):
+    """ Returns the SimpleTemplate for a filename or a template string. """
+    found = TEMPLATES.get(tpl)
+    if not found:
+        abort(500, 'Template (%s) not found' % tpl)
+    return found
 
 def template(tpl, **args):
     '''
     Get a rendered template as a string iterator.
     You can use a name, a filename or a template string as first parameter.
     '''
-    if tpl not in TEMPLATES:
-        if "\n" in tpl or "{" in tpl or "%" in tpl or '$' in tpl:
-            TEMPLATES[tpl] = SimpleTemplate(template=tpl)
-        elif '.' in tpl:
-            TEMPLATES[tpl] = SimpleTemplate(filename=tpl)
-
-    if not TEMPLATES[tpl]:
-        abort(500, 'Template (%s) not found' % tpl)
     args['abort'] = abort
     args['request'] = request
     args['response'] = response
-    return TEMPLATES[tpl].render(**args)
-
+    return load_template(tpl).render(**args)
 
+def stream_template(tpl, bufsize=8192, **args):
+    '''
+    Like template(), but returns a generator that yields the page in chunks
+    of about bufsize characters while it is rendered.
+    '''
+    args['abort'] = abort
+    args['request'] = request
+    args['response'] = response
+    return load_template(tpl).stream(bufsize, **args)
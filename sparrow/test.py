@@ -1,5 +1,5 @@
-from wsgiref.simple_server import make_server
 from sparrow import Sparrow
+from server import run
 
 app = Sparrow()
 
@@ -7,6 +7,5 @@ app = Sparrow()
 def hello_world():
     return "hello World!"
 
-httpd = make_server('localhost', 8080, app)
-
-httpd.serve_forever()
\ No newline at end of file
+if __name__ == '__main__':
+    run(app, 'localhost', 8080, workers=2)
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
-import email.utils
+import os
+import stat
 import time
-from exceptions import SparrowException, HTTPError, BreakTheSparrow
+from sparrow_exceptions import SparrowException, HTTPError, BreakTheSparrow
+from request import request
 from response import response
-import mimetypes
+from static import (FileRange, etag_matches, find_precompressed, make_etag,
+                    multipart_ranges, parse_range)
 
 def abort(code=500, text='Unknown Error: Appliction stopped.'):
     """ Aborts execution and causes a HTTP error. """
@@ -16,44 +19,119 @@ def redirect(url, code=307):
     response.header['Location'] = url
     raise BreakTheSparrow("")
 
+
+def abort_response(code=500, text='Unknown Error: Appliction stopped.'):
+    """
+    Like abort(), but returns the error for the handler to return:
+    return abort_response(404, "No such user."). Nothing is raised, which
+    is cheaper on paths that fail often.
+    """
+    return HTTPError(code, text)
+
+
+def redirect_response(url, code=307):
+    """ Like redirect(), but returns the (empty) body: return redirect_response(url) """
+    response.status = code
+    response.header['Location'] = url
+    return ""
+
 def send_file(filename, root, guessmime = True, mimetype = None):
-    """ Aborts execution and sends a static files as response. """
+    """
+    Aborts execution and sends a static files as response. Handles
+    If-None-Match/If-Modified-Since (304), Range (206/416) and serves a
+    precompressed .br/.gz sibling if the client accepts it. All of this is
+    decided from stat() results, before the file is opened.
+    """
     root = os.path.abspath(root) + os.sep
     filename = os.path.abspath(os.path.join(root, filename.strip('/\\')))
 
     if not filename.startswith(root):
         abort(401, "Access denied.")
-    if not os.path.exists(filename) or not os.path.isfile(filename):
+    try:
+        stats = os.stat(filename)
+    except OSError:
+        stats = None
+    if stats is None or not stat.S_ISREG(stats.st_mode):
         abort(404, "File does not exist.")
     if not os.access(filename, os.R_OK):
         abort(401, "You do not have permission to access this file.")
 
     if guessmime and not mimetype:
+        import mimetypes
         mimetype = mimetypes.guess_type(filename)[0]
     if not mimetype: mimetype = 'text/plain'
     response.content_type = mimetype
 
-    stats = os.stat(filename)
+    environ = request.environ
+    encoding, path, encoded_stats, vary = find_precompressed(
+        filename, environ.get('HTTP_ACCEPT_ENCODING', ''))
+    if encoding:
+        filename, stats = path, encoded_stats
+        response.header['Content-Encoding'] = encoding
+    if vary:
+        response.header['Vary'] = 'Accept-Encoding'
+
+    etag = make_etag(stats, encoding)
+    response.header['ETag'] = etag
+    response.header['Accept-Ranges'] = 'bytes'
     if 'Last-Modified' not in response.header:
         lm = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(stats.st_mtime))
         response.header['Last-Modified'] = lm
-    if 'HTTP_IF_MODIFIED_SINCE' in request.environ:
-        ims = request.environ['HTTP_IF_MODIFIED_SINCE']
+    if 'HTTP_IF_NONE_MATCH' in environ:
+        if etag_matches(etag, environ['HTTP_IF_NONE_MATCH']):
+            response.status = 304
+            raise BreakTheSparrow("")
+    elif 'HTTP_IF_MODIFIED_SINCE' in environ:
+        ims = environ['HTTP_IF_MODIFIED_SINCE']
         # IE sends "<date>; length=146"
         ims = ims.split(";")[0].strip()
         ims = parse_date(ims)
-        if ims is not None and ims >= stats.st_mtime:
-           abort(304, "Not modified")
-    if 'Content-Length' not in response.header:
-        response.header['Content-Length'] = str(stats.st_size)
+        if ims is not None and ims >= int(stats.st_mtime):
+            response.status = 304
+            raise BreakTheSparrow("")
+
+    size = stats.st_size
+    ranges = None
+    if 'HTTP_RANGE' in environ and if_range_matches(environ, stats):
+        ranges = parse_range(environ['HTTP_RANGE'], size)
+    if ranges == []:
+        response.status = 416
+        response.header['Content-Range'] = 'bytes */%d' % size
+        raise BreakTheSparrow("")
+    if ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        response.status = 206
+        response.header['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response.header['Content-Length'] = str(end - start + 1)
+        raise BreakTheSparrow(FileRange(open(filename, 'rb'), start, end - start + 1))
+    if ranges:
+        boundary = etag.strip('W/"')
+        length, body = multipart_ranges(filename, ranges, size, mimetype, boundary)
+        response.status = 206
+        response.content_type = 'multipart/byteranges; boundary=%s' % boundary
+        response.header['Content-Length'] = str(length)
+        raise BreakTheSparrow(body)
+    response.header['Content-Length'] = str(size)
     raise BreakTheSparrow(open(filename, 'rb'))
 
+def if_range_matches(environ, stats):
+    """
+    True if a Range header may be honoured. Our ETags are weak, so only an
+    If-Range date can match.
+    """
+    if_range = environ.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    date = parse_date(if_range)
+    return date is not None and date >= int(stats.st_mtime)
+
 def parse_date(ims):
     """
     ims: date strings usually found in HTTP header.
     returns UTC epoch.
     """
     try:
+        import email.utils
         ts = email.utils.parsedate_tz(ims)
         if ts is not None:
             if ts[9] is None:
@@ -67,10 +145,12 @@ def validate(**vkargs):
     """
     Validates and manipulates keyword arguments by user defined callables. 
     Handles ValueError and missing arguments by raising HTTPError(403).
+    Typed route placeholders (":id#int", see routing.CONVERTERS) convert in
+    the router instead and reject bad values with a 404.
     """
     def decorator(func):
         def wrapper(**kargs):
-            for key, value in vkargs.iteritems():
+            for key, value in vkargs.items():
                 if key not in kargs:
                     abort(403, 'Missing parameter: %s' % key)
                 try:
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of admission control: Limiter, Admission and the 503 responses.
+
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from admission import Admission, Limiter
+
+
+def call(app, path):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+               'wsgi.errors': io.StringIO()}
+    status = []
+    body = b''.join(app(environ, lambda s, h: status.append((s, dict(h)))))
+    return status[0][0], status[0][1], body
+
+
+class TestLimiter(unittest.TestCase):
+
+    def test_limit(self):
+        limiter = Limiter(2, timeout=0)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.acquire(), 1)
+        limiter.release()
+        self.assertEqual(limiter.acquire(), 0)
+        info = limiter.info()
+        self.assertEqual((info['inflight'], info['admitted'], info['rejected']), (2, 3, 1))
+
+    def test_waits_for_a_slot(self):
+        limiter = Limiter(1, timeout=5)
+        limiter.acquire()
+        timer = threading.Timer(0.05, limiter.release)
+        timer.start()
+        self.assertEqual(limiter.acquire(), 0)
+        timer.join()
+        self.assertEqual(limiter.info()['waiting'], 0)
+
+    def test_timeout(self):
+        limiter = Limiter(1, timeout=0.05)
+        limiter.acquire()
+        self.assertGreaterEqual(limiter.acquire(), 1)
+        self.assertEqual(limiter.timed_out, 1)
+
+    def test_no_blocking(self):
+        limiter = Limiter(1, timeout=5)
+        limiter.acquire()
+        start = time.monotonic()
+        self.assertGreaterEqual(limiter.acquire(block=False), 1)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_expected_wait_sheds_early(self):
+        limiter = Limiter(1, timeout=0.5)
+        limiter.acquire()
+        limiter.release(elapsed=100)
+        limiter.acquire()
+        start = time.monotonic()
+        self.assertGreaterEqual(limiter.acquire(), 1)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(limiter.timed_out, 0)
+
+    def test_full_queue(self):
+        limiter = Limiter(1, queue_size=0, timeout=5)
+        limiter.acquire()
+        self.assertGreaterEqual(limiter.acquire(), 1)
+
+
+class TestAdmission(unittest.TestCase):
+
+    def test_route_limit(self):
+        admission = Admission(routes={'/upload': 1}, timeout=0)
+        ticket, retry_after = admission.enter('/upload')
+        self.assertEqual(retry_after, 0)
+        self.assertIsNone(admission.enter('/upload')[0])
+        self.assertIsNotNone(admission.enter('/other')[0])
+        admission.leave(ticket)
+        self.assertIsNotNone(admission.enter('/upload')[0])
+
+    def test_rejection_releases_held_slots(self):
+        admission = Admission(max_inflight=1, routes={'/a': 1}, timeout=0)
+        held = admission.enter('/b')[0]
+        self.assertIsNone(admission.enter('/a')[0])
+        self.assertEqual(admission.routes['/a'].inflight, 0)
+        admission.leave(held)
+        self.assertEqual(admission.limiter.inflight, 0)
+
+    def test_prometheus(self):
+        admission = Admission(max_inflight=4, routes={'/up"load': 1})
+        admission.leave(admission.enter('/up"load')[0])
+        text = admission.prometheus()
+        self.assertIn('# TYPE sparrow_admission_in_flight gauge\n', text)
+        self.assertIn('sparrow_admission_admitted_total 1\n', text)
+        self.assertIn('sparrow_admission_admitted_total{route="/up\\"load"} 1\n', text)
+        self.assertTrue(text.endswith('\n'))
+
+
+class TestAdmissionResponses(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow(admission=Admission(max_inflight=1, timeout=0))
+        self.app.add_route('/a', lambda: 'ok')
+
+    def test_admitted(self):
+        self.assertEqual(call(self.app, '/a')[2], b'ok')
+        self.assertEqual(self.app.admission.limiter.inflight, 0)
+
+    def test_overloaded(self):
+        ticket = self.app.admission.enter('/a')[0]
+        self.addCleanup(self.app.admission.leave, ticket)
+        status, headers, body = call(self.app, '/a')
+        self.assertEqual(status, '503 SERVICE UNAVAILABLE')
+        self.assertEqual(headers['Retry-After'], '1')
+
+    def test_slot_released_on_error(self):
+        def fail():
+            raise ValueError('x')
+        self.app.add_route('/fail', fail)
+        self.assertEqual(call(self.app, '/fail')[0], '500 INTERNAL SERVER ERROR')
+        self.assertEqual(self.app.admission.limiter.inflight, 0)
+
+    def test_cached_responses_skip_admission(self):
+        self.app.add_route('/c', lambda: 'cached', cache=60)
+        call(self.app, '/c')
+        ticket = self.app.admission.enter('/a')[0]
+        self.addCleanup(self.app.admission.leave, ticket)
+        self.assertEqual(call(self.app, '/c')[2], b'cached')
+
+    def test_endpoint(self):
+        self.app.add_route('/_admission', self.app.admission.endpoint)
+        status, headers, body = call(self.app, '/_admission')
+        self.assertTrue(headers['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'sparrow_admission_in_flight 1', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the ASGI interface and the asyncio worker that serves it.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from request import Request, request
+from response import response
+from server import AsyncioWorker
+
+
+def scope(path, method='GET', headers=()):
+    return {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+            'headers': [(k.encode('latin1'), v.encode('latin1')) for k, v in headers]}
+
+
+def call(app, scope, chunks=(b'',)):
+    """ Runs one ASGI request; returns (status, headers, body). """
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {'type': 'http.disconnect'}
+    async def send(message):
+        sent.append(message)
+    asyncio.run(app.asgi(scope, receive, send))
+    if not sent:
+        return None, None, None
+    headers = dict((k.decode('latin1'), v.decode('latin1')) for k, v in sent[0]['headers'])
+    return sent[0]['status'], headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+
+class TestAsgi(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow()
+        self.app.add_route('/echo', lambda: request.environ['wsgi.input'].read(), method='POST')
+        self.app.add_route('/form', lambda: dict(request.POST), method='POST')
+
+    def test_get(self):
+        self.app.add_route('/hello/:name', lambda name: 'hello ' + name)
+        status, headers, body = call(self.app, scope('/hello/you'))
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'hello you')
+        self.assertEqual(headers['content-length'], '9')
+
+    def test_coroutine_handler(self):
+        async def handler():
+            await asyncio.sleep(0)
+            return {'ok': True}
+        self.app.add_route('/async', handler)
+        status, headers, body = call(self.app, scope('/async'))
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertEqual(body.replace(b' ', b''), b'{"ok":true}')
+
+    def test_chunked_body_without_length(self):
+        status, headers, body = call(self.app, scope('/form', 'POST', [
+            ('content-type', 'application/x-www-form-urlencoded')]), [b'a=1&b', b'=2', b''])
+        self.assertEqual(status, 200)
+        self.assertEqual(body.replace(b' ', b''), b'{"a":"1","b":"2"}')
+
+    def test_declared_length_too_large(self):
+        received = []
+        async def receive():
+            received.append(True)
+            return {'type': 'http.request', 'body': b'x', 'more_body': False}
+        sent = []
+        async def send(message):
+            sent.append(message)
+        big = str(Request.max_body_size + 1)
+        asyncio.run(self.app.asgi(scope('/echo', 'POST', [('content-length', big)]),
+                                  receive, send))
+        self.assertEqual(sent[0]['status'], 413)
+        self.assertEqual(received, [])
+
+    def test_body_too_large(self):
+        self.addCleanup(setattr, Request, 'max_body_size', Request.max_body_size)
+        Request.max_body_size = 10
+        status, headers, body = call(self.app, scope('/echo', 'POST'), [b'x' * 8, b'x' * 8, b''])
+        self.assertEqual(status, 413)
+
+    def test_disconnect(self):
+        status, headers, body = call(self.app, scope('/echo', 'POST'), [])
+        self.assertIsNone(status)
+
+    def test_deferred_tasks(self):
+        done = []
+        def handler():
+            response.defer(done.append, 'task')
+            return 'ok'
+        self.app.add_route('/defer', handler)
+        call(self.app, scope('/defer'))
+        self.app.shutdown()
+        self.assertEqual(done, ['task'])
+
+
+class TestAsyncioWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow()
+        self.app.add_route('/echo', lambda: request.environ['wsgi.input'].read(), method='POST')
+        self.app.add_route('/form', lambda: dict(request.POST), method='POST')
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.addCleanup(self.sock.close)
+
+    def exchange(self, data):
+        """ Sends raw bytes to a running worker and returns all it answers. """
+        async def run():
+            worker = AsyncioWorker(self.sock, self.app, keepalive_timeout=0.5)
+            server = asyncio.ensure_future(worker.serve(0.5))
+            while worker.stopping is None:
+                await asyncio.sleep(0.01)
+            reader, writer = await asyncio.open_connection(*self.sock.getsockname())
+            writer.write(data)
+            out = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            worker.stopping.set()
+            await server
+            return out
+        return asyncio.run(run())
+
+    def test_chunked_post(self):
+        out = self.exchange(b'POST /form HTTP/1.1\r\nConnection: close\r\n'
+                            b'Content-Type: application/x-www-form-urlencoded\r\n'
+                            b'Transfer-Encoding: chunked\r\n\r\n'
+                            b'5\r\na=1&b\r\n2\r\n=2\r\n0\r\n\r\n')
+        self.assertTrue(out.startswith(b'HTTP/1.1 200'), out)
+        self.assertTrue(out.replace(b' ', b'').endswith(b'{"a":"1","b":"2"}'), out)
+
+    def test_keep_alive(self):
+        out = self.exchange(b'POST /echo HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello'
+                            b'POST /echo HTTP/1.1\r\nContent-Length: 3\r\n'
+                            b'Connection: close\r\n\r\nbye')
+        self.assertEqual(out.count(b'HTTP/1.1 200'), 2)
+        self.assertTrue(out.endswith(b'bye'))
+
+    def test_bad_content_length(self):
+        out = self.exchange(b'POST /echo HTTP/1.1\r\nContent-Length: abc\r\n\r\n')
+        self.assertTrue(out.startswith(b'HTTP/1.1 400'), out)
+
+    def test_malformed_chunk(self):
+        out = self.exchange(b'POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n')
+        self.assertTrue(out.startswith(b'HTTP/1.1 400'), out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of Sparrow.cast(): how handler results become response bodies.
+
+    python -m pytest tests
+"""
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from response import response
+from template import stream_template
+
+
+def call(app, path, method='GET'):
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '',
+               'wsgi.errors': io.StringIO()}
+    status = []
+    out = app(environ, lambda s, h: status.append((s, dict(h))))
+    body = b''.join(out)
+    if hasattr(out, 'close'):
+        out.close()
+    return status[0][0], status[0][1], body
+
+
+class TestCast(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow()
+
+    def get(self, result, path='/x'):
+        self.app.add_route(path, result if callable(result) else lambda: result)
+        return call(self.app, path)
+
+    def test_str_and_bytes(self):
+        for result in (u'häh', u'häh'.encode('utf8'), [u'h', u'äh']):
+            status, headers, body = self.get(result)
+            self.assertEqual(body, u'häh'.encode('utf8'))
+            self.assertEqual(headers['Content-Length'], str(len(body)))
+
+    def test_dict(self):
+        status, headers, body = self.get({'a': [1, 2]})
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(body), {'a': [1, 2]})
+
+    def test_list_of_records(self):
+        status, headers, body = self.get([{'a': 1}, {'a': 2}])
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(body), [{'a': 1}, {'a': 2}])
+
+    def test_long_list_is_streamed(self):
+        records = [{'i': i} for i in range(self.app.json_stream_threshold + 1)]
+        status, headers, body = self.get(records)
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(json.loads(body), records)
+
+    def test_generator_of_records(self):
+        status, headers, body = self.get(lambda: ({'i': i} for i in range(3)))
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(body), [{'i': 0}, {'i': 1}, {'i': 2}])
+
+    def test_text_generator(self):
+        status, headers, body = self.get(lambda: (s for s in (u'a', b'b', u'ä')))
+        self.assertEqual(headers['Content-Type'], 'text/html')
+        self.assertEqual(body, u'abä'.encode('utf8'))
+
+    def test_empty(self):
+        for result in ('', None, [], (lambda: iter(())), (lambda: (s for s in ()))):
+            self.app = Sparrow()
+            status, headers, body = self.get(result)
+            self.assertEqual(body, b'')
+            self.assertEqual(headers['Content-Type'], 'text/html')
+
+    def test_empty_stream_template(self):
+        status, headers, body = self.get(lambda: stream_template('{{""}}'))
+        self.assertEqual(body, b'')
+        self.assertEqual(headers['Content-Type'], 'text/html')
+
+    def test_empty_json_records(self):
+        def records(result):
+            def handler():
+                response.content_type = 'application/json'
+                return result() if callable(result) else result
+            return handler
+        for result in ([], (lambda: iter(()))):
+            self.app = Sparrow()
+            status, headers, body = self.get(records(result))
+            self.assertEqual(body, b'[]')
+            self.assertEqual(headers['Content-Type'], 'application/json')
+
+    def test_no_content(self):
+        def handler():
+            response.status = 204
+            response.content_type = 'application/json'
+            return []
+        status, headers, body = self.get(handler)
+        self.assertEqual(status, '204 NO CONTENT')
+        self.assertEqual(body, b'')
+        self.assertNotIn('Content-Length', headers)
+
+    def test_head(self):
+        self.app.add_route('/x', lambda: 'body')
+        status, headers, body = call(self.app, '/x', 'HEAD')
+        self.assertEqual(body, b'')
+        self.assertEqual(headers['Content-Length'], '4')
+
+    def test_not_iterable(self):
+        self.app.catchall = True
+        status, headers, body = self.get(42)
+        self.assertEqual(status, '500 INTERNAL SERVER ERROR')
+
+
+if __name__ == '__main__':
+    unittest.main()
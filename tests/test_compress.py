@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of response compression.
+
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from response import response
+
+
+def call(app, path, method='GET', **environ):
+    environ.update({'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '',
+                    'wsgi.errors': io.StringIO(), 'HTTP_ACCEPT_ENCODING': 'gzip'})
+    status = []
+    out = app(environ, lambda s, h: status.append((s, dict(h))))
+    chunks = list(out)
+    if hasattr(out, 'close'):
+        out.close()
+    return status[0][0], status[0][1], chunks
+
+
+def gunzip(data):
+    return zlib.decompress(data, 31)
+
+
+class TestCompress(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow(compress=True)
+
+    def test_list_body(self):
+        self.app.add_route('/a', lambda: 'a' * 2000)
+        status, headers, chunks = call(self.app, '/a')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(headers['Content-Length']), len(chunks[0]))
+        self.assertEqual(gunzip(chunks[0]), b'a' * 2000)
+
+    def test_small_body(self):
+        self.app.add_route('/a', lambda: 'small')
+        status, headers, chunks = call(self.app, '/a')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(chunks, [b'small'])
+
+    def test_shared_etag(self):
+        def first():
+            response.header['ETag'] = '"same"'
+            return 'a' * 2000
+        def second():
+            response.header['ETag'] = '"same"'
+            return 'b' * 2000
+        self.app.add_route('/etag', first)
+        self.app.add_route('/etag2', second)
+        self.assertEqual(gunzip(call(self.app, '/etag')[2][0]), b'a' * 2000)
+        self.assertEqual(gunzip(call(self.app, '/etag2')[2][0]), b'b' * 2000)
+
+    def test_shared_etag_files(self):
+        root = tempfile.mkdtemp()
+        for name, char in (('a', b'a'), ('b', b'b')):
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(char * 2000)
+        def serve(name):
+            response.header['ETag'] = '"same"'
+            response.header['Content-Length'] = '2000'
+            return open(os.path.join(root, name), 'rb')
+        self.app.add_route('/files/:name', serve)
+        for _ in range(2):
+            for name in ('a', 'b'):
+                status, headers, chunks = call(self.app, '/files/' + name)
+                self.assertEqual(gunzip(b''.join(chunks)), name.encode() * 2000)
+
+    def test_generator_chunks_are_flushed(self):
+        def stream():
+            for i in range(3):
+                yield 'chunk %d ' % i * 100
+        self.app.add_route('/s', stream)
+        status, headers, chunks = call(self.app, '/s')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', headers)
+        decompressor = zlib.decompressobj(31)
+        for i, chunk in enumerate(chunks[:3]):
+            self.assertEqual(decompressor.decompress(chunk), b'chunk %d ' % i * 100)
+
+    def test_head_headers_match_get(self):
+        self.app.add_route('/a', lambda: 'a' * 2000)
+        get = call(self.app, '/a')
+        head = call(self.app, '/a', 'HEAD')
+        self.assertEqual(head[1], get[1])
+        self.assertEqual(head[2], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of error pages, error responses and the deduplicating error log.
+
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from errors import ErrorLog, error_page
+from utilities import abort, abort_response, redirect_response
+
+
+def call(app, path):
+    errors = io.StringIO()
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+               'wsgi.errors': errors}
+    status = []
+    body = b''.join(app(environ, lambda s, h: status.append((s, dict(h)))))
+    return status[0][0], status[0][1], body, errors.getvalue()
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+class TestErrorPage(unittest.TestCase):
+
+    def test_url_is_escaped(self):
+        page = error_page(404, 'Not found', '/<script>')
+        self.assertIn(b'/&lt;script&gt;', page)
+        self.assertIn(b'Error 404: Not Found', page)
+
+    def test_cached_parts_are_reused(self):
+        first = error_page(404, 'Not found', '/url-one')
+        second = error_page(404, 'Not found', '/url-two')
+        self.assertEqual(first.split(b'/url-one'), second.split(b'/url-two'))
+
+
+class TestErrorResponses(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow()
+
+    def test_not_found(self):
+        status, headers, body, errors = call(self.app, '/missing')
+        self.assertEqual(status, '404 NOT FOUND')
+        self.assertIn(b'/missing', body)
+
+    def test_abort(self):
+        self.app.add_route('/a', lambda: abort(403, 'No way.'))
+        status, headers, body, errors = call(self.app, '/a')
+        self.assertEqual(status, '403 FORBIDDEN')
+        self.assertIn(b'No way.', body)
+
+    def test_returned_error(self):
+        self.app.add_route('/a', lambda: abort_response(410, 'Gone for good.'))
+        status, headers, body, errors = call(self.app, '/a')
+        self.assertEqual(status, '410 GONE')
+        self.assertIn(b'Gone for good.', body)
+
+    def test_returned_redirect(self):
+        self.app.add_route('/a', lambda: redirect_response('/b'))
+        status, headers, body, errors = call(self.app, '/a')
+        self.assertEqual(status, '307 TEMPORARY REDIRECT')
+        self.assertEqual(headers['Location'], '/b')
+
+    def test_error_handler(self):
+        self.app.error_handler[404] = lambda e: 'custom'
+        status, headers, body, errors = call(self.app, '/missing')
+        self.assertEqual((status, body), ('404 NOT FOUND', b'custom'))
+
+    def test_internal_error_shows_current_message(self):
+        self.app.add_route('/fail/:message', fail)
+        call(self.app, '/fail/first')
+        status, headers, body, errors = call(self.app, '/fail/second')
+        self.assertEqual(status, '500 INTERNAL SERVER ERROR')
+        self.assertIn(b'ValueError: second', body)
+        self.assertNotIn(b'ValueError: first', body)
+
+
+class TestErrorLog(unittest.TestCase):
+
+    def raised(self, message):
+        try:
+            fail(message)
+        except ValueError as e:
+            return e
+
+    def test_repeats_are_counted(self):
+        log = ErrorLog(interval=60)
+        stream = io.StringIO()
+        for i in range(3):
+            log.report(self.raised('x'), stream)
+        self.assertEqual(stream.getvalue().count('Unhandled Exception'), 1)
+        log.entries.get(log.signature(self.raised('x')))[1] = 0
+        log.report(self.raised('x'), stream)
+        self.assertIn('(2 more like it since the last report)', stream.getvalue())
+
+    def test_message_is_current(self):
+        log = ErrorLog(interval=0)
+        stream = io.StringIO()
+        first = log.report(self.raised('first'), stream)
+        second = log.report(self.raised('second'), stream)
+        self.assertIn('ValueError: first', first)
+        self.assertIn('ValueError: second', second)
+        self.assertNotIn('first', second)
+        self.assertIn('ValueError: second', stream.getvalue().split('Unhandled')[-1])
+
+    def test_suppressed_repeat_returns_current_message(self):
+        log = ErrorLog(interval=60)
+        stream = io.StringIO()
+        log.report(self.raised('first'), stream)
+        text = log.report(self.raised('second'), stream)
+        self.assertIn('ValueError: second', text)
+        self.assertIn("in fail", text)
+
+    def test_different_paths(self):
+        log = ErrorLog(interval=60)
+        stream = io.StringIO()
+        log.report(self.raised('x'), stream)
+        try:
+            int('x')
+        except ValueError as e:
+            log.report(e, stream)
+        self.assertEqual(stream.getvalue().count('Unhandled Exception'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
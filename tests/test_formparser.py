@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental form parsers.
+
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from formparser import BodyReader, iter_multipart, iter_urlencoded
+from sparrow_exceptions import HTTPError
+
+BOUNDARY = 'xYzZY'
+
+
+def reader(body, chunk_size=65536):
+    return BodyReader(io.BytesIO(body), len(body), chunk_size)
+
+
+def multipart(*fields):
+    """ Builds a multipart body from (name, value) or (name, filename, value). """
+    out = []
+    for field in fields:
+        out.append(b'--' + BOUNDARY.encode() + b'\r\n')
+        if len(field) == 3:
+            name, filename, value = field
+            out.append(('Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                        'Content-Type: application/octet-stream\r\n\r\n'
+                        % (name, filename)).encode())
+        else:
+            name, value = field
+            out.append(('Content-Disposition: form-data; name="%s"\r\n\r\n' % name).encode())
+        out.append(value + b'\r\n')
+    out.append(b'--' + BOUNDARY.encode() + b'--\r\n')
+    return b''.join(out)
+
+
+class TestUrlencoded(unittest.TestCase):
+
+    def parse(self, body, **kargs):
+        chunk_size = kargs.pop('chunk_size', 65536)
+        return [(p.name, p.value) for p in
+                iter_urlencoded(reader(body, chunk_size), **kargs)]
+
+    def test_pairs(self):
+        self.assertEqual(self.parse(b'a=1&b=x+y&c=%C3%A4&&d'),
+                         [('a', '1'), ('b', 'x y'), ('c', u'ä'), ('d', '')])
+
+    def test_empty(self):
+        self.assertEqual(self.parse(b''), [])
+
+    def test_split_across_chunks(self):
+        body = b'first=' + b'a' * 100 + b'&second=b%20c&third=3'
+        for chunk_size in (1, 2, 7, 64):
+            self.assertEqual(self.parse(body, chunk_size=chunk_size),
+                             [('first', 'a' * 100), ('second', 'b c'), ('third', '3')])
+
+    def test_max_part_size(self):
+        self.assertEqual(self.parse(b'a=12345&b=1', max_part_size=7),
+                         [('a', '12345'), ('b', '1')])
+
+    def test_large_pair_in_one_chunk(self):
+        with self.assertRaises(HTTPError) as e:
+            self.parse(b'a=' + b'x' * 100 + b'&b=1', max_part_size=10)
+        self.assertEqual(e.exception.http_status, 413)
+
+    def test_large_pending_pair(self):
+        with self.assertRaises(HTTPError) as e:
+            self.parse(b'a=' + b'x' * 100, max_part_size=10, chunk_size=16)
+        self.assertEqual(e.exception.http_status, 413)
+
+    def test_large_last_pair(self):
+        with self.assertRaises(HTTPError) as e:
+            self.parse(b'b=1&a=' + b'x' * 100, max_part_size=10)
+        self.assertEqual(e.exception.http_status, 413)
+
+
+class TestMultipart(unittest.TestCase):
+
+    def parse(self, body, chunk_size=65536, **kargs):
+        return list(iter_multipart(reader(body, chunk_size), BOUNDARY, **kargs))
+
+    def test_fields_and_files(self):
+        body = multipart(('a', b'1'), ('b', u'ä'.encode('utf8')),
+                         ('upload', 'x.bin', b'\x00\r\n--xY\xff'))
+        parts = self.parse(body)
+        self.assertEqual([p.name for p in parts], ['a', 'b', 'upload'])
+        self.assertEqual(parts[0].value, '1')
+        self.assertEqual(parts[1].value, u'ä')
+        self.assertEqual(parts[2].filename, 'x.bin')
+        self.assertEqual(parts[2].content_type, 'application/octet-stream')
+        self.assertEqual(parts[2].file.read(), b'\x00\r\n--xY\xff')
+        self.assertEqual(parts[2].size, 8)
+
+    def test_split_across_chunks(self):
+        body = b'preamble\r\n' + multipart(('a', b'x' * 50), ('f', 'f.txt', b'y' * 50))
+        for chunk_size in (1, 3, 16, 1024):
+            parts = self.parse(body, chunk_size)
+            self.assertEqual([(p.name, p.value) for p in parts],
+                             [('a', 'x' * 50), ('f', b'y' * 50)])
+
+    def test_spooled_to_disk(self):
+        parts = self.parse(multipart(('f', 'big', b'z' * 5000)), spool_threshold=1024)
+        self.assertTrue(parts[0].file._rolled)
+        self.assertEqual(parts[0].value, b'z' * 5000)
+
+    def test_max_part_size(self):
+        for chunk_size in (16, 65536):
+            with self.assertRaises(HTTPError) as e:
+                self.parse(multipart(('a', b'1'), ('f', 'big', b'z' * 500)),
+                           chunk_size, max_part_size=100)
+            self.assertEqual(e.exception.http_status, 413)
+
+    def test_max_header_size(self):
+        body = multipart(('a' * 1000, b'1'))
+        with self.assertRaises(HTTPError) as e:
+            self.parse(body, 64, max_header_size=256)
+        self.assertEqual(e.exception.http_status, 413)
+
+    def test_truncated(self):
+        body = multipart(('a', b'1'), ('b', b'2'))
+        for cut in (5, 40, len(body) - 20):
+            with self.assertRaises(HTTPError) as e:
+                self.parse(body[:cut])
+            self.assertEqual(e.exception.http_status, 400)
+
+    def test_no_name(self):
+        body = (b'--' + BOUNDARY.encode() + b'\r\nContent-Disposition: form-data\r\n\r\n'
+                b'1\r\n--' + BOUNDARY.encode() + b'--\r\n')
+        with self.assertRaises(HTTPError) as e:
+            self.parse(body)
+        self.assertEqual(e.exception.http_status, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
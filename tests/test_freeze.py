@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of Sparrow.freeze() and the per-route options it must keep.
+
+    python -m pytest tests
+"""
+import gc
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from template import TEMPLATES
+
+
+def call(app, path, method='GET'):
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '',
+               'wsgi.errors': io.StringIO()}
+    status = []
+    body = b''.join(app(environ, lambda s, h: status.append((s, dict(h)))))
+    return status[0][0], status[0][1], body
+
+
+class TestFreeze(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(gc.unfreeze)
+        self.calls = 0
+
+    def app(self, **kargs):
+        app = Sparrow(**kargs)
+        app.add_route('/static', lambda: 'static')
+        app.add_route('/user/:id#int', lambda id: 'user %d' % id)
+        app.add_route('/page/:name', lambda name: 'page ' + name,
+                      headers={'Cache-Control': 'no-store'})
+        return app
+
+    def test_frozen_app_serves(self):
+        for router in ('scan', 'regex', 'trie'):
+            app = self.app(router=router).freeze()
+            self.assertEqual(call(app, '/static')[2], b'static', router)
+            self.assertEqual(call(app, '/user/7')[2], b'user 7', router)
+            self.assertEqual(call(app, '/user/x')[0], '404 NOT FOUND', router)
+            self.assertEqual(call(app, '/page/a')[1]['Cache-Control'], 'no-store', router)
+
+    def test_tables_are_read_only(self):
+        app = self.app().freeze()
+        with self.assertRaises(TypeError):
+            app.simple_routes['GET']['other'] = None
+        with self.assertRaises(TypeError):
+            app.error_handler[404] = None
+        self.assertIsInstance(app.routes, tuple)
+
+    def test_changes_are_rejected(self):
+        app = self.app().freeze()
+        handler = lambda: 'late'
+        for change in (lambda: app.add_route('/late', handler),
+                       lambda: app.set_default(handler),
+                       lambda: app.set_error_handler(404, handler),
+                       lambda: app.cache(60)(handler)):
+            self.assertRaises(RuntimeError, change)
+        self.assertEqual(call(app, '/late')[0], '404 NOT FOUND')
+
+    def test_route_cache_is_cleared(self):
+        app = self.app(route_cache=16)
+        app.match_route('/user/1')
+        app.freeze()
+        self.assertEqual(len(app.route_cache), 0)
+        self.assertEqual(call(app, '/user/1')[2], b'user 1')
+
+    def test_response_cache(self):
+        def handler():
+            self.calls += 1
+            return 'cached'
+        app = self.app()
+        app.add_route('/c', handler, cache=60)
+        app.freeze()
+        call(app, '/c')
+        call(app, '/c')
+        self.assertEqual(self.calls, 1)
+
+    def test_templates(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = os.path.join(root, 'frozen_page.tpl')
+        with open(path, 'w') as f:
+            f.write('page {{x}}')
+        self.addCleanup(TEMPLATES.clear)
+        self.app().freeze(templates=root)
+        os.remove(path) # served from the registry
+        tpl = TEMPLATES.get('frozen_page')
+        self.assertIsNotNone(tpl)
+        self.assertEqual(''.join(tpl.render(x=1)), 'page 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the response cache, ETags and 304 responses.
+
+    python -m pytest tests
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from cache import FileStore
+from request import request
+from response import response
+from utilities import send_file
+
+
+def call(app, path, method='GET', query='', **environ):
+    environ.update({'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query,
+                    'wsgi.errors': io.StringIO()})
+    status = []
+    body = b''.join(app(environ, lambda s, h: status.append((s, dict(h)))))
+    return status[0][0], status[0][1], body
+
+
+class Counter(object):
+    """ A handler that returns how often it was called. """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, **args):
+        self.calls += 1
+        return 'call %d' % self.calls
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow()
+        self.handler = Counter()
+
+    def test_hit(self):
+        self.app.add_route('/c', self.handler, cache=60)
+        first = call(self.app, '/c')
+        second = call(self.app, '/c')
+        self.assertEqual(first, second)
+        self.assertEqual(self.handler.calls, 1)
+        self.assertTrue(first[1]['Etag'].startswith('"'))
+
+    def test_not_modified(self):
+        self.app.add_route('/c', self.handler, cache=60)
+        etag = call(self.app, '/c')[1]['Etag']
+        for _ in range(2): # on save and on lookup
+            status, headers, body = call(self.app, '/c', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(status, '304 NOT MODIFIED')
+            self.assertEqual(body, b'')
+            self.assertNotIn('Content-Length', headers)
+
+    def test_route_option_covers_one_route(self):
+        self.app.add_route('/c', self.handler, cache=60)
+        self.app.add_route('/d', self.handler)
+        call(self.app, '/d')
+        call(self.app, '/d')
+        self.assertEqual(self.handler.calls, 2)
+        self.assertNotIn('Etag', call(self.app, '/d')[1])
+
+    def test_decorator_covers_every_route(self):
+        self.app.add_route('/c', self.handler)
+        self.app.cache(60)(self.handler)
+        self.app.add_route('/d', self.handler)
+        for path in ('/c', '/c', '/d', '/d'):
+            call(self.app, path)
+        self.assertEqual(self.handler.calls, 2)
+
+    def test_query_params(self):
+        self.app.add_route('/c', self.handler, cache={'params': ['page']})
+        call(self.app, '/c', query='page=1&x=1')
+        call(self.app, '/c', query='page=1&x=2')
+        call(self.app, '/c', query='page=2')
+        self.assertEqual(self.handler.calls, 2)
+
+    def test_vary(self):
+        self.app.add_route('/c', self.handler, cache={'vary': ['Accept-Language']})
+        call(self.app, '/c', HTTP_ACCEPT_LANGUAGE='de')
+        call(self.app, '/c', HTTP_ACCEPT_LANGUAGE='de')
+        headers = call(self.app, '/c', HTTP_ACCEPT_LANGUAGE='fr')[1]
+        self.assertEqual(self.handler.calls, 2)
+        self.assertEqual(headers['Vary'], 'Accept-Language')
+
+    def test_head_and_get_are_separate(self):
+        def handler():
+            return request.method.lower()
+        self.app.add_route('/c', handler, cache=60)
+        head = call(self.app, '/c', 'HEAD')
+        status, headers, body = call(self.app, '/c')
+        self.assertEqual(body, b'get')
+        self.assertEqual(head[1]['Content-Length'], '4')
+
+    def test_cookies_are_not_cached(self):
+        def handler():
+            self.handler.calls += 1
+            response.set_cookie('session', 'secret')
+            return 'private'
+        self.app.add_route('/c', handler, cache=60)
+        call(self.app, '/c')
+        call(self.app, '/c')
+        self.assertEqual(self.handler.calls, 2)
+
+    def test_errors_are_not_cached(self):
+        def handler():
+            self.handler.calls += 1
+            response.status = 500
+            return 'broken'
+        self.app.add_route('/c', handler, cache=60)
+        call(self.app, '/c')
+        call(self.app, '/c')
+        self.assertEqual(self.handler.calls, 2)
+
+    def test_file_store(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.app.add_route('/c', self.handler, cache={'ttl': 60, 'store': FileStore(root)})
+        other = Sparrow()
+        other.add_route('/c', Counter(), cache={'ttl': 60, 'store': FileStore(root)})
+        self.assertEqual(call(self.app, '/c')[2], b'call 1')
+        self.assertEqual(call(other, '/c')[2], b'call 1')
+
+
+class TestSendFile(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        with open(os.path.join(self.root, 'a.txt'), 'wb') as f:
+            f.write(b'0123456789')
+        self.app = Sparrow()
+        self.app.add_route('/files/:name', lambda name: send_file(name, self.root))
+
+    def test_send(self):
+        status, headers, body = call(self.app, '/files/a.txt')
+        self.assertEqual(body, b'0123456789')
+        self.assertEqual(headers['Content-Length'], '10')
+        self.assertEqual(headers['Content-Type'], 'text/plain')
+
+    def test_not_modified(self):
+        etag = call(self.app, '/files/a.txt')[1]['Etag']
+        status, headers, body = call(self.app, '/files/a.txt', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status, '304 NOT MODIFIED')
+        self.assertEqual(body, b'')
+        self.assertNotIn('Content-Length', headers)
+
+    def test_range(self):
+        status, headers, body = call(self.app, '/files/a.txt', HTTP_RANGE='bytes=2-4')
+        self.assertEqual(status, '206 PARTIAL CONTENT')
+        self.assertEqual(body, b'234')
+        self.assertEqual(headers['Content-Range'], 'bytes 2-4/10')
+
+    def test_unsatisfiable_range(self):
+        status, headers, body = call(self.app, '/files/a.txt', HTTP_RANGE='bytes=20-30')
+        self.assertEqual(status, '416 REQUESTED RANGE NOT SATISFIABLE')
+
+    def test_outside_root(self):
+        status, headers, body = call(self.app, '/files/..%2f..%2fetc%2fpasswd')
+        self.assertIn(status[:3], ('401', '404'))
+
+
+if __name__ == '__main__':
+    unittest.main()
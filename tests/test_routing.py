@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the routers, route converters and Sparrow's route table.
+
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from routing import CONVERTERS, RegexpRouter, ScanRouter, TrieRouter, register_converter
+
+
+def call(app, path, method='GET'):
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '',
+               'wsgi.errors': io.StringIO()}
+    status = []
+    body = b''.join(app(environ, lambda s, h: status.append((s, dict(h)))))
+    return status[0][0], status[0][1], body
+
+
+class RouterCase(object):
+    """ Tests every router must pass; subclasses set router. """
+    router = None
+
+    def setUp(self):
+        self.r = self.router()
+
+    def add(self, *routes):
+        for route in routes:
+            self.r.add('GET', route, route)
+
+    def test_wildcards(self):
+        self.add('user/:name', 'user/:name/posts', 'user/:name/:post')
+        self.assertEqual(self.r.match('user/ann', 'GET'), ('user/:name', {'name': 'ann'}))
+        self.assertEqual(self.r.match('user/ann/posts', 'GET'),
+                         ('user/:name/posts', {'name': 'ann'}))
+        self.assertEqual(self.r.match('user/ann/7', 'GET'),
+                         ('user/:name/:post', {'name': 'ann', 'post': '7'}))
+        self.assertEqual(self.r.match('user/', 'GET'), (None, None))
+        self.assertEqual(self.r.match('user/ann', 'POST'), (None, None))
+
+    def test_custom_expression(self):
+        self.add('files/:path#.+#', 'year/:y#[0-9]{4}#')
+        self.assertEqual(self.r.match('files/a/b.txt', 'GET'),
+                         ('files/:path#.+#', {'path': 'a/b.txt'}))
+        self.assertEqual(self.r.match('year/2024', 'GET')[1], {'y': '2024'})
+        self.assertEqual(self.r.match('year/24', 'GET'), (None, None))
+
+    def test_converters(self):
+        self.add('int/:v#int', 'float/:v#float', 'uuid/:v#uuid', 'path/:v#path')
+        self.assertEqual(self.r.match('int/-12', 'GET')[1], {'v': -12})
+        self.assertEqual(self.r.match('float/1.5', 'GET')[1], {'v': 1.5})
+        value = uuid.uuid4()
+        self.assertEqual(self.r.match('uuid/%s' % value, 'GET')[1], {'v': value})
+        self.assertEqual(self.r.match('path/a/b', 'GET')[1], {'v': 'a/b'})
+        self.assertEqual(self.r.match('int/x', 'GET'), (None, None))
+        self.assertEqual(self.r.match('uuid/1234', 'GET'), (None, None))
+
+    def test_typed_before_wildcard(self):
+        self.add('item/:id#int', 'item/:slug')
+        self.assertEqual(self.r.match('item/3', 'GET'), ('item/:id#int', {'id': 3}))
+        self.assertEqual(self.r.match('item/three', 'GET'), ('item/:slug', {'slug': 'three'}))
+
+    def test_rejected_value_falls_back(self):
+        def even(value):
+            if int(value) % 2:
+                raise ValueError(value)
+            return int(value)
+        self.addCleanup(CONVERTERS.pop, 'even')
+        register_converter('even', r'[0-9]+', even)
+        self.add('n/:v#even', 'n/:v')
+        self.assertEqual(self.r.match('n/4', 'GET'), ('n/:v#even', {'v': 4}))
+        self.assertEqual(self.r.match('n/5', 'GET'), ('n/:v', {'v': '5'}))
+
+    def test_many_routes(self):
+        routes = ['r%d/:a/:b' % i for i in range(200)] + ['last/:v#int']
+        self.add(*routes)
+        for i in (0, 31, 32, 199):
+            self.assertEqual(self.r.match('r%d/x/y' % i, 'GET'),
+                             ('r%d/:a/:b' % i, {'a': 'x', 'b': 'y'}))
+        self.assertEqual(self.r.match('last/9', 'GET'), ('last/:v#int', {'v': 9}))
+
+    def test_freeze(self):
+        self.add('a/:x')
+        self.r.freeze()
+        self.assertEqual(self.r.match('a/1', 'GET'), ('a/:x', {'x': '1'}))
+
+
+class TestScanRouter(RouterCase, unittest.TestCase):
+    router = ScanRouter
+
+
+class TestRegexpRouter(RouterCase, unittest.TestCase):
+    router = RegexpRouter
+
+    def test_rejected_value_in_later_chunk(self):
+        self.r.chunk_groups = 4
+        self.add('n/:v#int', *['p%d/:v' % i for i in range(10)])
+        self.add('n/:v')
+        self.assertEqual(self.r.match('n/x', 'GET'), ('n/:v', {'v': 'x'}))
+
+    def test_add_after_match(self):
+        self.add('a/:x')
+        self.r.match('a/1', 'GET')
+        self.add('b/:x')
+        self.assertEqual(self.r.match('b/1', 'GET'), ('b/:x', {'x': '1'}))
+
+
+class TestTrieRouter(RouterCase, unittest.TestCase):
+    router = TrieRouter
+
+    def test_backtracking(self):
+        self.add('a/:x/c', 'a/b/d')
+        self.assertEqual(self.r.match('a/b/c', 'GET'), ('a/:x/c', {'x': 'b'}))
+
+
+class TestSparrowRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow()
+
+    def test_static_and_dynamic(self):
+        self.app.add_route('/hello', lambda: 'static')
+        self.app.add_route('/hello/:name', lambda name: 'hello ' + name)
+        self.assertEqual(call(self.app, '/hello')[2], b'static')
+        self.assertEqual(call(self.app, '/hello/you')[2], b'hello you')
+
+    def test_converted_args(self):
+        self.app.add_route('/n/:v#int', lambda v: repr(v + 1))
+        self.assertEqual(call(self.app, '/n/41')[2], b'42')
+        self.assertEqual(call(self.app, '/n/x')[0], '404 NOT FOUND')
+
+    def test_head_falls_back_to_get(self):
+        self.app.add_route('/a/:x', lambda x: x)
+        status, headers, body = call(self.app, '/a/abc', 'HEAD')
+        self.assertEqual((status, body), ('200 OK', b''))
+        self.assertEqual(headers['Content-Length'], '3')
+
+    def test_routes_of_one_handler(self):
+        handler = lambda **args: 'ok'
+        self.app.add_route('/a', handler)
+        self.app.add_route('/b/:x', handler, method='POST', headers={'X-B': '1'})
+        a, b = self.app.routes
+        self.assertEqual((a.method, a.label, a.handler), ('GET', '/a', handler))
+        self.assertEqual((b.method, b.label, b.handler), ('POST', '/b/:x', handler))
+        self.assertIsNone(a.headers)
+        self.assertNotIn('X-B', call(self.app, '/a')[1])
+        self.assertEqual(call(self.app, '/b/1', 'POST')[1]['X-B'], '1')
+
+    def test_match_route(self):
+        self.app.add_route('/a/:x', lambda x: x)
+        route, args = self.app.match_route('/a/1')
+        self.assertEqual((route.label, args), ('/a/:x', {'x': '1'}))
+        handler, args = self.app.match_url('/a/1')
+        self.assertIs(handler, route.handler)
+        self.assertEqual(self.app.match_url('/b'), (None, None))
+
+    def test_route_cache(self):
+        app = Sparrow(route_cache=16)
+        app.add_route('/a/:x', lambda x: 'a')
+        self.assertEqual(app.match_route('/a/1')[1], {'x': '1'})
+        self.assertIs(app.match_route('/a/1'), app.match_route('/a/1'))
+        app.add_route('/a/1', lambda: 'static')
+        self.assertEqual(call(app, '/a/1')[2], b'static')
+
+    def test_routers_agree(self):
+        for router in ('scan', 'regex', 'trie'):
+            app = Sparrow(router=router)
+            app.add_route('/u/:id#int', lambda id: 'int %d' % id)
+            app.add_route('/u/:name', lambda name: 'name ' + name)
+            self.assertEqual(call(app, '/u/3')[2], b'int 3', router)
+            self.assertEqual(call(app, '/u/x')[2], b'name x', router)
+
+
+if __name__ == '__main__':
+    unittest.main()
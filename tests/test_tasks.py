@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of deferred tasks: TaskExecutor, call_on_close and response.defer().
+
+    python -m pytest tests
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from sparrow import Sparrow
+from response import response
+from static import FileWrapper
+from tasks import ClosingIterator, TaskExecutor, call_on_close
+from utilities import send_file
+
+
+class TestTaskExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = TaskExecutor(max_workers=1, max_pending=1)
+        self.addCleanup(self.executor.shutdown)
+        self.errors = []
+
+    def test_tasks_run_in_order(self):
+        done = []
+        tasks = [(done.append, (i,), {}) for i in range(5)]
+        self.assertTrue(self.executor.submit(tasks, self.errors.append))
+        self.executor.shutdown()
+        self.assertEqual(done, [0, 1, 2, 3, 4])
+        self.assertEqual(self.executor.submitted, 1)
+
+    def test_errors_are_reported(self):
+        done = []
+        tasks = [(int, ('x',), {}), (done.append, ('after',), {})]
+        self.executor.submit(tasks, self.errors.append)
+        self.executor.shutdown()
+        self.assertEqual(done, ['after'])
+        self.assertIsInstance(self.errors[0], ValueError)
+        self.assertEqual(self.executor.failed, 1)
+
+    def test_full_queue_runs_inline(self):
+        release = threading.Event()
+        done = []
+        self.executor.submit([(release.wait, (), {})], self.errors.append)
+        self.assertFalse(self.executor.submit([(done.append, (1,), {})], self.errors.append))
+        self.assertEqual(done, [1])
+        self.assertEqual(self.executor.ran_inline, 1)
+        self.assertFalse(self.executor.submit([(done.append, (2,), {})], self.errors.append,
+                                              inline=False))
+        self.assertEqual(done, [1])
+        release.set()
+
+    def test_closed(self):
+        self.executor.shutdown()
+        done = []
+        self.assertFalse(self.executor.submit([(done.append, (1,), {})], self.errors.append))
+        self.assertEqual(done, [1])
+
+
+class TestCallOnClose(unittest.TestCase):
+
+    def test_iterable(self):
+        closed = []
+        body = call_on_close([b'a', b'b'], lambda: closed.append(True))
+        self.assertIsInstance(body, ClosingIterator)
+        self.assertEqual(b''.join(body), b'ab')
+        self.assertEqual(closed, [])
+        body.close()
+        self.assertEqual(closed, [True])
+
+    def test_inner_close_first(self):
+        calls = []
+        class Body(list):
+            def close(self):
+                calls.append('body')
+        body = call_on_close(Body([b'a']), lambda: calls.append('callback'))
+        body.close()
+        self.assertEqual(calls, ['body', 'callback'])
+
+    def test_file_wrapper_keeps_its_type(self):
+        calls = []
+        wrapper = FileWrapper(io.BytesIO(b'data'))
+        body = call_on_close(wrapper, lambda: calls.append('callback'))
+        self.assertIs(body, wrapper)
+        body.close()
+        self.assertEqual(calls, ['callback'])
+
+
+class TestDefer(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Sparrow()
+        self.done = []
+
+    def call(self, path):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+                   'wsgi.errors': io.StringIO()}
+        out = self.app(environ, lambda s, h: None)
+        body = b''.join(out)
+        self.assertEqual(self.done, [])
+        out.close()
+        self.app.shutdown()
+        return out, body
+
+    def test_after_close(self):
+        def handler():
+            response.defer(self.done.append, 'task')
+            return 'ok'
+        self.app.add_route('/a', handler)
+        out, body = self.call('/a')
+        self.assertEqual((body, self.done), (b'ok', ['task']))
+
+    def test_send_file(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with open(os.path.join(root, 'a.txt'), 'wb') as f:
+            f.write(b'data')
+        def handler():
+            response.defer(self.done.append, 'task')
+            return send_file('a.txt', root)
+        self.app.add_route('/a', handler)
+        out, body = self.call('/a')
+        self.assertIsInstance(out, FileWrapper)
+        self.assertEqual((body, self.done), (b'data', ['task']))
+
+    def test_task_errors_are_logged(self):
+        def handler():
+            response.defer(int, 'x')
+            response.defer(self.done.append, 'after')
+            return 'ok'
+        self.app.add_route('/a', handler)
+        stderr, sys.stderr = sys.stderr, io.StringIO()
+        try:
+            self.call('/a')
+            log = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(self.done, ['after'])
+        self.assertIn('ValueError', log)
+
+
+if __name__ == '__main__':
+    unittest.main()
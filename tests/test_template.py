@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of SimpleTemplate, its bytecode cache and the template registry.
+
+    python -m pytest tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sparrow'))
+
+from template import BytecodeCache, SimpleTemplate, TemplateRegistry
+
+PAGE = """<ul>
+%for item in items:
+  <li>{{item}} {{'%d' % (2 * 3)}}</li>
+%end
+</ul>
+"""
+
+
+class TemplateCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, text):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+
+class TestSimpleTemplate(TemplateCase):
+
+    def test_render(self):
+        out = ''.join(SimpleTemplate(PAGE).render(items=['a', 'b']))
+        self.assertEqual(out, '<ul>\n  <li>a 6</li>\n  <li>b 6</li>\n</ul>\n')
+
+    def test_optimize_keeps_output(self):
+        class Plain(SimpleTemplate):
+            optimize = False
+        for items in ([], ['a'], ['x', 'y', 'z']):
+            self.assertEqual(''.join(SimpleTemplate(PAGE).render(items=items)),
+                             ''.join(Plain(PAGE).render(items=items)))
+
+    def test_stream(self):
+        tpl = SimpleTemplate(PAGE)
+        items = [str(i) for i in range(500)]
+        chunks = list(tpl.stream(bufsize=256, items=items))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), ''.join(tpl.render(items=items)))
+
+    def test_include(self):
+        part = self.write('part.tpl', 'part {{x}}\n')
+        page = SimpleTemplate('head\n%%include %s x=1\ntail\n' % part)
+        self.assertEqual(''.join(page.render()), 'head\npart 1\ntail\n')
+
+    def test_bytecode_cache(self):
+        cache = BytecodeCache(os.path.join(self.root, 'cache'))
+        class Cached(SimpleTemplate):
+            bytecode_cache = cache
+        path = self.write('page.tpl', PAGE)
+        first = ''.join(Cached(filename=path).render(items=['a']))
+        self.assertEqual(len(os.listdir(cache.directory)), 1)
+        self.assertEqual(''.join(Cached(filename=path).render(items=['a'])), first)
+        self.write('page.tpl', PAGE.replace('<ul>', '<ol>'))
+        os.utime(path, ns=(1, 1))
+        self.assertIn('<ol>', ''.join(Cached(filename=path).render(items=['a'])))
+
+
+class TestTemplateRegistry(TemplateCase):
+
+    def registry(self, **kargs):
+        return TemplateRegistry([self.root], **kargs)
+
+    def test_search(self):
+        self.write('page.tpl', 'page')
+        registry = self.registry()
+        self.assertEqual(''.join(registry.get('page').render()), 'page')
+        self.assertIs(registry.get('page'), registry.get('page'))
+        self.assertEqual(''.join(registry.get('page.tpl').render()), 'page')
+        self.assertIsNone(registry.get('missing'))
+
+    def test_inline_templates_are_bounded(self):
+        registry = self.registry(maxsize=4)
+        for i in range(10):
+            registry.get('{{%d}}' % i)
+        self.assertLessEqual(len(registry.cache), 4)
+
+    def test_reload(self):
+        path = self.write('page.tpl', 'one')
+        registry = self.registry(check_interval=0)
+        self.assertEqual(''.join(registry.get('page').render()), 'one')
+        self.write('page.tpl', 'two!')
+        self.assertEqual(''.join(registry.get('page').render()), 'two!')
+
+    def test_no_reload_without_interval(self):
+        self.write('page.tpl', 'one')
+        registry = self.registry()
+        registry.get('page')
+        self.write('page.tpl', 'two!')
+        self.assertEqual(''.join(registry.get('page').render()), 'one')
+
+    def test_reload_include(self):
+        part = self.write('part.tpl', 'one')
+        inner = self.write('inner.tpl', '%%include %s\n' % part)
+        self.write('page.tpl', 'page:\n%%include %s\n' % inner)
+        registry = self.registry(check_interval=0)
+        self.assertEqual(''.join(registry.get('page').render()), 'page:\none')
+        self.write('part.tpl', 'two!')
+        self.assertEqual(''.join(registry.get('page').render()), 'page:\ntwo!')
+
+    def test_reload_include_of_inline_template(self):
+        part = self.write('part.tpl', 'one')
+        source = '%%include %s\n' % part
+        registry = self.registry(check_interval=0)
+        self.assertEqual(''.join(registry.get(source).render()), 'one')
+        self.write('part.tpl', 'two!')
+        self.assertEqual(''.join(registry.get(source).render()), 'two!')
+
+    def test_precompile(self):
+        os.mkdir(os.path.join(self.root, 'sub'))
+        self.write('a.tpl', 'a')
+        self.write(os.path.join('sub', 'b.html'), 'b')
+        self.write('skip.txt', 'x')
+        registry = TemplateRegistry([])
+        self.assertEqual(registry.precompile(self.root), 2)
+        self.assertEqual(''.join(registry.get('a').render()), 'a')
+        self.assertEqual(''.join(registry.get(os.path.join('sub', 'b.html')).render()), 'b')
+
+
+if __name__ == '__main__':
+    unittest.main()